@@ -9,10 +9,16 @@ Principios Storytelling with Data (SWD) de Cole Nussbaumer Knaflic:
 """
 import streamlit as st
 import pandas as pd
-import json
 import plotly.graph_objects as go
 import plotly.express as px
-from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+from json_codec import decode_json
+
+logger = logging.getLogger(__name__)
 
 # Paleta institucional
 AZUL_OSCURO = "#1F3864"
@@ -98,40 +104,130 @@ def _clean_layout(fig, title, subtitle=""):
     return fig
 
 
-def load_evaluaciones_df(est_filter=None):
-    """Carga el DataFrame de evaluaciones con caché inteligente de datos crudos + filtrado dinámico RBAC + filtro establecimiento."""
-    # 1. Intentar obtener datos crudos del caché (5 min)
-    raw_df = None
-    if 'raw_analytics_df' in st.session_state and 'raw_df_ts' in st.session_state:
-        age_min = (datetime.now() - st.session_state['raw_df_ts']).seconds / 60
-        if age_min < 5:
-            raw_df = st.session_state['raw_analytics_df']
+# Columnas que los filtros RBAC / establecimiento necesitan en cualquier lectura proyectada
+FILTER_COLUMNS = ["Sector", "Programa/Unidad", "Establecimiento", "Establecimiento Base"]
+SEARCH_COLUMNS = ["ID Evaluación", "Familia", "Dirección", "Grupo Familiar JSON"]
+EVAL_TOPIC = "Evaluaciones"
+
+
+class EvaluacionesSnapshot:
+    """
+    Foto inmutable de la hoja 'Evaluaciones', compartida por todas las sesiones del proceso.
+    Nunca se modifica en sitio: los filtros RBAC / establecimiento se resuelven con máscaras
+    cacheadas por foto y quien necesite transformar columnas trabaja sobre una copia.
+    """
+
+    def __init__(self, df, version):
+        self.df = df
+        self.version = version
+        self.loaded_at = time.time()
+        self._masks = {}
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def is_fresh(self, version):
+        return self.version == version
+
+    def mask(self, col, value, contains=False):
+        """Máscara booleana (cacheada) de col normalizada (strip + lower) == value, o que contenga value."""
+        key = (col, value, contains)
+        with self._lock:
+            found = self._masks.get(key)
+        if found is None:
+            norm = self.df[col].astype(str).str.strip().str.lower()
+            found = norm.str.contains(value) if contains else norm == value
+            with self._lock:
+                self._masks[key] = found
+        return found
+
+    def derived(self, name, builder):
+        """Estructura calculada una vez por foto con builder(df) (p. ej. índice de búsqueda)."""
+        with self._lock:
+            found = self._derived.get(name)
+        if found is None:
+            found = builder(self.df)
+            with self._lock:
+                found = self._derived.setdefault(name, found)
+        return found
+
+
+@st.cache_resource(show_spinner=False)
+def _snapshot_store():
+    """Fotos por proceso: {None: completa, (columnas,): proyectada}."""
+    return {"snapshots": {}, "lock": threading.Lock()}
+
+
+def invalidate_evaluaciones_cache():
+    """
+    Publica en el bus de versiones que 'Evaluaciones' cambió: la próxima lectura de cualquier
+    sesión (y de otras réplicas si el bus es compartido) recarga la foto. Retorna la nueva versión.
+    """
+    from data_version import notify_change
+    version = notify_change(EVAL_TOPIC)
+    store = _snapshot_store()
+    with store["lock"]:
+        store["snapshots"].clear()
+    return version
 
-    # 2. Si no hay caché o expiró, cargar de Google Sheets
-    if raw_df is None:
-        try:
-            import gspread
-            from oauth2client.service_account import ServiceAccountCredentials
-            secrets = st.secrets["gcp_service_account"]
-            creds_dict = {k: secrets[k] for k in secrets}
-            scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-            client = gspread.authorize(creds)
-            SHEET_URL = "https://docs.google.com/spreadsheets/d/1JjYw2W6c-N2swGPuIHbz0CU7aDhh1pA-6VH1WuXV41w/edit"
-            sh = client.open_by_url(SHEET_URL)
-            data = sh.worksheet("Evaluaciones").get_all_values()
-            if len(data) > 1:
-                raw_df = pd.DataFrame(data[1:], columns=data[0])
-                st.session_state['raw_analytics_df'] = raw_df
-                st.session_state['raw_df_ts'] = datetime.now()
-            else:
-                return pd.DataFrame()
-        except Exception as e:
-            st.error(f"Error cargando datos: {e}")
-            return pd.DataFrame()
 
-    # 3. APLICAR FILTRO RBAC SIEMPRE (Dinámico por Sesión Actual)
-    df = raw_df.copy()
+def get_evaluaciones_snapshot(columns=None):
+    """
+    Foto vigente de 'Evaluaciones' (completa, o solo `columns` si se indican).
+    Una sola carga por versión de datos (data_version.py) para todo el proceso; la foto completa
+    sirve también las proyecciones. Retorna None si la hoja está vacía.
+    """
+    from data_version import data_version
+    store = _snapshot_store()
+    key = tuple(columns) if columns is not None else None
+    version = data_version(EVAL_TOPIC)
+    with store["lock"]:
+        full = store["snapshots"].get(None)
+        snap = store["snapshots"].get(key)
+    if full is not None and full.is_fresh(version):
+        if key is None:
+            return full
+        if snap is None or snap.version != full.version or snap.loaded_at < full.loaded_at:
+            snap = EvaluacionesSnapshot(full.df[[c for c in key if c in full.df.columns]], version)
+            snap.loaded_at = full.loaded_at
+            with store["lock"]:
+                store["snapshots"][key] = snap
+        return snap
+    if snap is not None and snap.is_fresh(version):
+        return snap
+
+    from storage import get_storage
+    db = get_storage()
+    data = db.read_table("Evaluaciones") if key is None else db.read_projection("Evaluaciones", list(key))
+    if len(data) <= 1:
+        return None
+    snap = EvaluacionesSnapshot(pd.DataFrame(data[1:], columns=data[0]), version)
+    # Si otro guardado publicó una versión nueva durante la carga, esta foto no se comparte
+    if data_version(EVAL_TOPIC) == version:
+        with store["lock"]:
+            store["snapshots"][key] = snap
+    return snap
+
+
+def load_evaluaciones_df(est_filter=None, columns=None):
+    """
+    Carga el DataFrame de evaluaciones desde la foto compartida + filtrado dinámico RBAC + filtro establecimiento.
+    columns: si se indica, solo se leen esas columnas (más las de filtrado) en vez de la hoja completa.
+    Siempre retorna un DataFrame propio (nunca la foto compartida), que quien llama puede modificar.
+    """
+    # 1. Foto compartida entre sesiones (una carga por versión de datos)
+    try:
+        wanted = list(dict.fromkeys(list(columns) + FILTER_COLUMNS)) if columns is not None else None
+        snap = get_evaluaciones_snapshot(wanted)
+    except Exception as e:
+        st.error(f"Error cargando datos: {e}")
+        return pd.DataFrame()
+    if snap is None:
+        return pd.DataFrame()
+
+    df = snap.df
+    mask = pd.Series(True, index=df.index)
+
+    # 2. APLICAR FILTRO RBAC SIEMPRE (Dinámico por Sesión Actual)
     if 'authenticated' in st.session_state and st.session_state.authenticated:
         user_info = st.session_state.user_info
         role = str(user_info.get('rol', '')).lower()
@@ -148,25 +244,133 @@ def load_evaluaciones_df(est_filter=None):
             full_context = f"{user_unit_clean} {user_cargo_clean}"
             
             if 'encargado' in user_cargo_clean and 'postas' in user_cargo_clean:
-                df = df[df['Sector'].str.strip().str.lower() == 'luna']
+                mask &= snap.mask('Sector', 'luna')
             elif re.search(r'\bsol\b', full_context):
-                df = df[df['Sector'].str.strip().str.lower() == 'sol']
+                mask &= snap.mask('Sector', 'sol')
             elif re.search(r'\bluna\b', full_context) or 'postas' in full_context:
-                df = df[df['Sector'].str.strip().str.lower() == 'luna']
+                mask &= snap.mask('Sector', 'luna')
             # Filtro por Programa
             elif user_unit_clean:
                  if 'Programa/Unidad' in df.columns:
-                     df = df[df['Programa/Unidad'].str.strip().str.lower().str.contains(user_unit_clean)]
+                     mask &= snap.mask('Programa/Unidad', user_unit_clean, contains=True)
     
     
-    # 4. APLICAR FILTRO DE ESTABLECIMIENTO (Global de la UI)
+    # 3. APLICAR FILTRO DE ESTABLECIMIENTO (Global de la UI)
     if est_filter and est_filter != "Todos":
         if 'Establecimiento' in df.columns:
-            df = df[df['Establecimiento'].str.strip().str.lower() == est_filter.lower()]
+            mask &= snap.mask('Establecimiento', est_filter.lower())
         elif 'Establecimiento Base' in df.columns:
-            df = df[df['Establecimiento Base'].str.strip().str.lower() == est_filter.lower()]
+            mask &= snap.mask('Establecimiento Base', est_filter.lower())
             
-    return df
+    # Sin filtro se entrega una copia: modificar el resultado no debe alterar la foto de otras sesiones
+    return df.copy() if mask.all() else df[mask]
+
+
+def _build_search_index(df):
+    from search_index import SearchIndex
+    col = lambda c: df[c].tolist() if c in df.columns else [""] * len(df)
+    return SearchIndex.from_columns(*(col(c) for c in SEARCH_COLUMNS))
+
+
+def search_evaluaciones(query):
+    """
+    Busca familias por apellido, integrante, RUT o dirección (índice invertido, ver search_index.py).
+    Retorna los ID Evaluación que coinciden, del más al menos relevante.
+    """
+    snap = get_evaluaciones_snapshot(SEARCH_COLUMNS)
+    if snap is None:
+        return []
+    return snap.derived("search", _build_search_index).search(query)
+
+
+RUT_COLUMNS = ["ID Evaluación", "Familia", "Grupo Familiar JSON"]
+
+
+def _rut_columns(values):
+    """Columnas de RUT_COLUMNS (listas alineadas) desde una grilla proyectada o un DataFrame."""
+    if isinstance(values, pd.DataFrame):
+        return [values[c].tolist() if c in values.columns else [""] * len(values) for c in RUT_COLUMNS]
+    if len(values) < 2:
+        return [[], [], []]
+    idx = [values[0].index(c) if c in values[0] else None for c in RUT_COLUMNS]
+    return [[r[i] if i is not None and i < len(r) else "" for r in values[1:]] for i in idx]
+
+
+def _rebuild_rut_registry(registry, db, version, generation):
+    """Reconstrucción en segundo plano tras cargar la copia local (arranque en frío)."""
+    try:
+        registry.rebuild(*_rut_columns(db.read_projection("Evaluaciones", RUT_COLUMNS)), version, generation)
+    except Exception as e:
+        logger.warning("Error reconstruyendo índice de RUTs: %s", e)
+
+
+@st.cache_resource(show_spinner=False)
+def _rut_registry():
+    """
+    Índice de RUTs único por proceso (rut.RutRegistry). Si hay copia local, responde de inmediato
+    con ella y la reconstrucción completa corre en segundo plano.
+    """
+    from data_version import data_version
+    from rut import RutRegistry
+    from storage import DATA_DIR, get_storage
+    registry = RutRegistry(os.path.join(DATA_DIR, "ruts.sqlite3"))
+    version = data_version(EVAL_TOPIC)
+    if registry.load(version):
+        threading.Thread(target=_rebuild_rut_registry, name="rut-index", daemon=True,
+                         args=(registry, get_storage(), version, registry.generation())).start()
+    return registry
+
+
+def get_rut_index():
+    """
+    Índice de RUTs canónicos de todos los integrantes (rut.RutIndex). Los guardados de la app lo
+    actualizan en sitio (apply_saved_ruts); solo se reconstruye si los datos cambiaron por otra vía.
+    """
+    from data_version import data_version
+    registry = _rut_registry()
+    version = data_version(EVAL_TOPIC)
+    if not registry.is_fresh(version):
+        generation = registry.generation()
+        snap = get_evaluaciones_snapshot(SEARCH_COLUMNS)
+        registry.rebuild(*_rut_columns(snap.df if snap is not None else []), version, generation)
+    return registry.index
+
+
+def apply_saved_ruts(saved, *versions):
+    """
+    Aplica al índice de RUTs las evaluaciones recién guardadas: saved = [(id, familia, JSON, versión)].
+    versions: otras versiones del bus publicadas por el mismo guardado.
+    """
+    registry = _rut_registry()
+    for eval_id, familia, gf_json, _ in saved:
+        registry.apply(eval_id, familia, gf_json)
+    registry.acknowledge(*([item[3] for item in saved] + list(versions)))
+
+
+def get_members_table():
+    """Tabla de integrantes de toda la población (members.py), una por versión de datos."""
+    from members import SOURCE_COLUMNS, empty_members, explode_members
+    snap = get_evaluaciones_snapshot(SOURCE_COLUMNS)
+    if snap is None:
+        return empty_members()
+    return snap.derived("members", explode_members)
+
+
+def load_members_df(est_filter=None):
+    """Integrantes de las evaluaciones visibles para la sesión (mismo filtro RBAC/establecimiento)."""
+    members = get_members_table()
+    visible = load_evaluaciones_df(est_filter=est_filter, columns=["ID Evaluación"])
+    if members.empty or visible.empty:
+        return members.iloc[0:0]
+    return members[members["ID Evaluación"].isin(visible["ID Evaluación"])]
+
+
+def fuzzy_search_evaluaciones(query, k=20):
+    """Búsqueda tolerante a tildes y errores de tipeo (trigramas). Retorna [(ID Evaluación, puntaje)]."""
+    snap = get_evaluaciones_snapshot(SEARCH_COLUMNS)
+    if snap is None:
+        return []
+    return snap.derived("search", _build_search_index).fuzzy_search(query, k)
 
 
 def chart_risk_distribution(df):
@@ -346,7 +550,7 @@ def chart_intervention_gap(df):
     # Usamos campo Plan Intervención JSON para detectar si tiene plan
     def has_plan(row):
         try:
-            plan = json.loads(row.get("Plan Intervención JSON", "[]"))
+            plan = decode_json(row.get("Plan Intervención JSON", "[]"))
             return len(plan) > 0
         except:
             return False
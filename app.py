@@ -1,22 +1,36 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 import json
 import toml
 import os
 import uuid
 import io
+import logging
+from contextlib import contextmanager, nullcontext
 from pdf_gen import generate_pdf_report, generate_blank_pdf
+from storage import AUDIT_HEADERS, cell_matches, get_storage, storage_settings, to_cell
+from audit import AUDIT_PAGE_SIZE, get_audit_buffer
+from journal import CONFLICT, DONE, PENDING, get_outbox_worker, get_save_journal, journaled_save, outbox_enabled
+from sync import REVISION_COL, RevisionConflict, check_revision, field_changes, merge_changes, stamp_row
+from rut import RutIndex, canonical_rut, format_rut, is_valid_rut
+from id_allocator import get_eval_id_allocator
+from search_index import fold_accents
+from json_codec import decode_json, encode_json
+from members import MEMBERS_TABLE, duplicate_members_report, duplicate_report_excel, write_members_table
+from consistency import CHILD_TABLES, EVAL_TABLE, apply_fix_plan, build_fix_plan, check_row_keys, plan_has_changes
+
+logger = logging.getLogger(__name__)
 
 # Módulos de visualización (carga lazy para no bloquear inicio)
 # Módulos de visualización (carga lazy para no bloquear inicio)
 try:
-    from analytics import render_analytics, load_evaluaciones_df
+    from analytics import render_analytics, load_evaluaciones_df, invalidate_evaluaciones_cache, apply_saved_ruts
 except ImportError:
     render_analytics = None
     load_evaluaciones_df = None
+    invalidate_evaluaciones_cache = None
+    apply_saved_ruts = None
 
 try:
     from genogram import generate_genogram_dot
@@ -244,8 +258,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- CONSTANTES ---
-SHEET_URL = "https://docs.google.com/spreadsheets/d/1JjYw2W6c-N2swGPuIHbz0CU7aDhh1pA-6VH1WuXV41w/edit"
-
 PARENTESCO_OPTIONS = [
     "Jefe/a de Hogar",
     "Cónyuge/Pareja",
@@ -300,55 +312,34 @@ def generate_family_id():
     short_uuid = uuid.uuid4().hex[:6].upper()
     return f"FAM-{today}-{short_uuid}"
 
+def clean_prefix(apellido):
+    """Prefijo de 3 letras del apellido para el ID (mayúsculas, sin tildes): 'Ñáñez' -> 'NAN'."""
+    if not apellido or not str(apellido).strip():
+        return "XXX"
+    s = fold_accents(str(apellido).strip())
+    s = ''.join(c for c in s if c.isalpha())  # solo letras
+    return s[:3].upper() if len(s) >= 3 else s.upper().ljust(3, 'X')
+
+
 def generate_incremental_eval_id(familia_apellido=""):
     """
     Genera el próximo ID de Evaluación en formato incremental EVA-NNN-FAM-XXX.
-    Lee la hoja 'Evaluaciones' de Google Sheets, busca el mayor número usado
-    y retorna el próximo ID con las 3 letras del apellido de la familia.
+    El número sale de la secuencia atómica del backend (id_allocator.py), por lo que dos
+    sesiones que guardan a la vez nunca reciben el mismo ID; las 3 letras son del apellido.
     Ejemplo: EVA-001-FAM-ORT (para Familia Ortiz)
-    Si no hay registros o hay error, retorna 'EVA-001-FAM-XXX'.
+    Con la cola de salida activa el número sale de la reserva local sin esperar a Sheets (funciona
+    sin conexión mientras queden números reservados).
+    Si no se puede reservar un número lanza RuntimeError: nunca se inventa un ID de respaldo,
+    porque un 'EVA-001' fijo pisaría (o se confundiría con) un registro real.
     """
-    # Extraer prefijo del apellido (3 letras en mayúsculas, sin tilde)
-    def clean_prefix(apellido):
-        if not apellido or not apellido.strip():
-            return "XXX"
-        import unicodedata
-        s = unicodedata.normalize('NFD', apellido.strip())
-        s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')  # quita tildes
-        s = ''.join(c for c in s if c.isalpha())  # solo letras
-        return s[:3].upper() if len(s) >= 3 else s.upper().ljust(3, 'X')
-
     prefix = clean_prefix(familia_apellido)
 
+    if get_db() is None:
+        raise RuntimeError("Sin conexión con la base de datos: no se pudo reservar un ID de evaluación.")
     try:
-        client = get_google_sheet_client()
-        if not client:
-            return f"EVA-001-FAM-{prefix}"
-        spreadsheet = client.open_by_url(SHEET_URL)
-        ws = spreadsheet.worksheet("Evaluaciones")
-        all_vals = ws.get_all_values()
-        if len(all_vals) < 2:
-            return f"EVA-001-FAM-{prefix}"
-        # Buscar columna "ID Evaluación" en la cabecera
-        headers = all_vals[0]
-        try:
-            id_col = headers.index("ID Evaluación")
-        except ValueError:
-            id_col = 0  # fallback: primera columna
-        # Recopilar todos los números usados en IDs con formato EVA-NNN-...
-        import re
-        max_num = 0
-        for row in all_vals[1:]:
-            if len(row) > id_col:
-                cell = str(row[id_col]).strip()
-                m = re.match(r'^EVA-(\d+)', cell)
-                if m:
-                    num = int(m.group(1))
-                    if num > max_num:
-                        max_num = num
-        return f"EVA-{max_num + 1:03d}-FAM-{prefix}"
-    except Exception:
-        return f"EVA-001-FAM-{prefix}"
+        return f"EVA-{get_eval_id_allocator().next(background=outbox_enabled()):03d}-FAM-{prefix}"
+    except Exception as e:
+        raise RuntimeError(f"No se pudo reservar un ID de evaluación: {e}") from e
 
 PROGRAMA_OPTIONS = [
     # Profesionales
@@ -408,11 +399,9 @@ PROGRAMA_OPTIONS = [
 def load_users():
     """Carga la lista de usuarios desde la hoja 'usuarios' en Google Sheets."""
     try:
-        client = get_google_sheet_client()
-        if not client: return pd.DataFrame()
-        sh = client.open_by_url(SHEET_URL)
-        ws = sh.worksheet("usuarios")
-        data = ws.get_all_values()
+        db = get_db()
+        if db is None: return pd.DataFrame()
+        data = db.read_table("usuarios")
         if len(data) > 1:
             return pd.DataFrame(data[1:], columns=data[0])
     except Exception as e:
@@ -527,14 +516,12 @@ def export_rem_p7_excel(n_inscritas_sol=0, n_inscritas_luna=0):
         return None, "Instala openpyxl: pip install openpyxl"
 
     # --- Leer datos de Sheets ---
-    client = get_google_sheet_client()
-    if not client:
+    db = get_db()
+    if db is None:
         return None, "Error de conexión."
-    spreadsheet = client.open_by_url(SHEET_URL)
 
     try:
-        ws_eval = spreadsheet.worksheet("Evaluaciones")
-        ev_data = ws_eval.get_all_values()
+        ev_data = db.read_table("Evaluaciones")
         if len(ev_data) > 1:
             df_eval = pd.DataFrame(ev_data[1:], columns=ev_data[0])
         else:
@@ -545,8 +532,7 @@ def export_rem_p7_excel(n_inscritas_sol=0, n_inscritas_luna=0):
         df_eval = pd.DataFrame()
 
     try:
-        ws_plan = spreadsheet.worksheet("Planes de Intervención")
-        pl_data = ws_plan.get_all_values()
+        pl_data = db.read_table("Planes de Intervención")
         df_plan = pd.DataFrame(pl_data[1:], columns=pl_data[0]) if len(pl_data) > 1 else pd.DataFrame(columns=["ID Evaluación"])
     except:
         df_plan = pd.DataFrame()
@@ -728,82 +714,124 @@ def export_rem_p7_excel(n_inscritas_sol=0, n_inscritas_luna=0):
     return buf, None
 
 
-# --- GOOGLE SHEETS CONNECTION ---
-def get_google_sheet_client():
+# --- PERSISTENCIA (Google Sheets / SQLite / memoria, ver storage.py) ---
+def get_db():
+    """
+    Retorna el backend de persistencia compartido, o None si no fue posible inicializarlo.
+    Durante un guardado (save_batch) las escrituras quedan además anotadas en el diario local.
+    """
+    activo = st.session_state.get('_diario_guardado')
+    if activo is not None:
+        return activo
     try:
-        secrets = st.secrets["gcp_service_account"]
-        creds_dict = {
-            "type": secrets["type"],
-            "project_id": secrets["project_id"],
-            "private_key_id": secrets["private_key_id"],
-            "private_key": secrets["private_key"],
-            "client_email": secrets["client_email"],
-            "client_id": secrets["client_id"],
-            "auth_uri": secrets["auth_uri"],
-            "token_uri": secrets["token_uri"],
-            "auth_provider_x509_cert_url": secrets["auth_provider_x509_cert_url"],
-            "client_x509_cert_url": secrets["client_x509_cert_url"],
-            "universe_domain": secrets["universe_domain"]
-        }
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        return client
+        return get_storage()
     except Exception as e:
-        st.error(f"Error conectando a Google Sheets: {e}")
+        st.error(f"Error conectando a la base de datos: {e}")
         return None
 
-@st.cache_data(ttl=300)
+def dump_json_column(value):
+    """Serializa una columna JSON de Evaluaciones ([storage] compact_json: formato compacto, ver json_codec.py)."""
+    return encode_json(value, compact=bool(storage_settings().get("compact_json")))
+
+def _outbox_worker():
+    """Hilo de envío del diario (cola de salida y reintentos); avisa a las cachés cuando algo llegó a la base."""
+    return get_outbox_worker(invalidate_evaluaciones_cache)
+
+@contextmanager
+def save_batch(key=""):
+    """
+    Agrupa las escrituras de un "Guardar" en una sola solicitud (ver StorageBackend.batch) y las
+    anota en el diario local (journal.py, journaled_save). Si un paso lanza una excepción no se envía
+    nada; si falla el envío, el guardado queda pendiente en st.session_state['envio_pendiente'] y
+    render_pending_save() permite reenviar solo lo que falta.
+    Con la cola de salida activa ([storage] outbox) el guardado solo se anota y lo envía el hilo
+    de fondo: no espera a Sheets.
+    """
+    db = get_db()
+    journal = get_save_journal() if db is not None else None
+    queued = bool(journal) and outbox_enabled()
+    user = st.session_state.get('user_info', {}).get('usuario', '')
+    st.session_state['_guardados_pendientes'] = []
+    st.session_state['_auditoria_pendiente'] = []
+    journaled = None
+    anotado = False
+    try:
+        # Un paso que falla lanza su excepción: el lote no se envía y la entrada se descarta
+        with (journaled_save(journal, db, key, user, queued) if journal else nullcontext()) as journaled:
+            st.session_state['_diario_guardado'] = journaled
+            yield
+        anotado = True
+        pendientes = st.session_state.get('_guardados_pendientes') or []
+    except Exception:
+        # Sellado pero sin confirmar: el envío falló y el guardado queda para reenviar
+        anotado = journaled is not None and journal.entry(journaled.save_id)["status"] == PENDING
+        if anotado:
+            st.session_state['envio_pendiente'] = {"id": journaled.save_id, "records": st.session_state.get('_guardados_pendientes') or []}
+        raise
+    finally:
+        st.session_state.pop('_guardados_pendientes', None)
+        st.session_state.pop('_diario_guardado', None)
+        # La auditoría del guardado se registra si llegó a la base o quedó completa en el diario
+        retenidos = st.session_state.pop('_auditoria_pendiente', None) or []
+        if anotado:
+            _log_retained_audit(retenidos)
+    if queued:
+        # En cola: la fila pasa a ser la base del formulario; las cachés se avisan cuando llegue a Sheets
+        _outbox_worker().wake()
+        _apply_saved_records(pendientes)
+        return
+    st.session_state.pop('envio_pendiente', None)
+    # Publicar el cambio recién cuando el lote llegó a la base (no antes del envío)
+    version = invalidate_evaluaciones_cache() if invalidate_evaluaciones_cache else None
+    _apply_saved_records([(record, version) for record, _ in pendientes])
+
+def _log_retained_audit(retenidos):
+    """Pasa al búfer de auditoría los eventos retenidos durante un guardado."""
+    for row in retenidos:
+        try:
+            get_audit_buffer().log(row)
+        except Exception as e:
+            logger.warning("Error registrando auditoría: %s", e)
+
+def _note_saved_record(record):
+    """
+    Una evaluación guardada se aplica (base del diff e índice de RUTs) cuando el lote se confirma:
+    save_batch() publica la versión después del envío y se la asigna. Fuera de un lote la escritura
+    ya llegó a la base, así que se publica de inmediato.
+    """
+    pendientes = st.session_state.get('_guardados_pendientes')
+    if pendientes is not None:
+        pendientes.append((record, None))
+    else:
+        version = invalidate_evaluaciones_cache() if invalidate_evaluaciones_cache else None
+        _apply_saved_records([(record, version)])
+
+def _apply_saved_records(saved, *versions):
+    """La última fila guardada pasa a ser la base del próximo guardado por diferencias; sus RUTs van al índice."""
+    if not saved:
+        return
+    st.session_state['registro_cargado'] = saved[-1][0]
+    if apply_saved_ruts:
+        apply_saved_ruts([(r.get("ID Evaluación", ""), r.get("Familia", ""), r.get("Grupo Familiar JSON", "[]"), v)
+                          for r, v in saved], *versions)
+
 def get_all_ruts_mapping():
-    """Retorna un dict {rut: (familia, id_eval)} de todos los integrantes de la BD para validación."""
+    """Índice {RUT canónico: [(familia, id_eval, posición)]} de todos los integrantes (ver rut.RutIndex)."""
     try:
-        client = get_google_sheet_client()
-        if not client: return {}
-        sh = client.open_by_url(SHEET_URL)
-        ws = sh.worksheet("Evaluaciones")
-        data = ws.get_all_values()
-        if len(data) <= 1: return {}
-        
-        df = pd.DataFrame(data[1:], columns=data[0])
-        rut_map = {}
-        for _, row in df.iterrows():
-            fid = row.get("ID Evaluación", "Desconocido")
-            fam = row.get("Familia", "Desconocida")
-            gf_json = row.get("Grupo Familiar JSON", "[]")
-            try:
-                gf = json.loads(gf_json)
-                for member in gf:
-                    rut = str(member.get("RUT", "")).strip().upper()
-                    if rut and rut != "S/R" and rut != "":
-                        rut_map[rut] = (fam, fid)
-            except:
-                continue
-        return rut_map
+        from analytics import get_rut_index
+        return get_rut_index()
     except Exception as e:
         st.error(f"Error cargando mapeo de RUTs: {e}")
-        return {}
-
+        return RutIndex()
 
-def get_or_create_worksheet(spreadsheet, title, headers=None):
-    """Obtiene una hoja por nombre, la crea si no existe y opcionalmente pone encabezados."""
-    try:
-        ws = spreadsheet.worksheet(title)
-    except gspread.WorksheetNotFound:
-        ws = spreadsheet.add_worksheet(title=title, rows="1000", cols="50")
-        if headers:
-            ws.append_row(headers)
-    return ws
 
 def log_audit_event(user_info, action, details="", eval_id=None):
-    """Registra un evento de auditoría en la hoja 'Auditoría' de Google Sheets."""
+    """
+    Registra un evento de auditoría en la hoja 'Auditoría'. No espera a Sheets: el evento va al
+    búfer de audit.py, que lo envía por lotes en segundo plano. Dentro de un guardado (save_batch)
+    se retiene hasta que el guardado se confirma o queda en el diario.
+    """
     try:
-        client = get_google_sheet_client()
-        if not client:
-            return
-        spreadsheet = client.open_by_url(SHEET_URL)
-        headers = ["Timestamp", "Usuario", "Cargo", "Acción", "Detalles", "ID Evaluación"]
-        worksheet = get_or_create_worksheet(spreadsheet, "Auditoría", headers)
-        
         # Obtener fecha y hora actual
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
@@ -815,54 +843,40 @@ def log_audit_event(user_info, action, details="", eval_id=None):
             details,
             str(eval_id) if eval_id else ""
         ]
-        worksheet.append_row(row)
+        retenidos = st.session_state.get('_auditoria_pendiente')
+        if retenidos is not None:
+            retenidos.append(row)
+        else:
+            get_audit_buffer().log(row)
     except Exception as e:
         # Fallo silencioso en auditoría para no bloquear la experiencia de usuario
-        print(f"Error registrando auditoría: {e}")
+        logger.warning("Error registrando auditoría: %s", e)
 
 
 def search_record(id_eval):
-    client = get_google_sheet_client()
-    if not client:
+    db = get_db()
+    if db is None:
         return None
     try:
-        spreadsheet = client.open_by_url(SHEET_URL)
-        worksheet = get_or_create_worksheet(spreadsheet, "Evaluaciones")
-
-        # Get all values (list of lists) to avoid duplicate header errors
-        all_values = worksheet.get_all_values()
-        if not all_values:
-            return None
-            
-        headers = all_values[0]
-        try:
-            id_idx = headers.index("ID Evaluación")
-        except ValueError:
+        record = db.find_row("Evaluaciones", id_eval)
+        if record is None:
             return None
-            
-        for row in all_values[1:]:
-            if len(row) > id_idx:
-                val = row[id_idx]
-                if str(val) == str(id_eval):
-                    record = {}
-                    for i, h in enumerate(headers):
-                        if h and i < len(row):
-                             record[h] = row[i]
-                    
-                    # VALIDACIÓN RBAC: Verificar si el usuario actual tiene permiso para ver este registro
-                    if 'authenticated' in st.session_state and st.session_state.authenticated:
-                        if not check_access(record, st.session_state.user_info):
-                            st.error("🚫 No tiene permisos para acceder a este registro (Restricción de Sector/Unidad).")
-                            return None
-                    
-                    return record
-        return None
+
+        # VALIDACIÓN RBAC: Verificar si el usuario actual tiene permiso para ver este registro
+        if 'authenticated' in st.session_state and st.session_state.authenticated:
+            if not check_access(record, st.session_state.user_info):
+                st.error("🚫 No tiene permisos para acceder a este registro (Restricción de Sector/Unidad).")
+                return None
+
+        return record
     except Exception as e:
         st.error(f"Error buscando en Google Sheets: {e}")
         return None
 
 
 def load_record_into_state(record):
+    # Fila tal como está en la base: el guardado solo envía las celdas que difieran de ella
+    st.session_state['registro_cargado'] = {k: to_cell(v) for k, v in record.items()}
     mapping = {
         'Rep Sector': 'comp_rep_sector',
         'Familia Comp': 'comp_familia',
@@ -933,7 +947,7 @@ def load_record_into_state(record):
         fam_json = record.get('Grupo Familiar JSON', '[]')
         plan_json = record.get('Plan Intervención JSON', '[]')
         
-        df_fam = pd.DataFrame(json.loads(fam_json) if fam_json else [])
+        df_fam = pd.DataFrame(decode_json(fam_json) if fam_json else [])
         
         # Robust backfill for family members
         expected_fam_cols = [
@@ -958,7 +972,7 @@ def load_record_into_state(record):
         df_fam['F. Nac'] = pd.to_datetime(df_fam['F. Nac'], errors='coerce')
         st.session_state.family_members = df_fam
         
-        df_plan = pd.DataFrame(json.loads(plan_json) if plan_json else [])
+        df_plan = pd.DataFrame(decode_json(plan_json) if plan_json else [])
         
         # Ensure all columns exist, especially for empty dataframes or old records
         expected_cols = ["Objetivo", "Actividad", "Fecha Prog", "Responsable", 
@@ -976,7 +990,7 @@ def load_record_into_state(record):
         # Load seguimiento plan
         seg_json_load = record.get('Seguimiento Plan JSON', '[]')
         try:
-            df_seg = pd.DataFrame(json.loads(seg_json_load) if seg_json_load else [])
+            df_seg = pd.DataFrame(decode_json(seg_json_load) if seg_json_load else [])
             expected_seg_cols = ['Objetivo', 'Actividad', 'Estado', 'F. Seguimiento', 'Obs. Seguimiento']
             for col in expected_seg_cols:
                 if col not in df_seg.columns:
@@ -991,14 +1005,14 @@ def load_record_into_state(record):
 
     try:
         rel_json = record.get('Relaciones JSON', '[]')
-        st.session_state.interpersonal_relations = json.loads(rel_json) if rel_json else []
+        st.session_state.interpersonal_relations = decode_json(rel_json) if rel_json else []
     except:
         st.session_state.interpersonal_relations = []
 
     try:
         team_json = record.get('Equipo Salud JSON', '[]')
         try:
-            df_team = pd.DataFrame(json.loads(team_json))
+            df_team = pd.DataFrame(decode_json(team_json))
         except:
             df_team = pd.DataFrame(columns=["Nombre y Profesión", "Firma"])
             
@@ -1016,61 +1030,212 @@ def load_record_into_state(record):
 
 def save_evaluacion_to_sheet(data, headers):
     """Guarda o actualiza la evaluación en la Hoja 1 'Evaluaciones'."""
-    client = get_google_sheet_client()
-    if not client:
+    db = get_db()
+    if db is None:
         return False, "Error de conexión."
     try:
-        spreadsheet = client.open_by_url(SHEET_URL)
-        worksheet = get_or_create_worksheet(spreadsheet, "Evaluaciones", headers)
-
-        all_values = worksheet.get_all_values()
-        
-        # Ensure header row exists
-        if not all_values:
-            worksheet.append_row(headers)
-            all_values = [headers]
-        elif all_values[0] != headers:
-            # Si los encabezados cambiaron, actualizar la primera fila
-            worksheet.update(range_name="A1", values=[headers])
-            all_values[0] = headers
-
         new_id = str(data[0]).strip()
-        
-        if not new_id:
-             worksheet.append_row(data)
-             if 'raw_analytics_df' in st.session_state: del st.session_state['raw_analytics_df']
-             return True, "Registro agregado (sin ID)."
-
-        id_col_idx = 0
-        if all_values and "ID Evaluación" in all_values[0]:
-             try:
-                 id_col_idx = all_values[0].index("ID Evaluación")
-             except:
-                 id_col_idx = 0
-        
-        row_to_update = -1
-        start_row_idx = 1 if (all_values and len(all_values) > 0) else 0
-        
-        for i in range(start_row_idx, len(all_values)):
-            row = all_values[i]
-            if len(row) > id_col_idx:
-                existing_id = str(row[id_col_idx]).strip()
-                if existing_id == new_id:
-                    row_to_update = i + 1
-                    break
-        
-        if row_to_update != -1:
-            worksheet.update(range_name=f"A{row_to_update}", values=[data])
-            if 'raw_analytics_df' in st.session_state: del st.session_state['raw_analytics_df']
-            return True, f"Registro actualizado (Fila {row_to_update})."
+        base = st.session_state.get('registro_cargado') or {}
+        queued = getattr(db, "queued", False)
+        if queued:
+            # Cola de salida (sin conexión): la revisión esperada es la del registro cargado; el
+            # conflicto, si lo hay, lo detecta el envío en segundo plano (journal.py)
+            same = bool(new_id) and str(base.get("ID Evaluación", "")).strip() == new_id
+            previous = {REVISION_COL: base.get(REVISION_COL, "")} if same else None
         else:
-            worksheet.append_row(data)
-            if 'raw_analytics_df' in st.session_state: del st.session_state['raw_analytics_df']
-            return True, "Nuevo registro agregado."
-            
+            # Solo la celda "Revisión" de la fila (ubicada con el índice), siempre leída desde Sheets
+            previous = db.read_cells("Evaluaciones", new_id, [REVISION_COL]) if new_id else None
+        loaded = previous is not None and str(base.get("ID Evaluación", "")).strip() == new_id
+        if loaded and not queued:
+            try:
+                check_revision(base, previous, new_id)
+            except RevisionConflict:
+                # Otro usuario guardó desde que se cargó: nada se escribe y se ofrece resolver por campo
+                mine = {h: to_cell(v) for h, v in zip(headers, data)}
+                st.session_state['conflicto_guardado'] = {
+                    "id": new_id, "base": base, "mine": mine,
+                    "theirs": db.read_cells("Evaluaciones", new_id, list(dict.fromkeys(list(headers) + list(base)))) or {},
+                }
+                raise
+        # Marca de actualización + revisión: permite la sincronización incremental (sync.py)
+        headers, data = stamp_row(headers, data, previous)
+        record = {h: to_cell(v) for h, v in zip(headers, data)}
+        row_updated = None
+        if loaded:
+            # Registro cargado: solo las celdas que cambiaron (más la marca y la revisión), en un solo lote
+            # (el valor del formulario contra la celda leída, ver cell_matches: no el texto de ambos)
+            changes = {h: record[h] for h, v in zip(headers, data) if not cell_matches(v, base.get(h, ""))}
+            row_updated = db.update_cells("Evaluaciones", headers, new_id, changes)
+        if row_updated is None:
+            row_updated = db.upsert_row("Evaluaciones", headers, data)
+        _note_saved_record(record)
+        if queued:
+            return True, "Guardado en la cola local; se enviará a Sheets en segundo plano."
+
+        if not new_id:
+            return True, "Registro agregado (sin ID)."
+        if row_updated:
+            return True, f"Registro actualizado (Fila {row_updated})."
+        return True, "Nuevo registro agregado."
+
+    except RevisionConflict:
+        raise  # Cancela todo el lote del guardado (ver render_save_conflict)
     except Exception as e:
         st.error(f"Error guardando en Hoja Evaluaciones: {e}")
-        return False, str(e)
+        raise  # Cancela todo el lote: nada del guardado se envía
+
+
+def render_sync_status(eval_id):
+    """Estado de sincronización del registro según el diario local (en cola, con conflicto o enviado)."""
+    if not eval_id:
+        return
+    try:
+        entry = get_save_journal().status(eval_id)
+    except Exception:
+        return
+    if entry is None:
+        return
+    if entry["status"] == PENDING:
+        detalle = f" · {entry['attempts']} intento(s), último error: {entry['error']}" if entry["attempts"] else ""
+        st.caption(f"⏳ En cola para Sheets desde {entry['created'].replace('T', ' ')}{detalle}")
+    elif entry["status"] == CONFLICT:
+        st.caption("⚠️ El guardado en cola no se envió: otro usuario modificó el registro. Recárgalo y vuelve a aplicar tus cambios.")
+    elif entry["status"] == DONE:
+        st.caption("☁️ Sincronizado con Sheets")
+
+
+def render_pending_save():
+    """Aviso de guardado pendiente en el diario local, con reenvío de los pasos que faltan."""
+    pendiente = st.session_state.get('envio_pendiente')
+    if not pendiente:
+        return
+    journal = get_save_journal()
+    entry = journal.entry(pendiente["id"])
+    if entry is None or entry["status"] == DONE:
+        st.session_state.pop('envio_pendiente', None)
+        return
+    with st.container(border=True):
+        st.warning(f"⏳ El último guardado de **{entry['key'] or 'la evaluación'}** quedó en el diario local sin "
+                   f"confirmarse en Sheets ({entry['done']}/{entry['steps']} pasos). Error: {entry['error'] or 's/i'}")
+        col_a, col_b = st.columns(2)
+        with col_a:
+            if st.button("🔁 Reintentar envío", type="primary", width='stretch',
+                         help="Envía solo los pasos que faltan; no vuelve a guardar todo."):
+                db = get_db()
+                status = journal.roll_forward(db, entry["id"]) if db is not None else entry["status"]
+                if status == DONE:
+                    st.session_state.pop('envio_pendiente', None)
+                    version = invalidate_evaluaciones_cache() if invalidate_evaluaciones_cache else None
+                    _apply_saved_records([(record, version) for record, _ in pendiente["records"]])
+                    st.success("✅ Guardado completado.")
+                elif status == CONFLICT:
+                    st.session_state.pop('envio_pendiente', None)
+                    st.error("Otro usuario guardó este registro antes del reenvío; recárgalo y vuelve a aplicar tus cambios.")
+                else:
+                    st.error(f"No se pudo completar el envío: {journal.entry(entry['id'])['error']}")
+        with col_b:
+            if st.button("🗑️ Descartar guardado pendiente", width='stretch'):
+                journal.discard(entry["id"])
+                st.session_state.pop('envio_pendiente', None)
+                st.rerun()
+
+
+def render_save_conflict():
+    """
+    Panel de conflicto de guardado: muestra campo a campo lo que cambió cada usuario desde que se
+    cargó el registro y permite recargar la versión actual o combinar (mis cambios sobre la versión
+    actual) y volver a guardar.
+    """
+    conflict = st.session_state.get('conflicto_guardado')
+    if not conflict:
+        return
+    base, mine, theirs = conflict["base"], conflict["mine"], conflict["theirs"]
+    changes = field_changes(base, mine, theirs)
+    with st.container(border=True):
+        st.error(f"⚠️ Otro usuario guardó la evaluación **{conflict['id']}** mientras la editabas. "
+                 "No se guardó nada; revisa las diferencias antes de continuar.")
+        origen = {"mío": "Solo tú", "otro": "Solo el otro usuario", "ambos": "Ambos (conflicto)"}
+        recortar = lambda v: v if len(v) <= 80 else v[:77] + "..."
+        st.dataframe(pd.DataFrame(
+            [{"Campo": f, "Al cargar": recortar(b), "Tus cambios": recortar(m), "Versión actual": recortar(t), "Cambiado por": origen[o]}
+             for f, b, m, t, o in changes],
+            columns=["Campo", "Al cargar", "Tus cambios", "Versión actual", "Cambiado por"]), hide_index=True, width='stretch')
+
+        keep_theirs = []
+        for field, _, m, t, origin in changes:
+            if origin == "ambos":
+                choice = st.radio(f"Valor para **{field}**", ["Tus cambios", "Versión actual"], horizontal=True,
+                                  key=f"conflicto_{field}")
+                if choice == "Versión actual":
+                    keep_theirs.append(field)
+
+        col_a, col_b = st.columns(2)
+        with col_a:
+            if st.button("🔀 Combinar y revisar", type="primary", width='stretch',
+                         help="Tus cambios sobre la versión actual; luego presiona Guardar de nuevo."):
+                load_record_into_state(merge_changes(base, mine, theirs, keep_theirs))
+                # La base del próximo guardado es la versión actual: solo viajan los campos combinados
+                st.session_state['registro_cargado'] = dict(theirs)
+                st.session_state.pop('conflicto_guardado', None)
+                st.rerun()
+        with col_b:
+            if st.button("↩️ Descartar mis cambios y recargar", width='stretch'):
+                load_record_into_state(theirs)
+                st.session_state.pop('conflicto_guardado', None)
+                st.rerun()
+
+
+def render_audit_admin():
+    """
+    Consulta de auditoría para programadores: filtra por usuario, acción, ID Evaluación y fechas
+    sobre el índice local (audit.AuditIndex) y pagina los resultados de a AUDIT_PAGE_SIZE eventos.
+    """
+    buffer = get_audit_buffer()
+    index = buffer.index
+    todos = "(Todos)"
+    usuario = st.selectbox("Usuario", [todos] + index.distinct("usuario"), key="audit_usuario")
+    accion = st.selectbox("Acción", [todos] + index.distinct("accion"), key="audit_accion")
+    eval_id = st.text_input("ID Evaluación", key="audit_eval_id")
+    c1, c2 = st.columns(2)
+    desde = c1.date_input("Desde", value=date.today() - timedelta(days=30), key="audit_desde")
+    hasta = c2.date_input("Hasta", value=date.today(), key="audit_hasta")
+
+    if st.button("🔍 Buscar eventos", width='stretch', key="btn_audit_buscar"):
+        try:
+            with st.spinner("Actualizando índice de auditoría..."):
+                buffer.sync_index()
+        except Exception as e:
+            st.warning(f"⚠️ No se pudo leer Sheets; se muestra el índice local: {e}")
+        st.session_state['audit_consulta'] = {
+            "usuario": "" if usuario == todos else usuario,
+            "accion": "" if accion == todos else accion,
+            "eval_id": eval_id.strip(), "since": desde, "until": hasta,
+        }
+        st.session_state['audit_pagina'] = 0
+
+    consulta = st.session_state.get('audit_consulta')
+    if consulta is not None:
+        pagina = st.session_state.get('audit_pagina', 0)
+        rows, total = index.query(**consulta, limit=AUDIT_PAGE_SIZE, offset=pagina * AUDIT_PAGE_SIZE)
+        paginas = max((total + AUDIT_PAGE_SIZE - 1) // AUDIT_PAGE_SIZE, 1)
+        st.caption(f"{total} eventos · página {pagina + 1} de {paginas}")
+        st.dataframe(pd.DataFrame(rows, columns=AUDIT_HEADERS), hide_index=True, width='stretch')
+        p1, p2 = st.columns(2)
+        if p1.button("◀ Anterior", width='stretch', disabled=pagina == 0, key="btn_audit_prev"):
+            st.session_state['audit_pagina'] = pagina - 1
+            st.rerun()
+        if p2.button("Siguiente ▶", width='stretch', disabled=pagina + 1 >= paginas, key="btn_audit_next"):
+            st.session_state['audit_pagina'] = pagina + 1
+            st.rerun()
+
+    if st.button("♻️ Reconstruir índice", width='stretch', key="btn_audit_rebuild",
+                 help="Vuelve a leer todas las hojas de auditoría, incluidas la histórica y los meses cerrados."):
+        with st.spinner("Leyendo todas las hojas de auditoría..."):
+            try:
+                n = buffer.sync_index(full=True)
+                st.success(f"✅ Índice reconstruido ({n} hojas).")
+            except Exception as e:
+                st.error(f"❌ Error reconstruyendo el índice: {e}")
 
 
 def migrate_eval_ids_to_new_format():
@@ -1081,26 +1246,15 @@ def migrate_eval_ids_to_new_format():
     Tambi\u00e9n actualiza referencias en Planes de Intervenci\u00f3n y Ecomapas.
     Retorna (bool, mensaje, n\u00famero de registros actualizados).
     """
-    import unicodedata, re
-
-    def clean_prefix(apellido):
-        if not apellido or not str(apellido).strip():
-            return "XXX"
-        s = unicodedata.normalize('NFD', str(apellido).strip())
-        s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
-        s = ''.join(c for c in s if c.isalpha())
-        return s[:3].upper() if len(s) >= 3 else s.upper().ljust(3, 'X')
-
-    client = get_google_sheet_client()
-    if not client:
+    db = get_db()
+    if db is None:
         return False, "Error de conexi\u00f3n con Google Sheets.", 0
 
     try:
-        spreadsheet = client.open_by_url(SHEET_URL)
-
+        # Las escrituras van por número de fila: leer sobre una copia recién reconciliada con Sheets
+        db.reconcile((EVAL_TABLE,) + CHILD_TABLES, full=True)
         # Leer hoja de Evaluaciones
-        ws_eval = spreadsheet.worksheet("Evaluaciones")
-        all_vals = ws_eval.get_all_values()
+        all_vals = db.read_table("Evaluaciones")
         if len(all_vals) < 2:
             return False, "No hay registros en la hoja Evaluaciones.", 0
 
@@ -1113,74 +1267,118 @@ def migrate_eval_ids_to_new_format():
 
         # Leer hoja Planes de Intervenci\u00f3n
         try:
-            ws_plan = spreadsheet.worksheet("Planes de Intervenci\u00f3n")
-            plan_all = ws_plan.get_all_values()
+            plan_all = db.read_table("Planes de Intervenci\u00f3n")
             plan_headers = plan_all[0] if plan_all else []
             plan_id_col = plan_headers.index("ID Evaluaci\u00f3n") if "ID Evaluaci\u00f3n" in plan_headers else 0
         except Exception:
-            ws_plan, plan_all, plan_id_col = None, [], 0
+            plan_all, plan_id_col = [], 0
 
         # Leer hoja Ecomapas
         try:
-            ws_eco = spreadsheet.worksheet("Ecomapas")
-            eco_all = ws_eco.get_all_values()
+            eco_all = db.read_table("Ecomapas")
             eco_headers = eco_all[0] if eco_all else []
             eco_id_col = eco_headers.index("ID Evaluaci\u00f3n") if "ID Evaluaci\u00f3n" in eco_headers else 0
         except Exception:
-            ws_eco, eco_all, eco_id_col = None, [], 0
+            eco_all, eco_id_col = [], 0
 
         # Construir mapa: ID_viejo -> ID_nuevo
         id_map = {}
-        updates_eval = []
+        updates_eval = {}
+        expected = {"Evaluaciones": {}}  # n_fila -> ID leído, para verificar antes de escribir
         counter = 1
         for row in data_rows:
             old_id   = str(row[id_col]).strip() if len(row) > id_col else ""
+            expected["Evaluaciones"][counter + 1] = old_id
             apellido = str(row[fam_col]).strip().split()[0] if len(row) > fam_col and str(row[fam_col]).strip() else ""
             prefix   = clean_prefix(apellido)
             new_id   = f"EVA-{counter:03d}-FAM-{prefix}"
             id_map[old_id] = new_id
             updated_row = list(row)
             updated_row[id_col] = new_id
-            updates_eval.append((counter + 1, updated_row))  # +1 por encabezado
+            updates_eval[counter + 1] = updated_row  # +1 por encabezado
             counter += 1
 
-        # Actualizar Evaluaciones fila por fila
-        for sheet_row_num, updated_row in updates_eval:
-            ws_eval.update(range_name=f"A{sheet_row_num}", values=[updated_row])
-
-        # Actualizar Planes de Intervenci\u00f3n
-        if ws_plan and len(plan_all) > 1:
-            for i, row in enumerate(plan_all[1:], 2):
-                if len(row) > plan_id_col:
-                    old_id = str(row[plan_id_col]).strip()
-                    if old_id in id_map:
-                        updated_row = list(row)
-                        updated_row[plan_id_col] = id_map[old_id]
-                        ws_plan.update(range_name=f"A{i}", values=[updated_row])
-
-        # Actualizar Ecomapas
-        if ws_eco and len(eco_all) > 1:
-            for i, row in enumerate(eco_all[1:], 2):
-                if len(row) > eco_id_col:
-                    old_id = str(row[eco_id_col]).strip()
+        # Referencias en Planes de Intervención y Ecomapas
+        child_updates = {}
+        for table, all_rows, id_idx in [("Planes de Intervención", plan_all, plan_id_col),
+                                        ("Ecomapas", eco_all, eco_id_col)]:
+            updates = {}
+            for i, row in enumerate(all_rows[1:], 2):
+                if len(row) > id_idx:
+                    old_id = str(row[id_idx]).strip()
                     if old_id in id_map:
                         updated_row = list(row)
-                        updated_row[eco_id_col] = id_map[old_id]
-                        ws_eco.update(range_name=f"A{i}", values=[updated_row])
-
+                        updated_row[id_idx] = id_map[old_id]
+                        updates[i] = updated_row
+                        expected.setdefault(table, {})[i] = old_id
+            child_updates[table] = updates
+
+        # Ninguna fila destino cambió desde la lectura; luego todo en un solo lote (una escritura por hoja)
+        check_row_keys(db, expected)
+        with db.batch():
+            db.update_rows("Evaluaciones", updates_eval)
+            for table, updates in child_updates.items():
+                db.update_rows(table, updates)
+        # La secuencia continúa después del último ID renumerado
+        get_eval_id_allocator().reset(counter - 1)
+
+        if invalidate_evaluaciones_cache: invalidate_evaluaciones_cache()
         return True, f"Migraci\u00f3n completada: {len(updates_eval)} registros actualizados.", len(updates_eval)
 
     except Exception as e:
         return False, f"Error durante la migraci\u00f3n: {e}", 0
 
 
+def check_eval_id_consistency(delete_orphans=False):
+    """
+    Revisa IDs repetidos y huérfanos en Evaluaciones, Planes de Intervención y Ecomapas.
+    Lee cada hoja una vez y retorna (bool, plan de corrección o mensaje de error). Ver consistency.py.
+    """
+    db = get_db()
+    if db is None:
+        return False, "Error de conexión con Google Sheets."
+    try:
+        # El plan escribe por número de fila: se arma sobre una copia recién reconciliada con Sheets
+        db.reconcile((EVAL_TABLE,) + CHILD_TABLES, full=True)
+        tables = {t: db.read_table(t) for t in (EVAL_TABLE,) + CHILD_TABLES}
+        return True, build_fix_plan(tables, generate_incremental_eval_id, delete_orphans)
+    except Exception as e:
+        return False, f"Error revisando IDs: {e}"
+
+
+def apply_eval_id_fixes(plan):
+    """Aplica un plan de check_eval_id_consistency() en un solo lote. Retorna (bool, mensaje, n filas)."""
+    db = get_db()
+    if db is None:
+        return False, "Error de conexión con Google Sheets.", 0
+    try:
+        n = apply_fix_plan(db, plan)
+        if invalidate_evaluaciones_cache: invalidate_evaluaciones_cache()
+        return True, f"Corrección aplicada: {n} filas modificadas.", n
+    except Exception as e:
+        return False, f"Error aplicando la corrección: {e}", 0
+
+
+def publish_members_table():
+    """Publica la tabla explotada de integrantes como hoja 'Integrantes'. Retorna (bool, mensaje)."""
+    db = get_db()
+    if db is None:
+        return False, "Error de conexión con Google Sheets."
+    try:
+        from analytics import get_members_table
+        n = write_members_table(db, get_members_table())
+        return True, f"Hoja '{MEMBERS_TABLE}' publicada: {n} integrantes."
+    except Exception as e:
+        return False, f"Error publicando integrantes: {e}"
+
+
 def save_intervention_rows(id_eval, familia, fecha_eval, nivel, programa, parentesco, df_plan):
     """Guarda las filas del plan de intervención en la Hoja 2 'Planes de Intervención'.
     
-    Primero elimina registros existentes con el mismo ID Evaluación, luego inserta las nuevas filas.
+    Reemplaza los registros existentes con el mismo ID Evaluación por las nuevas filas.
     """
-    client = get_google_sheet_client()
-    if not client:
+    db = get_db()
+    if db is None:
         return False, "Error de conexión."
     
     plan_headers = [
@@ -1191,38 +1389,9 @@ def save_intervention_rows(id_eval, familia, fecha_eval, nivel, programa, parent
     ]
     
     try:
-        spreadsheet = client.open_by_url(SHEET_URL)
-        worksheet = get_or_create_worksheet(spreadsheet, "Planes de Intervención", plan_headers)
-        
-        all_values = worksheet.get_all_values()
-        
-        # Ensure headers - force correct headers in first row
-        if not all_values or len(all_values[0]) != len(plan_headers):
-            worksheet.update('A1:P1', [plan_headers])
-            all_values = [plan_headers]
-        
-        # Find and delete existing rows with same ID Evaluación
-        if len(all_values) > 1:
-            headers_row = all_values[0]
-            try:
-                id_idx = headers_row.index("ID Evaluación")
-            except ValueError:
-                id_idx = 0
-
-            rows_to_delete = []
-            for i in range(1, len(all_values)):
-                row = all_values[i]
-                if len(row) > id_idx and str(row[id_idx]).strip() == str(id_eval).strip():
-                    rows_to_delete.append(i + 1)  # 1-indexed sheet row
-
-            # Delete from bottom to top to preserve row numbers
-            for row_num in sorted(rows_to_delete, reverse=True):
-                worksheet.delete_rows(row_num)
-
-        # Insert new rows for each plan activity
+        # Construir nuevas filas para cada actividad del plan
+        new_rows = []
         if df_plan is not None and not df_plan.empty:
-            new_rows = []
-            
             date_cols = ['Fecha Prog', 'Fecha Real', 'F. Seguimiento']
             df_plan_work = df_plan.copy()
             
@@ -1263,21 +1432,16 @@ def save_intervention_rows(id_eval, familia, fecha_eval, nivel, programa, parent
                     fecha_seg,
                     plan_row.get("Obs. Seguimiento", "")
                 ])
-            
-            if new_rows:
-                # Get the next available row
-                next_row = len(all_values) + 1
-                range_str = f"A{next_row}:P{next_row + len(new_rows) - 1}"
-                worksheet.update(range_str, new_rows, value_input_option='USER_ENTERED')
-                return True, f"{len(new_rows)} actividades guardadas en Hoja 'Planes de Intervención'."
-            else:
-                return True, "Plan de intervención vacío, no se agregaron filas."
-        else:
-            return True, "Plan de intervención vacío, no se agregaron filas."
+
+        # Elimina las filas anteriores del mismo ID aunque el plan nuevo venga vacío
+        db.replace_child_rows("Planes de Intervención", plan_headers, id_eval, new_rows)
+        if new_rows:
+            return True, f"{len(new_rows)} actividades guardadas en Hoja 'Planes de Intervención'."
+        return True, "Plan de intervención vacío, no se agregaron filas."
 
     except Exception as e:
         st.error(f"Error guardando en Hoja Planes de Intervención: {e}")
-        return False, str(e)
+        raise  # Cancela todo el lote: la evaluación tampoco se envía
 
 
 
@@ -1288,12 +1452,10 @@ def save_ecomap_to_sheet(eval_id, familia, elements):
     Incluye los flujos de energía del Protocolo SJ.
     """
     try:
-        client = get_google_sheet_client()
-        if not client: return False, "No se pudo conectar con Google."
-        spreadsheet = client.open_by_url(SHEET_URL)
+        db = get_db()
+        if db is None: return False, "No se pudo conectar con Google."
         
         headers = ["ID Evaluación", "Familia", "Sistemas JSON", "Flujos JSON", "Riesgos JSON", "Fecha Actualización"]
-        ws = get_or_create_worksheet(spreadsheet, "Ecomapas", headers)
         
         # Serializar la configuración
         sistemas_json = json.dumps(elements.get("selected_systems", []), ensure_ascii=False)
@@ -1301,25 +1463,15 @@ def save_ecomap_to_sheet(eval_id, familia, elements):
         riesgos_json = json.dumps(elements.get("active_risks", {}), ensure_ascii=False)
         fecha_act = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Buscar si ya existe para este ID
-        all_vals = ws.get_all_values()
-        row_idx = -1
-        if len(all_vals) > 1:
-            for i, row in enumerate(all_vals[1:], 2):
-                if len(row) > 0 and str(row[0]).strip() == str(eval_id).strip():
-                    row_idx = i
-                    break
-        
+        # Actualiza la fila existente para este ID o agrega una nueva
         new_row = [eval_id, familia, sistemas_json, flujos_json, riesgos_json, fecha_act]
-        if row_idx != -1:
-            ws.update(f"A{row_idx}:F{row_idx}", [new_row])
+        if db.upsert_row("Ecomapas", headers, new_row):
             return True, "Ecomapa actualizado."
-        else:
-            ws.append_row(new_row)
-            return True, "Ecomapa guardado."
+        return True, "Ecomapa guardado."
             
     except Exception as e:
-        return False, f"Error ecomapa: {e}"
+        st.error(f"Error guardando el ecomapa: {e}")
+        raise  # Cancela todo el lote: la evaluación tampoco se envía
 
 
 def update_rem_p7(n_inscritas_sol=0, n_inscritas_luna=0):
@@ -1331,16 +1483,13 @@ def update_rem_p7(n_inscritas_sol=0, n_inscritas_luna=0):
         n_inscritas_sol:  N° total de familias inscritas en sector Sol
         n_inscritas_luna: N° total de familias inscritas en sector Luna
     """
-    client = get_google_sheet_client()
-    if not client:
+    db = get_db()
+    if db is None:
         return False, "Error de conexión."
     try:
-        spreadsheet = client.open_by_url(SHEET_URL)
-
         # ------- Leer datos de evaluaciones -------
         try:
-            ws_eval = spreadsheet.worksheet("Evaluaciones")
-            eval_data = ws_eval.get_all_values()
+            eval_data = db.read_table("Evaluaciones")
         except:
             eval_data = []
 
@@ -1354,8 +1503,7 @@ def update_rem_p7(n_inscritas_sol=0, n_inscritas_luna=0):
 
         # ------- Leer datos de planes -------
         try:
-            ws_plan = spreadsheet.worksheet("Planes de Intervención")
-            plan_data = ws_plan.get_all_values()
+            plan_data = db.read_table("Planes de Intervención")
         except:
             plan_data = []
 
@@ -1477,9 +1625,7 @@ def update_rem_p7(n_inscritas_sol=0, n_inscritas_luna=0):
         ]
 
         # ------- Escribir en Hoja REM-P7 -------
-        ws_rem = get_or_create_worksheet(spreadsheet, "REM-P7")
-        ws_rem.clear()
-        ws_rem.update(range_name="A1", values=rows)
+        db.write_table("REM-P7", rows)
 
         return True, f"Hoja REM-P7 actualizada ({tot_eval} evaluaciones procesadas)."
 
@@ -1711,14 +1857,20 @@ def render_family_fragment():
     all_ruts = get_all_ruts_mapping()
     current_eval_id = st.session_state.get('idEvaluacion', '')
     dupe_list = []
+    invalid_list = []
     for idx, m_row in edited_family.iterrows():
-        m_rut = str(m_row.get("RUT", "")).strip().upper()
-        if m_rut in all_ruts:
-            fam_name, other_id = all_ruts[m_rut]
-            if other_id != current_eval_id:
-                dupe_list.append(f"• **{m_rut}** ({m_row.get('Nombre y Apellidos', 'Sin nombre')}) ya existe en la familia: **{fam_name}** (ID: {other_id})")
+        m_rut = canonical_rut(m_row.get("RUT", ""))
+        if not m_rut:
+            continue
+        m_name = m_row.get('Nombre y Apellidos', 'Sin nombre')
+        if not is_valid_rut(m_rut):
+            invalid_list.append(f"• **{format_rut(m_rut)}** ({m_name})")
+        for fam_name, other_id, _ in all_ruts.other_families(m_rut, current_eval_id):
+            dupe_list.append(f"• **{format_rut(m_rut)}** ({m_name}) ya existe en la familia: **{fam_name}** (ID: {other_id})")
     if dupe_list:
         st.warning("⚠️ **Alerta de Duplicidad detectada:**\n\n" + "\n".join(dupe_list))
+    if invalid_list:
+        st.warning("⚠️ **RUT con dígito verificador inválido:**\n\n" + "\n".join(invalid_list))
 
 @st.fragment
 def render_plan_fragment():
@@ -1791,6 +1943,12 @@ def main():
         render_login_page()
         return
 
+    # Hilo de envío del diario: vacía la cola de salida y reintenta guardados que no llegaron a Sheets
+    try:
+        _outbox_worker()
+    except Exception as e:
+        logger.warning("Error iniciando el envío en segundo plano: %s", e)
+
     # Si está autenticado, cargar sidebar con info de usuario
     user_info = st.session_state.user_info
     with st.sidebar:
@@ -1845,11 +2003,9 @@ def main():
                     st.session_state.user_info['Programa/Unidad'] = "Equipo de Sector Luna"
                 
                 st.warning(f"Simulando: **{sim_profile}** (Privilegios restringidos)")
-                # Forzar recarga de datos con el nuevo filtro RBAC
+                # Forzar recarga de datos con el nuevo filtro RBAC (la foto compartida se filtra en cada lectura)
                 if 'df_evaluaciones' in st.session_state:
                     del st.session_state['df_evaluaciones']
-                if 'raw_analytics_df' in st.session_state:
-                    del st.session_state['raw_analytics_df']
             else:
                 # Restaurar rol original
                 st.session_state.user_info['rol'] = st.session_state.real_role
@@ -1927,15 +2083,29 @@ def main():
             st.markdown('<div style="font-size: 0.8rem; color: #64748b; margin-bottom: 10px;">Forzar recarga de datos desde la base de datos.</div>', unsafe_allow_html=True)
             if st.button("🔄 Sincronizar Datos", type="secondary", width='stretch'):
                 with st.spinner("Actualizando datos..."):
-                    st.cache_data.clear()
+                    # Solo se publica una nueva versión si hubo cambios (o si el backend no puede detectarlos)
+                    db = get_db()
+                    if db is not None:
+                        db.reconcile()
+                        if not db.tracks_changes and invalidate_evaluaciones_cache:
+                            invalidate_evaluaciones_cache()
                     if 'df_evaluaciones' in st.session_state:
                         del st.session_state['df_evaluaciones']
-                    if 'raw_analytics_df' in st.session_state:
-                        del st.session_state['raw_analytics_df']
-                    if 'raw_df_ts' in st.session_state:
-                        del st.session_state['raw_df_ts']
                     st.rerun()
 
+            # Cola de guardados del diario local (journal.py): pendientes de envío y conflictos
+            try:
+                cola = get_save_journal().counts()
+            except Exception:
+                cola = {}
+            if cola.get(PENDING) or cola.get(CONFLICT):
+                st.caption(f"📤 Guardados en cola: {cola.get(PENDING, 0)} · con conflicto: {cola.get(CONFLICT, 0)}")
+                if cola.get(PENDING) and st.button("📤 Enviar cola ahora", width='stretch'):
+                    with st.spinner("Enviando guardados en cola..."):
+                        resultados = _outbox_worker().drain_once(due=False)
+                    enviados = sum(1 for r in resultados.values() if r == DONE)
+                    st.toast(f"Guardados enviados: {enviados} de {len(resultados)}")
+
         with st.container(border=True):
             st.markdown('<div style="font-weight: 700; font-size: 0.9rem; color: #334155; margin-bottom: 8px;">Búsqueda Directa</div>', unsafe_allow_html=True)
             search_id = st.text_input("ID Evaluación", placeholder="Ej: FAM-0123...", label_visibility="collapsed")
@@ -2008,20 +2178,27 @@ def main():
 
         # Cargar datos para el listado y búsqueda (Usamos la función centralizada de analytics)
         from analytics import load_evaluaciones_df
-        df_display = load_evaluaciones_df(est_filter=selected_est_filter)
+        # Solo las columnas del listado: evita bajar los JSON
+        list_cols = ["ID Evaluación", "Familia", "Sector", "Nivel", "Establecimiento"]
+        df_display = load_evaluaciones_df(est_filter=selected_est_filter, columns=list_cols)
         
-        # Filtro de búsqueda (se aplica sobre los datos ya filtrados por RBAC y Establecimiento)
-        if search_query:
-            q = search_query.lower()
-            mask = (
-                df_display['Familia'].astype(str).str.lower().str.contains(q, na=False) | 
-                df_display['Dirección'].astype(str).str.lower().str.contains(q, na=False) |
-                df_display['Grupo Familiar JSON'].astype(str).str.lower().str.contains(q, na=False)
-            )
-            df_display = df_display[mask]
+        # Filtro de búsqueda (índice por versión de datos; se cruza con lo ya filtrado por RBAC y Establecimiento)
+        busqueda_aproximada = False
+        if search_query and not df_display.empty:
+            from analytics import search_evaluaciones, fuzzy_search_evaluaciones
+            hits = search_evaluaciones(search_query)
+            if not hits:
+                # Sin coincidencias exactas: apellidos/nombres parecidos (tildes, errores de tipeo)
+                hits = [eval_id for eval_id, _ in fuzzy_search_evaluaciones(search_query)]
+                busqueda_aproximada = bool(hits)
+            ranked = df_display[df_display['ID Evaluación'].isin(hits)]
+            order = {eval_id: i for i, eval_id in enumerate(hits)}
+            df_display = ranked.iloc[ranked['ID Evaluación'].map(order).argsort(kind='stable')]
 
         with st.expander("📋 Mis Encuestas Familiares"):
             st.caption(f"Fichas autorizadas para: **{selected_est_filter}**")
+            if busqueda_aproximada:
+                st.caption(f"🔎 Sin coincidencias exactas para **{search_query}**; se muestran apellidos y nombres parecidos.")
             # En este punto df_display YA está filtrado por RBAC, Establecimiento y Búsqueda
             if not df_display.empty:
                 # Mostrar columnas clave
@@ -2086,6 +2263,75 @@ def main():
                             st.balloons()
                         else:
                             st.error(f"❌ {msg_m}")
+            with st.expander("🪪 RUT repetidos entre familias"):
+                st.caption("Integrantes cuyo RUT aparece en más de una evaluación (toda la población visible).")
+                if st.button("🔍 Generar reporte", width='stretch', key="btn_rut_dup"):
+                    from analytics import load_members_df
+                    with st.spinner("Agrupando integrantes por RUT..."):
+                        st.session_state['rut_dup_report'] = duplicate_members_report(load_members_df())
+                rep = st.session_state.get('rut_dup_report')
+                if rep is not None:
+                    if rep.empty:
+                        st.success("✅ No hay RUT repetidos entre familias.")
+                    else:
+                        st.metric("RUT repetidos", rep["RUT"].nunique())
+                        st.dataframe(rep, hide_index=True, width='stretch')
+                        buf_dup, err_dup = duplicate_report_excel(rep)
+                        if err_dup:
+                            st.error(f"❌ {err_dup}")
+                        else:
+                            st.download_button(
+                                label="⬇️ Descargar Excel",
+                                data=buf_dup,
+                                file_name=f"RUT_Duplicados_{date.today().strftime('%Y%m%d')}.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                width='stretch'
+                            )
+            with st.expander("👥 Publicar tabla de integrantes"):
+                st.caption("Reescribe la hoja **Integrantes** (una fila por persona) desde el Grupo Familiar de cada evaluación.")
+                if st.button("📤 Publicar Integrantes", width='stretch'):
+                    with st.spinner("Publicando integrantes..."):
+                        ok_p, msg_p = publish_members_table()
+                    if ok_p:
+                        st.success(f"✅ {msg_p}")
+                    else:
+                        st.error(f"❌ {msg_p}")
+            with st.expander("🗂️ Consultar auditoría"):
+                render_audit_admin()
+            with st.expander("🧹 Revisar IDs repetidos y huérfanos"):
+                st.caption("Busca IDs de evaluación repetidos y filas de Planes/Ecomapas sin evaluación, y propone una corrección.")
+                borrar_huerfanas = st.checkbox("Eliminar filas huérfanas", value=False, key="ids_borrar_huerfanas")
+                if st.button("🔍 Analizar IDs", width='stretch'):
+                    with st.spinner("Revisando hojas..."):
+                        ok_c, plan_c = check_eval_id_consistency(borrar_huerfanas)
+                    if ok_c:
+                        st.session_state['ids_fix_plan'] = plan_c
+                    else:
+                        st.session_state.pop('ids_fix_plan', None)
+                        st.error(f"❌ {plan_c}")
+                plan_c = st.session_state.get('ids_fix_plan')
+                if plan_c:
+                    c1, c2, c3 = st.columns(3)
+                    c1.metric("Repetidos", len(plan_c["duplicates"]))
+                    c2.metric("Renumerados", len(plan_c["renumbered"]))
+                    c3.metric("Huérfanas", len(plan_c["orphans"]))
+                    if plan_c["renumbered"]:
+                        st.dataframe(pd.DataFrame(plan_c["renumbered"], columns=["ID actual", "ID nuevo", "Familia"]),
+                                     hide_index=True, width='stretch')
+                    if plan_c["orphans"]:
+                        st.dataframe(pd.DataFrame(plan_c["orphans"], columns=["Hoja", "Fila", "ID Evaluación", "Familia"]),
+                                     hide_index=True, width='stretch')
+                    if not plan_has_changes(plan_c):
+                        st.success("✅ No hay correcciones pendientes.")
+                    elif st.button("🛠️ Aplicar corrección", type="primary", width='stretch'):
+                        with st.spinner("Aplicando corrección..."):
+                            ok_f, msg_f, n_f = apply_eval_id_fixes(plan_c)
+                        st.session_state.pop('ids_fix_plan', None)
+                        if ok_f:
+                            log_audit_event(st.session_state.user_info, "Corrección de IDs", f"{n_f} filas modificadas")
+                            st.success(f"✅ {msg_f}")
+                        else:
+                            st.error(f"❌ {msg_f}")
 
 
 
@@ -2284,6 +2530,8 @@ def main():
 
         st.markdown("---")
         # Barra de acciones de estudio
+        render_save_conflict()
+        render_pending_save()
         col_s1, col_s2 = st.columns([1, 4])
         with col_s1:
             if st.button("💾 Guardar Estudio Completo", type="primary", width='stretch'):
@@ -2292,7 +2540,7 @@ def main():
                     # 1. Preparar datos para Hoja 1 (Evaluaciones)
                     # ---- EXTRAER RUTs DEL GRUPO FAMILIAR ----
                     def normalizar_rut(rut_str):
-                        return rut_str.replace(".", "").strip()
+                        return canonical_rut(rut_str) or rut_str.replace(".", "").strip()
 
                     df_fam_rut = st.session_state.family_members.fillna("")
                     if 'RUT' in df_fam_rut.columns:
@@ -2323,23 +2571,23 @@ def main():
                                 return pd.to_datetime(x, dayfirst=True).date() if pd.notnull(x) and str(x).strip() != "" else None
                             except: return None
                         df_fam['F. Nac'] = df_fam['F. Nac'].apply(to_date_safe_fnac)
-                    data_row.append(json.dumps(df_fam.to_dict('records'), ensure_ascii=False, default=str))
+                    data_row.append(dump_json_column(df_fam.to_dict('records')))
                     
                     df_plan_save = apply_edits_df(st.session_state.intervention_plan, "intervention_editor").copy()
                     for c in ['Fecha Prog', 'Fecha Real', 'F. Seguimiento']:
                         if c in df_plan_save.columns:
                             df_plan_save[c] = df_plan_save[c].apply(lambda x: x.strftime('%Y-%m-%d') if pd.notnull(x) and hasattr(x, 'strftime') else "")
-                    data_row.append(json.dumps(df_plan_save.fillna("").to_dict('records'), ensure_ascii=False, default=str))
+                    data_row.append(dump_json_column(df_plan_save.fillna("").to_dict('records')))
                     
                     df_team = apply_edits_df(st.session_state.team_members, "team_editor").fillna("")
-                    data_row.append(json.dumps(df_team.to_dict('records'), ensure_ascii=False, default=str))
+                    data_row.append(dump_json_column(df_team.to_dict('records')))
 
-                    rel_json = json.dumps(st.session_state.get('interpersonal_relations', []), ensure_ascii=False)
+                    rel_json = dump_json_column(st.session_state.get('interpersonal_relations', []))
                     data_row.append(rel_json)
                     
                     # Seguimiento del Plan
                     df_seg_save = apply_edits_df(st.session_state.get('seguimiento_plan', pd.DataFrame()), "seguimiento_editor").copy()
-                    data_row.append(json.dumps(df_seg_save.fillna('').to_dict('records'), ensure_ascii=False, default=str))
+                    data_row.append(dump_json_column(df_seg_save.fillna('').to_dict('records')))
                     
                     # Extra data (APGAR)
                     data_row.extend([
@@ -2382,24 +2630,33 @@ def main():
                         "Fecha Egreso", "Observaciones", "Carpeta Digital (Drive)"
                     ]
 
-                    # 2. Guardar en Sheets
-                    ok1, msg1 = save_evaluacion_to_sheet(data_row, final_headers)
-                    ok2, msg2 = save_intervention_rows(eval_id, familia_val, str(st.session_state.get('fechaEvaluacion', date.today())), nivel_val, prog_val, st.session_state.get('parentesco', ''), df_plan_save)
-                    
-                    # 3. Guardar Ecomapa
-                    ecomap_elements = {
-                        "selected_systems": selected_systems, 
-                        "system_flows": system_flows,
-                        "active_risks": active_risks
-                    }
-                    ok3, msg3 = save_ecomap_to_sheet(eval_id, familia_val, ecomap_elements)
-                    
+                    # 2. Guardar en Sheets (evaluación, plan, ecomapa y auditoría en una sola solicitud)
+                    try:
+                        with save_batch(eval_id):
+                            ok1, msg1 = save_evaluacion_to_sheet(data_row, final_headers)
+                            ok2, msg2 = save_intervention_rows(eval_id, familia_val, str(st.session_state.get('fechaEvaluacion', date.today())), nivel_val, prog_val, st.session_state.get('parentesco', ''), df_plan_save)
+                            
+                            # 3. Guardar Ecomapa
+                            ecomap_elements = {
+                                "selected_systems": selected_systems, 
+                                "system_flows": system_flows,
+                                "active_risks": active_risks
+                            }
+                            ok3, msg3 = save_ecomap_to_sheet(eval_id, familia_val, ecomap_elements)
+                            
+                            if ok1 and ok2:
+                                # Auditoría de Guardado/Actualización
+                                _es_registro_existente = bool(eval_id and eval_id != 'N/A')
+                                accion_audit = "Actualización de Registro" if _es_registro_existente else "Creación de Registro"
+                                log_audit_event(st.session_state.user_info, accion_audit, f"Evaluación guardada en Sheets. Familia: {familia_val}", eval_id=eval_id)
+                    except RevisionConflict:
+                        st.rerun()  # Muestra el panel de conflicto (render_save_conflict)
+                    except Exception as e:
+                        if st.session_state.get('envio_pendiente'):
+                            st.rerun()  # Muestra el aviso de reenvío (render_pending_save)
+                        ok1, msg1, ok2, msg2 = False, f"No se pudieron enviar los cambios a Sheets: {e}", False, ""
+
                     if ok1 and ok2:
-                        # Auditoría de Guardado/Actualización
-                        _es_registro_existente = bool(eval_id and eval_id != 'N/A')
-                        accion_audit = "Actualización de Registro" if _es_registro_existente else "Creación de Registro"
-                        log_audit_event(st.session_state.user_info, accion_audit, f"Evaluación guardada en Sheets. Familia: {familia_val}", eval_id=eval_id)
-                        
                         st.success(f"✅ Estudio Completo Guardado: {msg1} | {msg2} | {msg3}")
                         st.balloons()
                     else:
@@ -2443,6 +2700,7 @@ def main():
                     f'🏷️ {id_actual}</div>',
                     unsafe_allow_html=True
                 )
+                render_sync_status(id_actual)
             else:
                 # Registro nuevo: sin ID aún
                 st.markdown(
@@ -2820,6 +3078,8 @@ def main():
     evaluador_nombre = st.text_input("Nombre Evaluador (para registro digital):", key="evaluadorName")
     
     # ---- BOTONES GUARDAR Y DESCARGAR ----
+    render_save_conflict()
+    render_pending_save()
     col_save, col_down = st.columns([3, 1])
     
     with col_save:
@@ -2832,7 +3092,11 @@ def main():
                 # Si es registro nuevo, generar el ID ahora con el apellido ingresado
                 if not id_evaluacion:
                     familia_para_id = st.session_state.get('familia', '')
-                    id_evaluacion = generate_incremental_eval_id(familia_para_id)
+                    try:
+                        id_evaluacion = generate_incremental_eval_id(familia_para_id)
+                    except RuntimeError as e:
+                        st.error(f"❌ No se guardó el registro: {e} Intente nuevamente en unos segundos.")
+                        st.stop()
                     st.session_state['idEvaluacion'] = id_evaluacion
 
                 # Leer valores actuales desde session_state
@@ -2841,8 +3105,8 @@ def main():
 
                 # ---- EXTRAER RUTs DEL GRUPO FAMILIAR (sin puntos: 1234567-8) ----
                 def normalizar_rut(rut_str):
-                    """Elimina puntos del RUT, conserva solo guión como separador."""
-                    return rut_str.replace(".", "").strip()
+                    """RUT canónico sin puntos (1234567-8); otros textos solo sin puntos."""
+                    return canonical_rut(rut_str) or rut_str.replace(".", "").strip()
 
                 df_fam_rut = apply_edits_df(st.session_state.family_members, "family_editor").fillna("")
                 if 'RUT' in df_fam_rut.columns:
@@ -2879,22 +3143,22 @@ def main():
                             return pd.to_datetime(x, dayfirst=True).date() if pd.notnull(x) and str(x).strip() != "" else None
                         except: return None
                     df_fam['F. Nac'] = df_fam['F. Nac'].apply(to_date_safe_fnac)
-                family_json = json.dumps(df_fam.to_dict('records'), ensure_ascii=False, default=str)
+                family_json = dump_json_column(df_fam.to_dict('records'))
                 
                 df_plan_save = apply_edits_df(st.session_state.intervention_plan, "intervention_editor").copy()
                 for c in ['Fecha Prog', 'Fecha Real', 'F. Seguimiento']:
                     if c in df_plan_save.columns:
                         df_plan_save[c] = df_plan_save[c].apply(lambda x: x.strftime('%Y-%m-%d') if pd.notnull(x) and hasattr(x, 'strftime') else "")
-                plan_json = json.dumps(df_plan_save.fillna("").to_dict('records'), ensure_ascii=False, default=str)
+                plan_json = dump_json_column(df_plan_save.fillna("").to_dict('records'))
                 
                 df_team = apply_edits_df(st.session_state.team_members, "team_editor").fillna("")
-                team_json = json.dumps(df_team.to_dict('records'), ensure_ascii=False, default=str)
+                team_json = dump_json_column(df_team.to_dict('records'))
                 
-                rel_json = json.dumps(st.session_state.get('interpersonal_relations', []), ensure_ascii=False)
+                rel_json = dump_json_column(st.session_state.get('interpersonal_relations', []))
                 
                 # Seguimiento del Plan
                 df_seg_save = apply_edits_df(st.session_state.get('seguimiento_plan', pd.DataFrame()), "seguimiento_editor").copy()
-                seg_json = json.dumps(df_seg_save.fillna('').to_dict('records'), ensure_ascii=False, default=str)
+                seg_json = dump_json_column(df_seg_save.fillna('').to_dict('records'))
                 
                 # Extra data (APGAR)
                 apgar_val = st.session_state.get('apgar_total', 0)
@@ -2953,23 +3217,37 @@ def main():
                     "Fecha Egreso", "Observaciones", "Carpeta Digital (Drive)"
                 ]
                 
-                success1, msg1 = save_evaluacion_to_sheet(data_row, final_headers)
-                
-                # ---- HOJA 2: PLANES DE INTERVENCIÓN ----
-                success2, msg2 = save_intervention_rows(
-                    id_evaluacion,
-                    familia,
-                    str(fecha_input),
-                    level,
-                    _programa,
-                    _parentesco,
-                    df_plan_save
-                )
+                # Evaluación y plan viajan en una sola solicitud a Sheets
+                try:
+                    with save_batch(id_evaluacion):
+                        success1, msg1 = save_evaluacion_to_sheet(data_row, final_headers)
+                        
+                        # ---- HOJA 2: PLANES DE INTERVENCIÓN ----
+                        success2, msg2 = save_intervention_rows(
+                            id_evaluacion,
+                            familia,
+                            str(fecha_input),
+                            level,
+                            _programa,
+                            _parentesco,
+                            df_plan_save
+                        )
+                except RevisionConflict:
+                    st.rerun()  # Muestra el panel de conflicto (render_save_conflict)
+                except Exception as e:
+                    if st.session_state.get('envio_pendiente'):
+                        st.rerun()  # Muestra el aviso de reenvío (render_pending_save)
+                    success1, msg1, success2, msg2 = False, f"No se pudieron enviar los cambios a Sheets: {e}", False, ""
 
                 # ---- HOJA 3: REM-P7 (auto-actualizar) ----
                 _sol_ins  = st.session_state.get('n_inscritas_sol', 0)
                 _luna_ins = st.session_state.get('n_inscritas_luna', 0)
-                success3, msg3 = update_rem_p7(_sol_ins, _luna_ins)
+                if outbox_enabled():
+                    # En cola el guardado aún no llega a Sheets: regenerar la hoja ahí esperaría la
+                    # conexión (y no contaría esta ficha). Se actualiza desde "Actualizar REM-P7".
+                    success3, msg3 = False, "no se regenera con la cola local activa; usa «Actualizar REM-P7» con conexión."
+                else:
+                    success3, msg3 = update_rem_p7(_sol_ins, _luna_ins)
                 
                 if success1 and success2:
                     rem_info = f"\n\n📊 REM-P7: {msg3}" if success3 else f"\n\n⚠️ REM-P7: {msg3}"
@@ -0,0 +1,272 @@
+"""
+audit.py — Registro de auditoría con búfer en memoria y envío por lotes.
+log() no espera a Sheets: agrega el evento al búfer y a un archivo local (una línea JSON por
+evento) y retorna. Un hilo de fondo envía el búfer en una sola solicitud cada AUDIT_FLUSH_SECONDS
+o apenas junta AUDIT_FLUSH_SIZE eventos; recién entonces los saca del archivo. Si el proceso se
+cae, los eventos que quedaron en el archivo se envían al volver a partir; si Sheets falla, se
+reintentan en la pasada siguiente.
+Los eventos se guardan en una hoja por mes ("Auditoría 2025-03", ver storage.audit_partition) y
+se consultan en un índice SQLite local (AuditIndex) por usuario, acción e ID Evaluación: solo las
+hojas de meses aún abiertos se vuelven a leer; la hoja histórica y los meses cerrados se leen una vez.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import streamlit as st
+
+from storage import AUDIT_HEADERS, AUDIT_PARTITION_PREFIX, AUDIT_TABLE, DATA_DIR, audit_partition, get_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPILL_PATH = os.path.join(DATA_DIR, "audit_spill.jsonl")
+DEFAULT_INDEX_PATH = os.path.join(DATA_DIR, "audit_index.sqlite3")
+
+AUDIT_FLUSH_SECONDS = 10
+AUDIT_FLUSH_SIZE = 50
+AUDIT_SYNC_SECONDS = 300    # Relectura de las hojas de meses abiertos (eventos de otras réplicas)
+AUDIT_PAGE_SIZE = 50
+
+_INDEX_COLUMNS = ("ts", "usuario", "cargo", "accion", "detalles", "eval_id")   # = AUDIT_HEADERS
+
+
+def _next_month(month):
+    """'2025-12' -> '2026-01'."""
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12}-{mon % 12 + 1:02d}"
+
+
+def _is_closed(partition, now):
+    """
+    La hoja histórica ya no recibe eventos; una hoja mensual se da por cerrada un día después de
+    terminar su mes (margen para los eventos que otras réplicas aún tenían en su búfer).
+    """
+    if partition == AUDIT_TABLE:
+        return True
+    month = partition[len(AUDIT_PARTITION_PREFIX):]
+    return now.strftime("%Y-%m-%d") >= _next_month(month) + "-02"
+
+
+class AuditIndex:
+    """Índice local de los eventos de auditoría (una fila por evento, con la hoja de origen)."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._lock = threading.RLock()
+        self._last_sync = None
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS events (partition TEXT, ts TEXT, usuario TEXT, cargo TEXT,"
+                             " accion TEXT, detalles TEXT, eval_id TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_events_ts ON events (ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_events_usuario ON events (usuario, ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_events_accion ON events (accion, ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_events_eval ON events (eval_id, ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_events_partition ON events (partition)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS partitions (name TEXT PRIMARY KEY, synced TEXT, closed INTEGER)")
+
+    @staticmethod
+    def _cells(row):
+        row = [str(v).strip() for v in row][:len(AUDIT_HEADERS)]
+        return row + [""] * (len(AUDIT_HEADERS) - len(row))
+
+    def _insert(self, partition, rows):
+        self._db.executemany(f"INSERT INTO events (partition, {', '.join(_INDEX_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             [[partition] + self._cells(r) for r in rows])
+
+    def add(self, rows):
+        """Agrega eventos recién enviados (cada uno en la hoja de su mes)."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    self._insert(audit_partition(row[0] if row else ""), [row])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _replace(self, partition, rows, synced, closed):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM events WHERE partition = ?", (partition,))
+                self._insert(partition, rows)
+                self._db.execute("INSERT OR REPLACE INTO partitions (name, synced, closed) VALUES (?, ?, ?)",
+                                 (partition, synced, int(closed)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def sync(self, backend, force=False, full=False):
+        """
+        Trae al índice lo que está en las hojas y no pasó por este proceso (otras réplicas, eventos
+        anteriores al índice). Lee completas solo las hojas no indexadas o de meses abiertos, a lo
+        más cada AUDIT_SYNC_SECONDS salvo force; full=True vuelve a leer también las cerradas.
+        Retorna cuántas hojas se leyeron.
+        """
+        now = datetime.now()
+        if not (force or full) and self._last_sync and (now - self._last_sync).total_seconds() < AUDIT_SYNC_SECONDS:
+            return 0
+        with self._lock:
+            closed = {r[0] for r in self._db.execute("SELECT name FROM partitions WHERE closed = 1")}
+        read = 0
+        for partition in backend.audit_partitions():
+            if partition in closed and not full:
+                continue
+            values = backend.read_table(partition)
+            header = [str(h).strip() for h in values[0]] if values else []
+            # Columnas por nombre (la hoja histórica pudo tener otro orden), por posición si falta
+            cols = [header.index(h) if h in header else i for i, h in enumerate(AUDIT_HEADERS)]
+            rows = [[r[c] if c < len(r) else "" for c in cols] for r in values[1:] if any(str(v).strip() for v in r)]
+            self._replace(partition, rows, now.isoformat(timespec="seconds"), _is_closed(partition, now))
+            read += 1
+        self._last_sync = now
+        return read
+
+    def _where(self, usuario="", accion="", eval_id="", since=None, until=None):
+        clauses, params = [], []
+        for col, value in (("usuario", usuario), ("accion", accion), ("eval_id", eval_id)):
+            if str(value or "").strip():
+                clauses.append(f"{col} = ?")
+                params.append(str(value).strip())
+        if since:
+            clauses.append("ts >= ?")
+            params.append(since.strftime("%Y-%m-%d"))
+        if until:
+            clauses.append("ts < ?")
+            params.append((until + timedelta(days=1)).strftime("%Y-%m-%d"))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, usuario="", accion="", eval_id="", since=None, until=None, limit=AUDIT_PAGE_SIZE, offset=0):
+        """
+        Eventos que cumplen los filtros (vacío = sin filtro; since/until son fechas inclusivas), del
+        más reciente al más antiguo. Retorna (filas de AUDIT_HEADERS de la página, total).
+        """
+        where, params = self._where(usuario, accion, eval_id, since, until)
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM events{where}", params).fetchone()[0]
+            rows = self._db.execute(f"SELECT {', '.join(_INDEX_COLUMNS)} FROM events{where}"
+                                    " ORDER BY ts DESC, rowid DESC LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        return [list(r) for r in rows], total
+
+    def distinct(self, column):
+        """Valores distintos de 'usuario' o 'accion' (opciones de los filtros)."""
+        if column not in ("usuario", "accion"):
+            raise ValueError(f"Columna no indexada: {column}")
+        with self._lock:
+            return [r[0] for r in self._db.execute(f"SELECT DISTINCT {column} FROM events WHERE {column} != '' ORDER BY {column}")]
+
+    def partitions(self):
+        """[(hoja, última lectura, cerrada)] de las hojas indexadas."""
+        with self._lock:
+            return [(n, s, bool(c)) for n, s, c in self._db.execute("SELECT name, synced, closed FROM partitions ORDER BY name")]
+
+
+class AuditBuffer:
+    """Eventos de auditoría pendientes de envío, respaldados en un archivo JSONL local."""
+
+    def __init__(self, backend, spill_path=DEFAULT_SPILL_PATH, flush_size=AUDIT_FLUSH_SIZE,
+                 flush_seconds=AUDIT_FLUSH_SECONDS, index=None):
+        self.backend = backend
+        self.index = index                      # AuditIndex que recibe los eventos enviados (opcional)
+        self.spill_path = spill_path
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._rows = []
+        self._lock = threading.Lock()           # Búfer y archivo
+        self._flush_lock = threading.Lock()     # Un envío a la vez
+        self._wake = threading.Event()
+        os.makedirs(os.path.dirname(spill_path) or ".", exist_ok=True)
+        self._rows = self._read_spill()         # Eventos que no alcanzaron a enviarse antes de una caída
+
+    def _read_spill(self):
+        if not os.path.exists(self.spill_path):
+            return []
+        rows = []
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue  # Última línea truncada por la caída
+        return rows
+
+    def _rewrite_spill(self):
+        tmp = self.spill_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in self._rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.spill_path)
+
+    def log(self, row):
+        """Encola un evento (fila de AUDIT_HEADERS). Solo escribe una línea en el archivo local."""
+        row = [str(v) for v in row]
+        with self._lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self._rows.append(row)
+            full = len(self._rows) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self):
+        """Envía todo el búfer en una sola solicitud. Retorna cuántos eventos se enviaron."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._rows)
+            if not rows:
+                return 0
+            self.backend.append_audit_rows(rows)
+            with self._lock:
+                # Lo que llegó mientras se enviaba queda para la próxima pasada
+                self._rows = self._rows[len(rows):]
+                self._rewrite_spill()
+            if self.index is not None:
+                try:
+                    self.index.add(rows)
+                except Exception:
+                    logger.exception("Error indexando auditoría (se corrige al sincronizar)")
+            return len(rows)
+
+    def sync_index(self, force=False, full=False):
+        """AuditIndex.sync sin cruzarse con un envío (el índice no duplica ni pierde el lote en curso)."""
+        with self._flush_lock:
+            return self.index.sync(self.backend, force=force, full=full)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Error enviando auditoría (se reintenta): %s", e)
+
+    def start(self):
+        threading.Thread(target=self._run, name="audit-flush", daemon=True).start()
+        atexit.register(self._flush_quietly)
+        return self
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("Auditoría pendiente queda en %s: %s", self.spill_path, e)
+
+
+@st.cache_resource(show_spinner=False)
+def get_audit_buffer():
+    """Búfer único por proceso, con su hilo de envío y el índice local de consultas."""
+    return AuditBuffer(get_storage(), index=AuditIndex()).start()
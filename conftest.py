@@ -0,0 +1,239 @@
+"""
+conftest.py — Fixtures compartidas de las pruebas (pytest).
+FakeSpreadsheet imita la parte de gspread / Sheets API v4 que usa SheetsBackend (lecturas por rango,
+append, update, batch_update con updateCells/appendCells/deleteDimension), con las mismas reglas de
+formato: las celdas vuelven como texto, las filas y columnas vacías del final se omiten en las
+lecturas por rango y los números enteros se leen sin decimales. Así las pruebas de paridad corren los
+tres backends contra la misma grilla sin red ni credenciales.
+"""
+import re
+
+import gspread
+import pytest
+
+from sheets_client import SheetsConnection
+from storage import MemoryBackend, SheetsBackend, SQLiteBackend, WriteBatch, to_cell
+
+# test_form.py es una página de Streamlit de prueba manual, no una prueba de pytest
+collect_ignore = ["test_form.py"]
+
+_A1_RE = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+
+def _col(letters):
+    """Letras A1 -> índice de columna base 0 (None si no hay letras)."""
+    if not letters:
+        return None
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def _rendered(cell):
+    """Valor que Sheets devuelve (FORMATTED_VALUE) para una celda de la API v4."""
+    value = cell.get("userEnteredValue", {})
+    if "stringValue" in value:
+        return value["stringValue"]
+    if "boolValue" in value:
+        return "TRUE" if value["boolValue"] else "FALSE"
+    if "formulaValue" in value:
+        return value["formulaValue"]
+    if "numberValue" in value:
+        number = value["numberValue"]
+        return str(int(number)) if float(number).is_integer() else str(number)
+    return ""
+
+
+def _entered(value, value_input_option):
+    """Texto que queda en la celda al escribir `value` con RAW o USER_ENTERED."""
+    if value_input_option == "USER_ENTERED":
+        return _rendered(WriteBatch._parsed_cell(value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return to_cell(value)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, cols=26):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.col_count = cols
+        self.rows = []
+        self.calls = []     # (método, argumento) de cada llamada, para contar lecturas
+
+    # --- Grilla ---
+    def _set(self, row_num, col, values):
+        while len(self.rows) < row_num:
+            self.rows.append([])
+        row = self.rows[row_num - 1]
+        row += [""] * (col + len(values) - len(row))
+        row[col:col + len(values)] = values
+
+    def _last_row(self):
+        filled = [n for n, row in enumerate(self.rows, 1) if any(c != "" for c in row)]
+        return filled[-1] if filled else 0
+
+    def _range(self, a1):
+        a1 = a1.split("!")[-1]
+        found = _A1_RE.match(a1)
+        c1, r1, c2, r2 = found.groups()
+        if found.group(3) is None and found.group(4) is None:
+            c2, r2 = c1, r1
+        first_row = int(r1) if r1 else 1
+        last_row = int(r2) if r2 else max(len(self.rows), first_row)
+        first_col = _col(c1) or 0
+        last_col = _col(c2)
+        return first_row, last_row, first_col, last_col
+
+    # --- gspread ---
+    def get_all_values(self):
+        self.calls.append(("get_all_values", None))
+        height = self._last_row()
+        width = max([len(row) for row in self.rows[:height]] + [0])
+        return [list(row) + [""] * (width - len(row)) for row in self.rows[:height]]
+
+    def batch_get(self, ranges):
+        self.calls.append(("batch_get", tuple(ranges)))
+        out = []
+        for a1 in ranges:
+            first_row, last_row, first_col, last_col = self._range(a1)
+            block = []
+            for n in range(first_row, last_row + 1):
+                row = self.rows[n - 1] if n <= len(self.rows) else []
+                cells = row[first_col:None if last_col is None else last_col + 1]
+                while cells and cells[-1] == "":
+                    cells = cells[:-1]
+                block.append(list(cells))
+            while block and not block[-1]:
+                block.pop()
+            out.append(block)
+        return out
+
+    def update(self, range_name=None, values=None, value_input_option="RAW"):
+        self.calls.append(("update", range_name))
+        first_row, _, first_col, _ = self._range(range_name)
+        for offset, row in enumerate(values):
+            self._set(first_row + offset, first_col, [_entered(v, value_input_option) for v in row])
+
+    def batch_update(self, data, value_input_option="RAW"):
+        self.calls.append(("batch_update", len(data)))
+        for item in data:
+            self.update(item["range"], item["values"], value_input_option)
+
+    def append_row(self, values, value_input_option="RAW"):
+        return self.append_rows([values], value_input_option)
+
+    def append_rows(self, values, value_input_option="RAW", insert_data_option=None, table_range=None):
+        self.calls.append(("append_rows", len(values)))
+        start = self._last_row() + 1
+        for offset, row in enumerate(values):
+            self._set(start + offset, 0, [_entered(v, value_input_option) for v in row])
+        end = start + len(values) - 1
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:Z{end}"}}
+
+    def add_cols(self, n):
+        self.col_count += n
+
+    def clear(self):
+        self.calls.append(("clear", None))
+        self.rows = []
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self._sheets = {}
+        self.batch_updates = 0
+
+    def worksheet(self, title):
+        if title not in self._sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def add_worksheet(self, title, rows="1000", cols="26"):
+        ws = FakeWorksheet(self, len(self._sheets) + 1, title, int(cols))
+        self._sheets[title] = ws
+        return ws
+
+    def worksheets(self):
+        return list(self._sheets.values())
+
+    def _by_id(self, sheet_id):
+        return next(ws for ws in self._sheets.values() if ws.id == sheet_id)
+
+    def batch_update(self, body):
+        self.batch_updates += 1
+        for request in body["requests"]:
+            (kind, spec), = request.items()
+            if kind == "appendDimension":
+                self._by_id(spec["sheetId"]).add_cols(spec["length"])
+            elif kind == "updateCells" and "rows" in spec:
+                ws = self._by_id(spec["start"]["sheetId"])
+                for offset, row in enumerate(spec["rows"]):
+                    ws._set(spec["start"]["rowIndex"] + 1 + offset, spec["start"]["columnIndex"],
+                            [_rendered(c) for c in row["values"]])
+            elif kind == "updateCells":
+                self._by_id(spec["range"]["sheetId"]).rows = []
+            elif kind == "deleteDimension":
+                ws = self._by_id(spec["range"]["sheetId"])
+                del ws.rows[spec["range"]["startIndex"]:spec["range"]["endIndex"]]
+            elif kind == "appendCells":
+                ws = self._by_id(spec["sheetId"])
+                start = ws._last_row() + 1
+                for offset, row in enumerate(spec["rows"]):
+                    ws._set(start + offset, 0, [_rendered(c) for c in row["values"]])
+            else:
+                raise AssertionError(f"Solicitud no soportada: {kind}")
+        return {}
+
+
+def fake_connection(spreadsheet=None):
+    """SheetsConnection real (caché de handles) sobre una planilla falsa, sin credenciales."""
+    conn = SheetsConnection({})
+    conn._spreadsheet = spreadsheet or FakeSpreadsheet()
+    return conn
+
+
+@pytest.fixture
+def spreadsheet():
+    return FakeSpreadsheet()
+
+
+@pytest.fixture
+def sheets_backend(spreadsheet):
+    return SheetsBackend(fake_connection(spreadsheet))
+
+
+@pytest.fixture(params=["memory", "sqlite", "sheets"])
+def backend(request, tmp_path):
+    """Cada prueba que la usa corre contra los tres backends."""
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "gen_enc.sqlite3"))
+    return SheetsBackend(fake_connection())
+
+
+@pytest.fixture
+def memory_storage(monkeypatch, tmp_path):
+    """
+    get_storage() y los recursos por proceso que dependen de él (bus de versiones, foto de
+    Evaluaciones) sobre un MemoryBackend nuevo, aislado de las demás pruebas.
+    """
+    import storage
+    from data_version import get_version_bus
+    monkeypatch.setenv("GEN_ENC_STORAGE", "memory")
+    monkeypatch.delenv("GEN_ENC_OUTBOX", raising=False)
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+    resources = [storage.get_storage, get_version_bus]
+    try:
+        from analytics import _rut_registry, _snapshot_store
+        resources += [_snapshot_store, _rut_registry]
+    except ImportError:
+        pass  # Sin plotly: las pruebas del dashboard se omiten
+    for resource in resources:
+        resource.clear()
+    yield storage.get_storage()
+    for resource in resources:
+        resource.clear()
@@ -0,0 +1,156 @@
+"""
+consistency.py — Revisión de integridad de "ID Evaluación" entre Evaluaciones, Planes de Intervención y Ecomapas.
+Una sola pasada con diccionarios por hoja (lineal en el número de filas) detecta:
+  - IDs repetidos en Evaluaciones: la primera fila es la vigente (upsert y find_row siempre usan la
+    primera); las repeticiones de la misma familia son copias obsoletas y se eliminan, y las de otra
+    familia son registros distintos que recibieron el mismo ID y se renumeran
+  - Filas de Planes/Ecomapas que apuntan a una evaluación renumerada (se reasignan por Familia)
+  - Ecomapas repetidos para un mismo ID (se conserva la primera fila, igual que upsert_row)
+  - Filas huérfanas de Planes/Ecomapas cuyo ID no existe en Evaluaciones (solo se eliminan si se pide)
+El plan de corrección se aplica con escrituras masivas (update_rows + delete_rows por hoja) en un solo lote,
+después de comprobar contra la fuente de verdad que cada fila destino sigue teniendo el ID revisado.
+"""
+from storage import ID_COL, key_index, trim_row
+
+EVAL_TABLE = "Evaluaciones"
+CHILD_TABLES = ("Planes de Intervención", "Ecomapas")
+ECO_TABLE = "Ecomapas"
+FAMILY_COL = "Familia"
+
+
+class StalePlan(Exception):
+    """Una fila destino ya no tiene el ID con que se revisó (la hoja cambió después de la revisión)."""
+
+    def __init__(self, table, row_num, expected, current):
+        super().__init__(f"La fila {row_num} de '{table}' cambió desde la revisión "
+                         f"(se esperaba '{expected}', ahora '{current}'). Vuelva a revisar.")
+        self.table, self.row_num, self.expected, self.current = table, row_num, expected, current
+
+
+def _cell(row, idx):
+    return str(row[idx]).strip() if idx is not None and idx < len(row) else ""
+
+
+def _family_key(value):
+    return " ".join(str(value).lower().split())
+
+
+def _family_index(headers):
+    return headers.index(FAMILY_COL) if FAMILY_COL in headers else None
+
+
+def build_fix_plan(tables, new_id, delete_orphans=False):
+    """
+    tables: {hoja: grilla completa (encabezados + filas)} para Evaluaciones y CHILD_TABLES.
+    new_id(familia): genera un ID nuevo para un registro renumerado.
+    Retorna el plan: {"updates": {hoja: {n_fila: fila}}, "deletes": {hoja: [n_fila]},
+    "keys": {hoja: {n_fila: ID revisado}}, "duplicates", "renumbered", "orphans", "blank"}
+    (las tres últimas como listas para mostrar). "keys" cubre cada fila de updates y deletes.
+    """
+    plan = {"updates": {}, "deletes": {}, "keys": {}, "duplicates": [], "renumbered": [], "orphans": [],
+            "blank": []}
+    evals = tables.get(EVAL_TABLE) or []
+    if len(evals) < 2:
+        return plan
+    headers = evals[0]
+    id_idx, fam_idx = key_index(headers, ID_COL), _family_index(headers)
+
+    # 1. Evaluaciones: primera aparición de cada ID y familias de las repeticiones
+    first = {}        # ID -> familia normalizada de la fila vigente
+    moved = {}        # ID -> {familia normalizada: ID nuevo}
+    for n, row in enumerate(evals[1:], 2):
+        eval_id = _cell(row, id_idx)
+        if not eval_id:
+            if trim_row(row):
+                plan["blank"].append((EVAL_TABLE, n))
+            continue
+        family = _family_key(_cell(row, fam_idx))
+        if eval_id not in first:
+            first[eval_id] = family
+            continue
+        plan["duplicates"].append((eval_id, n, _cell(row, fam_idx)))
+        if family == first[eval_id] or family in moved.get(eval_id, {}):
+            plan["deletes"].setdefault(EVAL_TABLE, []).append(n)
+            continue
+        replacement = new_id(_cell(row, fam_idx))
+        moved.setdefault(eval_id, {})[family] = replacement
+        updated = list(row)
+        updated[id_idx] = replacement
+        plan["updates"].setdefault(EVAL_TABLE, {})[n] = updated
+        plan["renumbered"].append((eval_id, replacement, _cell(row, fam_idx)))
+
+    # 2. Hojas hijas: reasignar por familia, quitar ecomapas repetidos y detectar huérfanas
+    for table in CHILD_TABLES:
+        values = tables.get(table) or []
+        if len(values) < 2:
+            continue
+        child_id, child_fam = key_index(values[0], ID_COL), _family_index(values[0])
+        seen = set()
+        for n, row in enumerate(values[1:], 2):
+            eval_id = _cell(row, child_id)
+            if not eval_id:
+                if trim_row(row):
+                    plan["blank"].append((table, n))
+                continue
+            if eval_id not in first:
+                plan["orphans"].append((table, n, eval_id, _cell(row, child_fam)))
+                if delete_orphans:
+                    plan["deletes"].setdefault(table, []).append(n)
+                continue
+            target = moved.get(eval_id, {}).get(_family_key(_cell(row, child_fam)), eval_id)
+            if table == ECO_TABLE:
+                if target in seen:
+                    plan["deletes"].setdefault(table, []).append(n)
+                    continue
+                seen.add(target)
+            if target != eval_id:
+                updated = list(row)
+                updated[child_id] = target
+                plan["updates"].setdefault(table, {})[n] = updated
+    for table, values in tables.items():
+        rows = set(plan["updates"].get(table) or {}) | set(plan["deletes"].get(table) or [])
+        if rows:
+            idx = key_index(values[0], ID_COL)
+            plan["keys"][table] = {n: _cell(values[n - 1], idx) for n in sorted(rows)}
+    return plan
+
+
+def plan_has_changes(plan):
+    return any(plan["updates"].values()) or any(plan["deletes"].values())
+
+
+def check_row_keys(db, expected, key_col=ID_COL):
+    """
+    expected: {hoja: {n_fila: ID}}. Lee solo esas filas (y los encabezados) desde la fuente de verdad
+    y lanza StalePlan si alguna ya no tiene el ID esperado: las escrituras por número de fila no
+    deben caer sobre filas que se movieron o cambiaron desde que se armó el plan.
+    """
+    for table, keys in expected.items():
+        if not keys:
+            continue
+        rows = db.read_rows(table, [1] + list(keys))
+        idx = key_index(rows.get(1) or [], key_col)
+        for n, key in keys.items():
+            current = _cell(rows.get(n) or [], idx)
+            if current != key:
+                raise StalePlan(table, n, key, current)
+
+
+def apply_fix_plan(db, plan):
+    """
+    Aplica el plan en un solo lote: por hoja, primero las sobrescrituras y luego las eliminaciones
+    (ambas con la numeración previa). Antes comprueba que las filas destino no cambiaron
+    (check_row_keys). Retorna el número de filas modificadas.
+    """
+    check_row_keys(db, plan.get("keys") or {})
+    changed = 0
+    with db.batch():
+        for table in (EVAL_TABLE,) + CHILD_TABLES:
+            updates = plan["updates"].get(table) or {}
+            deletes = plan["deletes"].get(table) or []
+            if updates:
+                db.update_rows(table, updates)
+            if deletes:
+                db.delete_rows(table, deletes)
+            changed += len(updates) + len(deletes)
+    return changed
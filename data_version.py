@@ -0,0 +1,97 @@
+"""
+data_version.py — Bus de versiones de datos para invalidar cachés entre sesiones.
+Cada tabla ("tema") tiene una versión entera monótona que sube cuando sus datos cambian:
+guardados de cualquier sesión o cambios detectados al reconciliar el espejo con Sheets.
+Las cachés (foto de Evaluaciones, mapa de RUTs) guardan la versión con la que se construyeron
+y se recargan solo cuando cambia, en vez de vencer cada 5 minutos.
+  - VersionBus: contador en memoria, compartido por todas las sesiones del proceso
+  - SQLiteVersionBus: contador en un archivo SQLite local, compartido por varias réplicas
+    que montan el mismo volumen ([storage] version_bus = "sqlite")
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from storage import DATA_DIR, get_storage, storage_settings
+
+DEFAULT_VERSION_PATH = os.path.join(DATA_DIR, "versions.sqlite3")
+
+# Respaldo si el backend no detecta cambios hechos fuera de la app (Sheets sin espejo)
+FALLBACK_TTL_SECONDS = 300
+
+
+class VersionBus:
+    """Versiones por tema en memoria del proceso."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def current(self, topic):
+        with self._lock:
+            return self._versions.get(topic, 0)
+
+    def bump(self, topic):
+        """Marca el tema como modificado. Retorna la nueva versión."""
+        with self._lock:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            return self._versions[topic]
+
+
+class SQLiteVersionBus(VersionBus):
+    """Versiones por tema en un archivo SQLite (visible para todos los procesos que lo abran)."""
+
+    def __init__(self, path=DEFAULT_VERSION_PATH):
+        super().__init__()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS data_versions (topic TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def current(self, topic):
+        with self._lock:
+            found = self._db.execute("SELECT version FROM data_versions WHERE topic = ?", (topic,)).fetchone()
+        return found[0] if found else 0
+
+    def bump(self, topic):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO data_versions (topic, version) VALUES (?, 1) "
+                    "ON CONFLICT(topic) DO UPDATE SET version = version + 1", (topic,))
+                version = self._db.execute("SELECT version FROM data_versions WHERE topic = ?", (topic,)).fetchone()[0]
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return version
+
+
+@st.cache_resource(show_spinner=False)
+def get_version_bus():
+    """Bus único por proceso. [storage] version_bus = "process" (defecto) | "sqlite"."""
+    settings = storage_settings()
+    if settings.get("version_bus") == "sqlite":
+        return SQLiteVersionBus(settings.get("version_path", DEFAULT_VERSION_PATH))
+    return VersionBus()
+
+
+def data_version(topic):
+    """
+    Clave de versión para cachés del tema: (versión del bus, época).
+    La época solo avanza (cada FALLBACK_TTL_SECONDS) si el backend no detecta por sí mismo
+    los cambios externos; con espejo o base local la caché vive hasta el próximo cambio.
+    """
+    epoch = 0 if get_storage().tracks_changes else int(time.time() // FALLBACK_TTL_SECONDS)
+    return get_version_bus().current(topic), epoch
+
+
+def notify_change(topic):
+    """Publica que los datos del tema cambiaron (todas las sesiones recargarán sus cachés)."""
+    return get_version_bus().bump(topic)
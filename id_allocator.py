@@ -0,0 +1,143 @@
+"""
+id_allocator.py — Asignación de IDs de Evaluación (EVA-NNN) sin colisiones.
+El contador vive en el backend (hoja "Secuencia EVA" en Sheets, tabla _sequences en SQLite) y se
+avanza de forma atómica (ver StorageBackend.reserve_ids). Los números reservados se guardan en
+un archivo SQLite local (id_pool.sqlite3) y se entregan desde ahí, así que generar un ID no lee
+la hoja Evaluaciones y solo cuesta una escritura pequeña cada ID_BLOCK registros nuevos.
+La reserva va adelantada: apenas quedan menos de ID_RESERVE números se pide otro bloque. Con la
+cola de salida (postas sin conexión) esa reposición va en segundo plano y las fichas nuevas
+reciben su ID del archivo local sin esperar a Sheets; si la reserva local se agota sin conexión,
+next() propaga el error del backend y la ficha nueva no se guarda hasta que vuelva la conexión.
+Los números reservados que no se alcanzan a usar (archivo local perdido) quedan como saltos en
+la numeración; nunca se repiten.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import streamlit as st
+
+from storage import DATA_DIR, ID_COL, get_storage
+
+logger = logging.getLogger(__name__)
+
+EVAL_SEQUENCE = "EVA"
+ID_BLOCK = 5
+ID_RESERVE = 20     # Números que se mantienen reservados por adelantado (fichas nuevas sin conexión)
+DEFAULT_POOL_PATH = os.path.join(DATA_DIR, "id_pool.sqlite3")
+
+_EVA_RE = re.compile(r"^EVA-(\d+)")
+
+
+def max_eval_number(values):
+    """Mayor N de los IDs EVA-NNN-... en una grilla (encabezados + filas) con la columna de IDs."""
+    if len(values) < 2:
+        return 0
+    col = values[0].index(ID_COL) if ID_COL in values[0] else 0
+    numbers = [int(m.group(1)) for row in values[1:] if len(row) > col
+               for m in [_EVA_RE.match(str(row[col]).strip())] if m]
+    return max(numbers, default=0)
+
+
+class IdAllocator:
+    """
+    Entrega números consecutivos de una secuencia a partir de bloques reservados en el backend.
+    pool_path: archivo SQLite donde quedan los números reservados y aún no entregados (sin él, la
+    reserva vive en memoria y se pierde al reiniciar). Varios procesos pueden compartir el archivo.
+    """
+
+    def __init__(self, backend, sequence, seed=None, block=ID_BLOCK, reserve=ID_RESERVE, pool_path=None):
+        self.backend = backend
+        self.sequence = sequence
+        self.seed = seed        # Último número usado si la secuencia aún no existe en el backend
+        self.block = block
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._refilling = False
+        if pool_path:
+            os.makedirs(os.path.dirname(pool_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(pool_path or ":memory:", check_same_thread=False, isolation_level=None, timeout=10)
+        with self._lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS pool (sequence TEXT, number INTEGER, "
+                             "PRIMARY KEY (sequence, number))")
+
+    def next(self, background=False):
+        """
+        Próximo número. background=True (cola de salida): la reposición de la reserva no se espera;
+        solo si la reserva local está vacía se pide un bloque en el acto.
+        """
+        number = self._take()
+        if number is None:
+            self.refill()
+            number = self._take()
+            if number is None:
+                raise RuntimeError("la reserva local de IDs está vacía")
+        if self.available() < self.reserve:
+            if background:
+                self._refill_in_background()
+            else:
+                self.refill()
+        return number
+
+    def available(self):
+        """Números reservados que aún no se entregan."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pool WHERE sequence = ?", (self.sequence,)).fetchone()[0]
+
+    def refill(self):
+        """Reserva en el backend lo que falta para volver a tener `reserve` números (al menos un bloque)."""
+        count = max(self.block, self.reserve - self.available())
+        numbers = self.backend.reserve_ids(self.sequence, count, self.seed)
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO pool (sequence, number) VALUES (?, ?)",
+                                 [(self.sequence, n) for n in numbers])
+
+    def _take(self):
+        # BEGIN IMMEDIATE: dos procesos que comparten el archivo nunca entregan el mismo número
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                found = self._db.execute("SELECT MIN(number) FROM pool WHERE sequence = ?", (self.sequence,)).fetchone()
+                if found[0] is not None:
+                    self._db.execute("DELETE FROM pool WHERE sequence = ? AND number = ?", (self.sequence, found[0]))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return found[0]
+
+    def _refill_in_background(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill_quietly, daemon=True).start()
+
+    def _refill_quietly(self):
+        try:
+            self.refill()
+        except Exception as e:
+            # Sin conexión: se reintenta con la próxima ficha nueva
+            logger.warning("No se pudo reponer la reserva de IDs %s: %s", self.sequence, e)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def reset(self, value):
+        """Reinicia la secuencia en `value` (último número usado) y descarta la reserva local."""
+        with self._lock:
+            self._db.execute("DELETE FROM pool WHERE sequence = ?", (self.sequence,))
+        self.backend.reset_sequence(self.sequence, value)
+
+
+@st.cache_resource(show_spinner=False)
+def get_eval_id_allocator():
+    """
+    Asignador único por proceso, con la reserva en DATA_DIR (sobrevive a reinicios); la primera vez
+    se siembra con el mayor EVA-NNN existente.
+    """
+    backend = get_storage()
+    return IdAllocator(backend, EVAL_SEQUENCE, pool_path=DEFAULT_POOL_PATH,
+                       seed=lambda: max_eval_number(backend.read_projection("Evaluaciones", [ID_COL])))
@@ -0,0 +1,437 @@
+"""
+journal.py — Diario local (write-ahead) de los guardados.
+Cada "Guardar" abre una entrada y anota, en orden, las escrituras que hace (evaluación, plan de
+intervención, ecomapa) con sus argumentos. La entrada queda "pendiente" apenas se anotó
+el guardado completo y "hecho" cuando Sheets lo confirmó. Si el envío falla (cuota, timeout, caída
+del proceso), roll_forward() reenvía solo los pasos que falten: reintentar ya no rehace ni relee
+el guardado completo.
+Con [storage] outbox = true (postas con conectividad intermitente) el guardado no espera a Sheets:
+se anota en el diario como "pendiente" (cola local) y OutboxWorker lo envía en segundo plano,
+agrupando varios guardados por solicitud y reintentando con espera exponencial si no hay conexión.
+El mismo hilo reenvía los guardados directos que fallaron.
+Los pasos son idempotentes: upsert, celdas y filas hijas se ubican por clave, y los de Evaluaciones
+llevan la revisión y la Fecha Actualización que escriben (la marca del guardado), así que al reenviar
+se omiten si la fila ya tiene esa misma marca y la entrada se abandona ("conflicto") si otro usuario
+guardó entremedio. Los append son "al menos una vez".
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import streamlit as st
+
+from storage import DATA_DIR, ID_COL, get_storage, key_index, storage_settings, to_cell, trim_row
+from sync import REVISION_COL, STAMP_COL, current_revision
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_PATH = os.path.join(DATA_DIR, "journal.sqlite3")
+
+# Cola de salida: sondeo del hilo, guardados por solicitud y espera entre reintentos (segundos)
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_BATCH = 10
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 600
+
+# Escrituras del backend que se anotan (el resto de la interfaz no pasa por el diario)
+JOURNALED_METHODS = ("upsert_row", "update_cells", "replace_child_rows", "append_rows", "append_audit")
+
+# Resultado de una escritura encolada (aún sin N° de fila)
+QUEUED = -1
+
+# Estados de una entrada
+OPEN = "abierto"            # Guardado en curso (aún no se anotan todos sus pasos)
+PENDING = "pendiente"       # Completo en el diario, falta confirmar pasos en la base
+DONE = "hecho"
+CONFLICT = "conflicto"      # Otro usuario guardó el registro antes del reenvío
+DISCARDED = "descartado"    # Falló antes de anotarse completo, o lo reemplazó un guardado posterior
+
+
+def _guard(method, args, kwargs):
+    """
+    (hoja, clave, columna clave, revisión escrita, Fecha Actualización escrita) de un paso sobre una
+    fila con Revisión, o None.
+    """
+    names = {"upsert_row": ("table", "headers", "row", "key_col"),
+             "update_cells": ("table", "headers", "key_value", "changes", "key_col")}.get(method)
+    if names is None:
+        return None
+    params = dict(zip(names, args), **kwargs)
+    key_col = params.get("key_col", ID_COL)
+    if method == "upsert_row":
+        values = dict(zip(params["headers"], params["row"]))
+        key = params["row"][key_index(params["headers"], key_col)]
+    else:
+        values, key = params["changes"], params["key_value"]
+    if REVISION_COL not in values:
+        return None
+    stamp = str(values.get(STAMP_COL, "")).strip()
+    return params["table"], str(key).strip(), key_col, current_revision(values), stamp
+
+
+class SaveJournal:
+    """Entradas de guardado y sus pasos en un archivo SQLite local."""
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._running = set()       # Entradas que se están reenviando en este proceso
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS saves (id TEXT PRIMARY KEY, key TEXT, user TEXT, created TEXT, "
+                "status TEXT, attempts INTEGER DEFAULT 0, error TEXT DEFAULT '')")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS steps (save_id TEXT, seq INTEGER, method TEXT, args TEXT, "
+                "guard TEXT, done INTEGER DEFAULT 0, PRIMARY KEY (save_id, seq))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_saves_status ON saves (status)")
+            columns = [r[1] for r in self._db.execute("PRAGMA table_info(saves)")]
+            if "next_attempt" not in columns:
+                self._db.execute("ALTER TABLE saves ADD COLUMN next_attempt REAL DEFAULT 0")
+
+    # --- Anotación ---
+    def begin(self, key="", user=""):
+        """Abre una entrada para un guardado. Retorna su id."""
+        save_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("INSERT INTO saves (id, key, user, created, status) VALUES (?, ?, ?, ?, ?)",
+                             (save_id, str(key or ""), user, datetime.now().isoformat(timespec="seconds"), OPEN))
+        return save_id
+
+    def record(self, save_id, method, args, kwargs=None):
+        """Anota un paso (método del backend y sus argumentos) al final de la entrada."""
+        kwargs = kwargs or {}
+        guard = _guard(method, args, kwargs)
+        payload = json.dumps({"args": list(args), "kwargs": kwargs}, ensure_ascii=False, default=to_cell)
+        with self._lock:
+            seq = self._db.execute("SELECT COUNT(*) FROM steps WHERE save_id = ?", (save_id,)).fetchone()[0]
+            self._db.execute("INSERT INTO steps (save_id, seq, method, args, guard) VALUES (?, ?, ?, ?, ?)",
+                             (save_id, seq, method, payload, json.dumps(guard) if guard else None))
+
+    def seal(self, save_id):
+        """El guardado quedó anotado completo: desde ahora se puede reenviar."""
+        self._set_status(save_id, PENDING)
+
+    def complete(self, save_id):
+        """La base confirmó todos los pasos. Las entradas pendientes anteriores del mismo registro quedan obsoletas."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("UPDATE steps SET done = 1 WHERE save_id = ?", (save_id,))
+                self._db.execute("UPDATE saves SET status = ?, error = '' WHERE id = ?", (DONE, save_id))
+                key, rowid = self._db.execute("SELECT key, rowid FROM saves WHERE id = ?", (save_id,)).fetchone()
+                if key:
+                    self._db.execute("UPDATE saves SET status = ? WHERE key = ? AND status = ? AND rowid < ?",
+                                     (DISCARDED, key, PENDING, rowid))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def discard(self, save_id):
+        self._set_status(save_id, DISCARDED)
+
+    def fail(self, save_id, error):
+        """Registra un intento de envío fallido: la entrada sigue pendiente y espera antes del próximo."""
+        with self._lock:
+            found = self._db.execute("SELECT attempts FROM saves WHERE id = ?", (save_id,)).fetchone()
+            wait = min(BACKOFF_BASE_SECONDS * 2 ** (found[0] if found else 0), BACKOFF_MAX_SECONDS)
+            self._db.execute("UPDATE saves SET attempts = attempts + 1, error = ?, next_attempt = ? WHERE id = ?",
+                             (str(error), time.time() + wait, save_id))
+
+    def _set_status(self, save_id, status):
+        with self._lock:
+            self._db.execute("UPDATE saves SET status = ? WHERE id = ?", (status, save_id))
+
+    # --- Consulta ---
+    def entry(self, save_id):
+        with self._lock:
+            found = self._db.execute(
+                "SELECT id, key, user, created, status, attempts, error, next_attempt FROM saves WHERE id = ?",
+                (save_id,)).fetchone()
+            if not found:
+                return None
+            steps = self._db.execute("SELECT COUNT(*), SUM(done) FROM steps WHERE save_id = ?", (save_id,)).fetchone()
+        entry = dict(zip(("id", "key", "user", "created", "status", "attempts", "error", "next_attempt"), found))
+        entry["steps"], entry["done"] = steps[0], steps[1] or 0
+        return entry
+
+    def pending(self):
+        """Entradas completas sin confirmar, de la más antigua a la más nueva."""
+        with self._lock:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM saves WHERE status = ? ORDER BY created, rowid", (PENDING,)).fetchall()]
+        return [self.entry(save_id) for save_id in ids]
+
+    def status(self, key):
+        """Última entrada de un registro (estado de sincronización para la UI), o None."""
+        with self._lock:
+            found = self._db.execute(
+                "SELECT id FROM saves WHERE key = ? AND status != ? ORDER BY created DESC, rowid DESC LIMIT 1",
+                (str(key), DISCARDED)).fetchone()
+        return self.entry(found[0]) if found else None
+
+    def counts(self):
+        """{estado: número de entradas}."""
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM saves GROUP BY status").fetchall())
+
+    def _open_steps(self, save_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT seq, method, args, guard FROM steps WHERE save_id = ? AND done = 0 ORDER BY seq", (save_id,)).fetchall()
+
+    def _mark_done(self, save_id, seq):
+        with self._lock:
+            self._db.execute("UPDATE steps SET done = 1 WHERE save_id = ? AND seq = ?", (save_id, seq))
+
+    # --- Reenvío ---
+    def roll_forward(self, db, save_id):
+        """Reenvía los pasos sin confirmar de una entrada pendiente. Retorna DONE, CONFLICT o PENDING."""
+        return self.drain(db, [save_id]).get(save_id, PENDING)
+
+    @staticmethod
+    def _arrived(current, revision, stamp):
+        """
+        True si la fila ya tiene lo que escribió este paso: la misma revisión y la misma Fecha
+        Actualización. Una revisión igual o mayor no basta: una fila nueva (revisión 1) con un ID
+        que ya existía en la base no se da por entregada, ni un guardado ajeno posterior.
+        """
+        if current_revision(current) != revision:
+            return False
+        return not stamp or str(current.get(STAMP_COL, "")).strip() == stamp
+
+    @staticmethod
+    def _row_ready(db, payload, current, headers):
+        """
+        True si un paso update_cells va a escribir: la hoja tiene los encabezados anotados y la fila
+        existe. current: celdas ya leídas de la fila (o None si no se leyeron o no existe).
+        headers: caché {hoja: encabezados} para la pasada.
+        """
+        call = json.loads(payload)
+        params = dict(zip(("table", "headers", "key_value", "changes", "key_col"), call["args"]), **call["kwargs"])
+        table, key_col = params["table"], params.get("key_col", ID_COL)
+        if table not in headers:
+            headers[table] = trim_row(db.read_rows(table, [1]).get(1) or [])
+        if headers[table] != trim_row(params["headers"]):
+            return False
+        if current is None:
+            current = db.read_cells(table, str(params["key_value"]).strip(), [key_col], key_col)
+        return current is not None
+
+    def _check_guards(self, db, steps):
+        """
+        Revisa los pasos de una entrada antes de escribir nada: las revisiones de las filas con
+        Revisión y, para update_cells, que la fila y sus encabezados sigan ahí. Así una entrada en
+        conflicto no deja pasos a medias en el lote compartido.
+        Retorna (pasos que faltan enviar, pasos que ya habían llegado) o None si hay conflicto.
+        """
+        send, arrived, headers = [], [], {}
+        for step in steps:
+            seq, method, payload, guard = step
+            current = None
+            if guard:
+                # Las entradas anotadas antes de la marca traen solo la revisión
+                table, key, key_col, revision, *stamp = json.loads(guard)
+                current = db.read_cells(table, key, [REVISION_COL, STAMP_COL], key_col)
+                if current is not None and self._arrived(current, revision, stamp[0] if stamp else ""):
+                    arrived.append(seq)
+                    continue
+                if current is not None and current_revision(current) != revision - 1:
+                    return None
+            if method == "update_cells" and not self._row_ready(db, payload, current, headers):
+                return None  # La fila ya no está donde se anotó (eliminada o encabezados cambiados)
+            send.append(step)
+        return send, arrived
+
+    def drain(self, db, save_ids):
+        """
+        Reenvía varias entradas pendientes en un solo lote (una solicitud a Sheets); solo los pasos
+        sin confirmar. Usar a lo más una entrada por registro por lote (las revisiones se leen antes
+        del envío). Retorna {id: estado final}.
+        """
+        with self._lock:
+            claimed = [i for i in dict.fromkeys(save_ids) if i not in self._running]
+            self._running.update(claimed)
+        results, sent = {}, {}
+        try:
+            with db.batch():
+                for save_id in claimed:
+                    entry = self.entry(save_id)
+                    if entry is None or entry["status"] != PENDING:
+                        results[save_id] = entry["status"] if entry else DISCARDED
+                        continue
+                    checked = self._check_guards(db, self._open_steps(save_id))
+                    if checked is None:
+                        self._set_status(save_id, CONFLICT)
+                        results[save_id] = CONFLICT
+                        continue
+                    send, arrived = checked
+                    for seq in arrived:
+                        self._mark_done(save_id, seq)
+                    for seq, method, payload, _ in send:
+                        call = json.loads(payload)
+                        result = getattr(db, method)(*call["args"], **call["kwargs"])
+                        if method == "update_cells" and result is None:
+                            # Solo si otra instancia borró la fila entre la revisión y este paso
+                            results[save_id] = CONFLICT
+                            break
+                    if results.get(save_id) == CONFLICT:
+                        self._set_status(save_id, CONFLICT)
+                        continue
+                    sent[save_id] = [step[0] for step in send]
+        except Exception as e:
+            for save_id in claimed:
+                if save_id not in results:
+                    self.fail(save_id, e)
+                    results[save_id] = PENDING
+            return results
+        finally:
+            with self._lock:
+                self._running.difference_update(claimed)
+        for save_id in sent:
+            self.complete(save_id)
+            results[save_id] = DONE
+        return results
+
+    def discard_stale(self, before):
+        """Descarta las entradas que quedaron a medio anotar por una caída anterior a `before` (ISO)."""
+        with self._lock:
+            self._db.execute("UPDATE saves SET status = ? WHERE status = ? AND created < ?", (DISCARDED, OPEN, before))
+
+
+class OutboxWorker:
+    """
+    Hilo que vacía la cola del diario: toma las entradas pendientes cuyo próximo intento ya venció
+    (la más antigua de cada registro), las envía en lotes de OUTBOX_BATCH y notifica on_change
+    cuando algún guardado llegó a la base.
+    """
+
+    def __init__(self, journal, backend, interval=OUTBOX_POLL_SECONDS, batch_size=OUTBOX_BATCH, on_change=None):
+        self.journal = journal
+        self.backend = backend
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_change = on_change
+        self._wake = threading.Event()
+        self._started = datetime.now().isoformat(timespec="seconds")
+
+    def start(self):
+        threading.Thread(target=self._run, name="journal-outbox", daemon=True).start()
+        return self
+
+    def wake(self):
+        """Pide un envío inmediato (p. ej. después de encolar un guardado)."""
+        self._wake.set()
+
+    def drain_once(self, due=True):
+        """Una pasada: envía lo que esté vencido (due=False: todo lo pendiente). Retorna {id: estado}."""
+        batch, keys, now = [], set(), time.time()
+        for entry in self.journal.pending():
+            # Los guardados de un mismo registro van en orden: el siguiente espera al anterior
+            if entry["key"] and entry["key"] in keys:
+                continue
+            keys.add(entry["key"])
+            if due and entry["next_attempt"] > now:
+                continue
+            batch.append(entry["id"])
+            if len(batch) >= self.batch_size:
+                break
+        results = self.journal.drain(self.backend, batch) if batch else {}
+        if self.on_change and DONE in results.values():
+            try:
+                self.on_change()
+            except Exception:
+                logger.exception("Error notificando guardados enviados")
+        return results
+
+    def _run(self):
+        self.journal.discard_stale(self._started)
+        while True:
+            try:
+                self.drain_once()
+            except Exception as e:
+                logger.warning("Error vaciando la cola de guardados: %s", e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+class JournaledBackend:
+    """
+    Envoltura del backend para la duración de un guardado: anota en el diario cada escritura de
+    JOURNALED_METHODS que se hizo (o quedó en el lote); las lecturas y el resto pasan directo.
+    queued=True (cola de salida): las escrituras solo se anotan y las envía OutboxWorker.
+    """
+
+    def __init__(self, backend, journal, save_id, queued=False):
+        self._backend = backend
+        self._journal = journal
+        self.save_id = save_id
+        self.queued = queued
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if name not in JOURNALED_METHODS:
+            return attr
+
+        def journaled(*args, **kwargs):
+            if self.queued:
+                self._journal.record(self.save_id, name, args, kwargs)
+                return QUEUED
+            result = attr(*args, **kwargs)
+            # update_cells sin fila no escribió nada (quien llama hace upsert_row, que sí se anota)
+            if not (name == "update_cells" and result is None):
+                self._journal.record(self.save_id, name, args, kwargs)
+            return result
+        return journaled
+
+
+@contextmanager
+def journaled_save(journal, db, key="", user="", queued=False):
+    """
+    Un guardado completo: abre la entrada y entrega el JournaledBackend con que el bloque escribe.
+    Sin cola, las escrituras van en un lote (db.batch()) que se envía al salir; la entrada se sella
+    antes del envío y se completa después. Si un paso del bloque lanza una excepción, no se envía
+    nada y la entrada se descarta; si falla el envío, la entrada queda pendiente (fail) para
+    roll_forward. En ambos casos la excepción se propaga.
+    """
+    save_id = journal.begin(key, user)
+    sealed = False
+    try:
+        with (nullcontext() if queued else db.batch()):
+            yield JournaledBackend(db, journal, save_id, queued=queued)
+            journal.seal(save_id)
+            sealed = True
+    except Exception as e:
+        if sealed:
+            journal.fail(save_id, e)
+        else:
+            journal.discard(save_id)
+        raise
+    if not queued:
+        journal.complete(save_id)
+
+
+def outbox_enabled():
+    """[storage] outbox = true (o GEN_ENC_OUTBOX=1): los guardados se encolan y se envían en segundo plano."""
+    return bool(storage_settings().get("outbox"))
+
+
+@st.cache_resource(show_spinner=False)
+def get_save_journal():
+    """Diario único por proceso, con su hilo de envío (reenvía también lo que quedó pendiente al reiniciar)."""
+    return SaveJournal()
+
+
+@st.cache_resource(show_spinner=False)
+def get_outbox_worker(_on_change=None):
+    """Hilo único por proceso que vacía la cola del diario contra el backend compartido."""
+    return OutboxWorker(get_save_journal(), get_storage(), on_change=_on_change).start()
@@ -0,0 +1,75 @@
+"""
+json_codec.py — Codificación compacta de las columnas JSON de Evaluaciones.
+Las columnas Grupo Familiar / Plan Intervención / Equipo Salud / Relaciones / Seguimiento Plan
+guardan listas de diccionarios que repiten las mismas claves en cada elemento. Con
+[storage] compact_json = true se escriben en formato columnar (claves una sola vez) y, si la
+carga supera COMPRESS_MIN_CHARS, comprimida con zlib + base64:
+  - JSON plano (histórico):  [{"Nombre y Apellidos": "Ana", "RUT": "1-9"}, ...]
+  - Columnar:                c1:{"k":["Nombre y Apellidos","RUT"],"v":[["Ana","1-9"],...]}
+  - Comprimido:              z1:<base64 de zlib(columnar o JSON)>
+decode_json() lee los tres formatos, así que las filas antiguas y las nuevas conviven y el
+formato de escritura se puede cambiar en cualquier momento. Aunque la opción esté apagada, una
+celda que superaría el límite de Sheets (CELL_LIMIT) se escribe comprimida.
+"""
+import base64
+import binascii
+import json
+import zlib
+
+JSON_COLUMNS = ("Grupo Familiar JSON", "Plan Intervención JSON", "Equipo Salud JSON",
+                "Relaciones JSON", "Seguimiento Plan JSON")
+
+COLUMNAR_PREFIX = "c1:"
+COMPRESSED_PREFIX = "z1:"
+COMPRESS_MIN_CHARS = 1024
+CELL_LIMIT = 50000          # Máximo de caracteres por celda en Google Sheets
+
+
+def _columnar(value):
+    """Lista de diccionarios con las mismas claves -> {"k": claves, "v": filas}; None si no aplica."""
+    if not isinstance(value, list) or not value or not all(isinstance(item, dict) for item in value):
+        return None
+    keys = list(value[0])
+    if any(list(item) != keys for item in value[1:]):
+        return None
+    return {"k": keys, "v": [list(item.values()) for item in value]}
+
+
+def _compress(text):
+    return COMPRESSED_PREFIX + base64.b64encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+
+
+def encode_json(value, compact=False):
+    """
+    Valor Python -> texto de celda. compact=False mantiene el JSON histórico (legible en la planilla);
+    compact=True usa el formato columnar y comprime las cargas grandes.
+    """
+    if not compact:
+        text = json.dumps(value, ensure_ascii=False, default=str)
+        return text if len(text) <= CELL_LIMIT else _compress(text)
+    table = _columnar(value)
+    if table is not None:
+        text = COLUMNAR_PREFIX + json.dumps(table, ensure_ascii=False, separators=(",", ":"), default=str)
+    else:
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+    if len(text) >= COMPRESS_MIN_CHARS:
+        packed = _compress(text)
+        if len(packed) < len(text):
+            return packed
+    return text
+
+
+def decode_json(text):
+    """Texto de celda (cualquiera de los tres formatos) -> valor Python. ValueError si no es válido."""
+    if isinstance(text, (list, dict)):
+        return text
+    text = str(text).strip()
+    if text.startswith(COMPRESSED_PREFIX):
+        try:
+            text = zlib.decompress(base64.b64decode(text[len(COMPRESSED_PREFIX):], validate=True)).decode("utf-8")
+        except (binascii.Error, zlib.error) as e:
+            raise ValueError(f"Celda JSON comprimida inválida: {e}") from e
+    if text.startswith(COLUMNAR_PREFIX):
+        table = json.loads(text[len(COLUMNAR_PREFIX):])
+        return [dict(zip(table["k"], row)) for row in table["v"]]
+    return json.loads(text)
@@ -0,0 +1,147 @@
+"""
+members.py — Tabla "Integrantes": una fila por integrante, explotada desde Grupo Familiar JSON.
+Los datos de cada integrante viven solo dentro de la celda JSON de su evaluación; esta tabla los
+deja en columnas tipadas para que las consultas por persona sean un solo filtro de pandas:
+
+    m = get_members_table()
+    m[m["Crónico"] & (m["Edad"] >= 65) & (m["Sector"].str.lower() == "luna")]
+
+Se calcula una vez por versión de datos (EvaluacionesSnapshot.derived) y puede publicarse como
+hoja/tabla propia con write_members_table().
+"""
+import io
+from datetime import date
+
+import pandas as pd
+
+from json_codec import decode_json
+from rut import canonical_rut
+from storage import to_cell
+
+MEMBERS_TABLE = "Integrantes"
+
+# Columnas de Evaluaciones que se copian a cada integrante
+EVAL_COLUMNS = ["ID Evaluación", "Fecha", "Familia", "Sector", "Establecimiento", "Programa/Unidad", "Nivel"]
+SOURCE_COLUMNS = EVAL_COLUMNS + ["Grupo Familiar JSON"]
+
+MEMBER_COLUMNS = EVAL_COLUMNS + [
+    "Posición", "Nombre y Apellidos", "RUT", "F. Nac", "Edad", "Género", "Parentesco",
+    "Pueblo Originario", "Nacionalidad", "Crónico", "Resp",
+]
+
+_LEGACY_SEXO = {"M": "Masculino", "F": "Femenino", "G": "Gestación/Aborto"}
+_TRUE_VALUES = {"TRUE", "1", "YES", "VERDADERO", "SI", "SÍ"}
+
+
+def _parse(gf_json):
+    try:
+        members = decode_json(gf_json) if gf_json else []
+    except (TypeError, ValueError):
+        return []
+    return [m for m in members if isinstance(m, dict)] if isinstance(members, list) else []
+
+
+def _as_bool(series):
+    return series.map(lambda v: v is True or str(v).strip().upper() in _TRUE_VALUES)
+
+
+def _text(frame, col):
+    return frame[col].fillna("").astype(str).str.strip() if col in frame.columns else pd.Series("", index=frame.index)
+
+
+def empty_members():
+    return pd.DataFrame({c: pd.Series(dtype="object") for c in MEMBER_COLUMNS})
+
+
+def explode_members(df, today=None):
+    """
+    Evaluaciones (con Grupo Familiar JSON) -> DataFrame de integrantes con columnas MEMBER_COLUMNS.
+    RUT en forma canónica, F. Nac como fecha (NaT si falta), Edad en años y Crónico/Resp booleanos.
+    """
+    if df is None or df.empty or "Grupo Familiar JSON" not in df.columns:
+        return empty_members()
+    base = df[[c for c in EVAL_COLUMNS if c in df.columns]].copy()
+    base["_miembro"] = df["Grupo Familiar JSON"].map(_parse)
+    base = base.explode("_miembro")
+    base = base[base["_miembro"].notna()]
+    if base.empty:
+        return empty_members()
+
+    raw = pd.DataFrame(base.pop("_miembro").tolist(), index=base.index)
+    out = base.reset_index(drop=True)
+    raw = raw.reset_index(drop=True)
+    for col in EVAL_COLUMNS:
+        if col not in out.columns:
+            out[col] = ""
+    out["Posición"] = out.groupby(base.index.values).cumcount().values
+
+    out["Nombre y Apellidos"] = _text(raw, "Nombre y Apellidos")
+    out["RUT"] = _text(raw, "RUT").map(canonical_rut)
+    fnac = _text(raw, "F. Nac").str.slice(0, 10)
+    # Formato de la app (AAAA-MM-DD) y, como respaldo, registros antiguos con día primero
+    parsed = pd.to_datetime(fnac, format="%Y-%m-%d", errors="coerce")
+    parsed = parsed.fillna(pd.to_datetime(fnac.where(parsed.isna()), dayfirst=True, errors="coerce", format="mixed"))
+    out["F. Nac"] = parsed.dt.date
+    ref = pd.Timestamp(today or date.today())
+    birthday_pending = (parsed.dt.month > ref.month) | ((parsed.dt.month == ref.month) & (parsed.dt.day > ref.day))
+    out["Edad"] = (ref.year - parsed.dt.year - birthday_pending.astype(int)).astype("Int64")
+
+    genero = _text(raw, "Identidad de género")
+    legacy = _text(raw, "Sexo").str.upper().map(lambda s: _LEGACY_SEXO.get(s, s))
+    out["Género"] = genero.where(genero != "", legacy)
+    out["Parentesco"] = _text(raw, "Parentesco")
+    out["Pueblo Originario"] = _text(raw, "Pueblo Originario")
+    out["Nacionalidad"] = _text(raw, "Nacionalidad")
+    out["Crónico"] = _as_bool(raw["Cronico"]) if "Cronico" in raw.columns else False
+    out["Resp"] = _as_bool(raw["Resp"]) if "Resp" in raw.columns else False
+    return out[MEMBER_COLUMNS]
+
+
+def members_grid(members):
+    """DataFrame de integrantes -> grilla (encabezados + filas de texto) para write_table."""
+    cells = members[MEMBER_COLUMNS].astype(object).where(members[MEMBER_COLUMNS].notna(), None)
+    return [MEMBER_COLUMNS] + [[to_cell(v) for v in row] for row in cells.itertuples(index=False)]
+
+
+def write_members_table(db, members):
+    """Publica la tabla de integrantes como hoja/tabla propia (reemplaza su contenido)."""
+    db.write_table(MEMBERS_TABLE, members_grid(members))
+    return len(members)
+
+
+REPORT_COLUMNS = ["RUT", "Familias", "Nombre y Apellidos", "ID Evaluación", "Familia", "Fecha",
+                  "Sector", "Establecimiento", "Parentesco"]
+
+
+def duplicate_members_report(members):
+    """
+    RUTs que aparecen en más de una evaluación (familia), en una sola pasada con agrupación por hash.
+    Una fila por aparición, agrupadas por RUT; primero los RUTs repetidos en más familias.
+    """
+    with_rut = members[members["RUT"] != ""]
+    if with_rut.empty:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    families = with_rut.groupby("RUT", sort=False)["ID Evaluación"].transform("nunique")
+    report = with_rut[families > 1].assign(Familias=families[families > 1])
+    report = report.sort_values(["Familias", "RUT", "Fecha"], ascending=[False, True, True], kind="stable")
+    return report[REPORT_COLUMNS].reset_index(drop=True)
+
+
+def duplicate_report_excel(report):
+    """Reporte de duplicados -> (BytesIO con el Excel, None) o (None, mensaje de error)."""
+    try:
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            report.to_excel(writer, sheet_name="RUT duplicados", index=False)
+            sheet = writer.sheets["RUT duplicados"]
+            sheet.freeze_panes = "A2"
+            sheet.auto_filter.ref = sheet.dimensions
+            for col, name in zip(sheet.columns, report.columns):
+                width = max([len(str(name))] + [len(str(c.value or "")) for c in col])
+                sheet.column_dimensions[col[0].column_letter].width = min(width + 2, 50)
+        buf.seek(0)
+        return buf, None
+    except ImportError:
+        return None, "Instala openpyxl: pip install openpyxl"
+    except Exception as e:
+        return None, f"Error generando Excel: {e}"
@@ -3,21 +3,15 @@ migrate_ids.py
 Migración directa de IDs de Evaluación al formato EVA-NNN-FAM-XXX en Google Sheets.
 Ejecutar desde la raíz del proyecto: python migrate_ids.py
 """
-import unicodedata
 import re
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import toml
+from storage import open_backend, DEFAULT_SQLITE_PATH
+from search_index import fold_accents
 
 # ----------- Cargar credenciales desde secrets.toml -----------
 secrets = toml.load(r".streamlit/secrets.toml")
 creds_dict = dict(secrets["gcp_service_account"])
 
-SCOPE = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive"
-]
-
 # Leer URL desde el mismo archivo o configurarlo aquí
 # Si la URL está en secrets.toml, leerla desde ahí; sino, escribirla directamente
 SHEET_URL = secrets.get("SHEET_URL", "")
@@ -37,27 +31,29 @@ if not SHEET_URL:
                 SHEET_URL = line.split("=", 1)[1].strip().strip('"').strip("'")
                 break
 
-print(f"✅ Conectando a: {SHEET_URL[:60]}...")
-
-credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
-client = gspread.authorize(credentials)
-spreadsheet = client.open_by_url(SHEET_URL)
+# Backend de persistencia: [storage] backend = "sheets" | "sqlite" en secrets.toml
+storage_cfg = dict(secrets.get("storage", {}))
+backend_kind = storage_cfg.get("backend", "sheets")
+if backend_kind == "sheets":
+    print(f"✅ Conectando a: {SHEET_URL[:60]}...")
+else:
+    print(f"✅ Usando backend local: {backend_kind}")
+db = open_backend(backend_kind, creds_dict=creds_dict, sheet_url=SHEET_URL,
+                  sqlite_path=storage_cfg.get("sqlite_path", DEFAULT_SQLITE_PATH))
 
 
 def clean_prefix(apellido):
     """Extrae 3 letras del apellido, sin tildes."""
     if not apellido or not str(apellido).strip():
         return "XXX"
-    s = unicodedata.normalize('NFD', str(apellido).strip())
-    s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
+    s = fold_accents(str(apellido).strip())
     s = ''.join(c for c in s if c.isalpha())
     return s[:3].upper() if len(s) >= 3 else s.upper().ljust(3, 'X')
 
 
 # ----------- Leer hoja Evaluaciones -----------
 print("📋 Leyendo hoja Evaluaciones...")
-ws_eval = spreadsheet.worksheet("Evaluaciones")
-all_vals = ws_eval.get_all_values()
+all_vals = db.read_table("Evaluaciones")
 
 if len(all_vals) < 2:
     print("⚠️ No hay registros en Evaluaciones. Nada que migrar.")
@@ -75,7 +71,7 @@ print()
 
 # ----------- Construir mapa ID_viejo → ID_nuevo -----------
 id_map = {}
-updates_eval = []
+updates_eval = {}
 counter = 1
 
 for row in data_rows:
@@ -87,51 +83,54 @@ for row in data_rows:
 
     updated_row = list(row)
     updated_row[id_col] = new_id
-    updates_eval.append((counter + 1, updated_row))  # +1 por encabezado
+    updates_eval[counter + 1] = updated_row  # +1 por encabezado
     print(f"   [{counter:03d}] {old_id or '(vacío)':40s} → {new_id}  (Familia: {apellido or 'N/A'})")
     counter += 1
 
 print()
 print("💾 Actualizando hoja Evaluaciones...")
-for sheet_row_num, updated_row in updates_eval:
-    ws_eval.update(range_name=f"A{sheet_row_num}", values=[updated_row])
-    print(f"   ✅ Fila {sheet_row_num} actualizada.")
+db.update_rows("Evaluaciones", updates_eval)
+print(f"   ✅ {len(updates_eval)} filas actualizadas.")
+# La secuencia de IDs (id_allocator.py) continúa después del último ID renumerado
+db.reset_sequence("EVA", counter - 1)
 
 # ----------- Actualizar Planes de Intervención -----------
 try:
-    ws_plan = spreadsheet.worksheet("Planes de Intervención")
-    plan_all = ws_plan.get_all_values()
+    plan_all = db.read_table("Planes de Intervención")
     if len(plan_all) > 1:
         plan_headers = plan_all[0]
         plan_id_col = plan_headers.index("ID Evaluación") if "ID Evaluación" in plan_headers else 0
         print(f"\n📋 Actualizando Planes de Intervención ({len(plan_all)-1} filas)...")
+        plan_updates = {}
         for i, row in enumerate(plan_all[1:], 2):
             if len(row) > plan_id_col:
                 old_id = str(row[plan_id_col]).strip()
                 if old_id in id_map:
                     updated_row = list(row)
                     updated_row[plan_id_col] = id_map[old_id]
-                    ws_plan.update(range_name=f"A{i}", values=[updated_row])
+                    plan_updates[i] = updated_row
                     print(f"   ✅ Plan fila {i}: {old_id} → {id_map[old_id]}")
+        db.update_rows("Planes de Intervención", plan_updates)
 except Exception as e:
     print(f"   ⚠️ Planes de Intervención: {e}")
 
 # ----------- Actualizar Ecomapas -----------
 try:
-    ws_eco = spreadsheet.worksheet("Ecomapas")
-    eco_all = ws_eco.get_all_values()
+    eco_all = db.read_table("Ecomapas")
     if len(eco_all) > 1:
         eco_headers = eco_all[0]
         eco_id_col = eco_headers.index("ID Evaluación") if "ID Evaluación" in eco_headers else 0
         print(f"\n🗺️  Actualizando Ecomapas ({len(eco_all)-1} filas)...")
+        eco_updates = {}
         for i, row in enumerate(eco_all[1:], 2):
             if len(row) > eco_id_col:
                 old_id = str(row[eco_id_col]).strip()
                 if old_id in id_map:
                     updated_row = list(row)
                     updated_row[eco_id_col] = id_map[old_id]
-                    ws_eco.update(range_name=f"A{i}", values=[updated_row])
+                    eco_updates[i] = updated_row
                     print(f"   ✅ Ecomapa fila {i}: {old_id} → {id_map[old_id]}")
+        db.update_rows("Ecomapas", eco_updates)
 except Exception as e:
     print(f"   ⚠️ Ecomapas: {e}")
 
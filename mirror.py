@@ -0,0 +1,311 @@
+"""
+mirror.py — Espejo local (SQLite) de las hojas más leídas.
+Google Sheets sigue siendo la fuente de verdad; el espejo:
+  - Se puebla una vez por tabla (descarga completa) la primera vez que se lee
+  - Se mantiene al día por escritura directa: cada guardado se aplica en Sheets y luego en el espejo
+  - Se reconcilia periódicamente contra Sheets en un hilo de fondo (cambios de otras instancias):
+    en forma incremental si la hoja tiene "Fecha Actualización" (ver sync.py) y con copia
+    completa cada FULL_RESYNC_SECONDS
+Las lecturas de las tablas espejadas (listado, búsqueda, RUTs, dashboard, REM-P7) se sirven
+desde tablas SQLite indexadas en vez de get_all_values() sobre la hoja completa.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from storage import DATA_DIR, ID_COL, SQLiteBackend, StorageBackend, trim_row
+from sync import apply_delta, fetch_delta
+
+logger = logging.getLogger(__name__)
+
+MIRROR_TABLES = ("Evaluaciones", "Planes de Intervención", "Ecomapas")
+DEFAULT_MIRROR_PATH = os.path.join(DATA_DIR, "mirror.sqlite3")
+RECONCILE_SECONDS = 300
+FULL_RESYNC_SECONDS = 3600
+
+
+class MirroredBackend(StorageBackend):
+    """Backend primario (Sheets) con espejo SQLite de escritura directa para MIRROR_TABLES."""
+    name = "mirrored"
+    tracks_changes = True  # La reconciliación detecta cambios hechos fuera de la app
+
+    def __init__(self, primary, mirror=None, tables=MIRROR_TABLES, reconcile_seconds=RECONCILE_SECONDS,
+                 on_change=None):
+        self.primary = primary
+        self.on_change = on_change  # Callback(tabla) cuando la reconciliación trae cambios
+        self.mirror = mirror or SQLiteBackend(DEFAULT_MIRROR_PATH)
+        self.tables = set(tables)
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.RLock()
+        self._loaded = set()        # Tablas ya pobladas en este proceso
+        self._generation = {}       # Contador de escrituras por tabla (descarta reconciliaciones obsoletas)
+        self._inflight = {}         # Escrituras enviadas a Sheets que aún no llegan al espejo, por tabla
+        self._last_sync = {}
+        self._last_full = {}
+        self._worker = None
+        self._stop = threading.Event()
+        self._local = threading.local()  # Escrituras al espejo diferidas hasta confirmar el lote
+        if reconcile_seconds:
+            self._start_worker()
+
+    # --- Población y reconciliación ---
+    def _mirrored(self, table):
+        return table in self.tables
+
+    def _begin_write(self, table):
+        with self._lock:
+            self._generation[table] = self._generation.get(table, 0) + 1
+            self._inflight[table] = self._inflight.get(table, 0) + 1
+
+    def _end_write(self, table):
+        with self._lock:
+            self._generation[table] = self._generation.get(table, 0) + 1
+            self._inflight[table] -= 1
+
+    def _snapshot(self, table):
+        """Marca tomada antes de leer Sheets sin el lock (ver _unchanged)."""
+        with self._lock:
+            return self._generation.get(table, 0)
+
+    def _unchanged(self, table, generation):
+        """
+        True (con el lock tomado) si desde _snapshot no hubo escrituras y ninguna está a medio camino
+        entre Sheets y el espejo: lo leído de Sheets se puede aplicar sin pisar ni duplicar una
+        escritura directa.
+        """
+        return self._generation.get(table, 0) == generation and not self._inflight.get(table, 0)
+
+    def _pull(self, table):
+        """
+        Descarga la tabla desde el primario y la copia al espejo, salvo que haya habido escrituras
+        entremedio. Retorna None si se descartó, o si el contenido cambió respecto del espejo.
+        """
+        generation = self._snapshot(table)
+        values = self.primary.read_table(table)
+        with self._lock:
+            if not self._unchanged(table, generation):
+                return None  # Se reintenta en el próximo ciclo
+            before = [trim_row(r) for r in self.mirror.read_table(table)]
+            self.mirror.write_table(table, values)
+            self._loaded.add(table)
+            self._last_sync[table] = self._last_full[table] = time.time()
+        return before != [trim_row(r) for r in values]
+
+    def _refresh(self, table, full=False):
+        """Reconciliación de una tabla: incremental si es posible, completa si no. Igual retorno que _pull."""
+        due = time.time() - self._last_full.get(table, 0) > FULL_RESYNC_SECONDS
+        if full or due or table not in self._loaded:
+            return self._pull(table)
+        result = self._delta(table)
+        if result == "full":
+            return self._pull(table)
+        return None if result is None else result == "delta"
+
+    def _delta(self, table):
+        """
+        Reconciliación incremental (sync.py). El sondeo y la descarga van sin el lock, así que una
+        lectura lenta de Sheets no detiene los guardados; el delta se aplica con el lock y solo si
+        ninguna escritura directa ocurrió entremedio. Retorna el resultado de delta_sync, o None
+        si se descartó (se reintenta en el próximo ciclo).
+        """
+        generation = self._snapshot(table)
+        result, delta = fetch_delta(self.primary, self.mirror, table)
+        if result == "full":
+            return result
+        with self._lock:
+            if not self._unchanged(table, generation):
+                return None
+            if delta is not None:
+                apply_delta(self.mirror, table, delta)
+            self._last_sync[table] = time.time()
+        return result
+
+    def _ensure_loaded(self, table):
+        """True si el espejo puede responder por la tabla."""
+        if table in self._loaded:
+            return True
+        # Un espejo de una ejecución anterior se pone al día con el sondeo incremental antes de servirlo
+        if self.mirror.read_table(table):
+            try:
+                if self._delta(table) in ("skip", "delta"):
+                    with self._lock:
+                        self._loaded.add(table)
+                    return True
+            except Exception as e:
+                # Sin conexión: se sirve la copia heredada y el hilo de fondo la reconcilia después
+                logger.warning("Espejo local de %s sin verificar: %s", table, e)
+                with self._lock:
+                    self._loaded.add(table)
+                return True
+        return self._pull(table) is not None
+
+    def reconcile(self, tables=None, full=False):
+        """Sincroniza desde Sheets las tablas espejadas. Retorna las tablas cuyo contenido cambió."""
+        changed = []
+        for table in sorted(tables or self.tables):
+            if self._mirrored(table) and self._refresh(table, full):
+                changed.append(table)
+                if self.on_change:
+                    self.on_change(table)
+        return changed
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._reconcile_loop, name="mirror-reconcile", daemon=True)
+        self._worker.start()
+
+    def _reconcile_loop(self):
+        # Primera pasada inmediata: corrige un espejo heredado de una ejecución anterior
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.warning("Error reconciliando espejo local: %s", e)
+            if self._stop.wait(self.reconcile_seconds):
+                return
+
+    def _invalidate(self, table):
+        """Si falla la escritura en el espejo, la tabla se vuelve a poblar en la próxima lectura."""
+        with self._lock:
+            self._loaded.discard(table)
+        try:
+            self.mirror.write_table(table, [])
+        except Exception:
+            pass
+
+    @contextmanager
+    def _writing(self, table):
+        """
+        Escritura directa a `table`: el bloque la envía a Sheets y registra con apply(op) lo que hay
+        que aplicar al espejo (op(espejo)). Mientras la escritura no llega al espejo, las
+        reconciliaciones de la tabla se descartan (ver _unchanged).
+        """
+        ops = []
+        self._begin_write(table)
+        try:
+            yield ops.append
+        except Exception:
+            self._end_write(table)
+            raise
+        self._write_through(table, ops[0] if ops else None)
+
+    def _write_through(self, table, op):
+        deferred = getattr(self._local, "deferred", None)
+        if deferred is not None:
+            deferred.append((table, op))
+            return
+        try:
+            with self._lock:
+                if table not in self._loaded or op is None:
+                    return
+                op(self.mirror)
+        except Exception as e:
+            logger.warning("Error actualizando espejo local (%s): %s", table, e)
+            self._invalidate(table)
+        finally:
+            self._end_write(table)
+
+    @contextmanager
+    def batch(self):
+        """Lote en Sheets; el espejo se actualiza solo si el lote se confirmó."""
+        if getattr(self._local, "deferred", None) is not None:
+            yield self
+            return
+        self._local.deferred = []
+        try:
+            with self.primary.batch():
+                yield self
+            deferred = self._local.deferred
+        except Exception:
+            for table, _ in self._local.deferred:
+                self._end_write(table)  # El lote no llegó a Sheets: nada que aplicar
+            raise
+        finally:
+            self._local.deferred = None
+        for table, op in deferred:
+            self._write_through(table, op)
+
+    # --- Lecturas ---
+    def read_table(self, table):
+        if not self._mirrored(table):
+            return self.primary.read_table(table)
+        if not self._ensure_loaded(table):
+            return self.primary.read_table(table)
+        return self.mirror.read_table(table)
+
+    def read_projection(self, table, columns):
+        if not self._mirrored(table) or not self._ensure_loaded(table):
+            return self.primary.read_projection(table, columns)
+        return self.mirror.read_projection(table, columns)
+
+    def find_row(self, table, key_value, key_col=ID_COL):
+        if not self._mirrored(table):
+            return self.primary.find_row(table, key_value, key_col)
+        if not self._ensure_loaded(table):
+            return self.primary.find_row(table, key_value, key_col)
+        return self.mirror.find_row(table, key_value, key_col)
+
+    def read_cells(self, table, key_value, columns, key_col=ID_COL):
+        # Control de revisiones: siempre contra Sheets, nunca contra la copia local
+        return self.primary.read_cells(table, key_value, columns, key_col)
+
+    def read_rows(self, table, row_numbers):
+        # Verificación antes de escribir por número de fila: siempre contra Sheets
+        return self.primary.read_rows(table, row_numbers)
+
+    # --- Escrituras (primero Sheets, luego espejo) ---
+    def upsert_row(self, table, headers, row, key_col=ID_COL):
+        with self._writing(table) as apply:
+            result = self.primary.upsert_row(table, headers, row, key_col)
+            apply(lambda m: m.upsert_row(table, headers, row, key_col))
+        return result
+
+    def update_cells(self, table, headers, key_value, changes, key_col=ID_COL):
+        def patch(mirror):
+            if mirror.update_cells(table, headers, key_value, changes, key_col) is None:
+                raise LookupError("fila no encontrada en el espejo")
+        with self._writing(table) as apply:
+            result = self.primary.update_cells(table, headers, key_value, changes, key_col)
+            if result is not None:
+                apply(patch)
+        return result
+
+    def append_rows(self, table, headers, rows):
+        with self._writing(table) as apply:
+            self.primary.append_rows(table, headers, rows)
+            apply(lambda m: m.append_rows(table, headers, rows))
+
+    def update_rows(self, table, updates):
+        with self._writing(table) as apply:
+            self.primary.update_rows(table, updates)
+            apply(lambda m: m.update_rows(table, updates))
+
+    def delete_rows(self, table, row_numbers):
+        with self._writing(table) as apply:
+            self.primary.delete_rows(table, row_numbers)
+            apply(lambda m: m.delete_rows(table, row_numbers))
+
+    def replace_child_rows(self, table, headers, key_value, rows, key_col=ID_COL):
+        with self._writing(table) as apply:
+            count = self.primary.replace_child_rows(table, headers, key_value, rows, key_col)
+            apply(lambda m: m.replace_child_rows(table, headers, key_value, rows, key_col))
+        return count
+
+    def write_table(self, table, rows):
+        with self._writing(table) as apply:
+            self.primary.write_table(table, rows)
+            apply(lambda m: m.write_table(table, rows))
+
+    def append_audit_rows(self, rows):
+        self.primary.append_audit_rows(rows)
+
+    def list_tables(self, prefix=""):
+        return self.primary.list_tables(prefix)
+
+    # --- Secuencias (siempre en la fuente de verdad) ---
+    def reserve_ids(self, sequence, count, seed=None):
+        return self.primary.reserve_ids(sequence, count, seed)
+
+    def reset_sequence(self, sequence, value):
+        self.primary.reset_sequence(sequence, value)
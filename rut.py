@@ -0,0 +1,225 @@
+"""
+rut.py — RUT chileno: normalización, dígito verificador (módulo 11) e índice por RUT canónico.
+Forma canónica: cuerpo sin puntos ni ceros a la izquierda + "-" + DV en mayúscula
+("12.345.678-k", "12345678K" y "012345678-K" -> "12345678-K"). Todas las comparaciones de RUT
+de la app se hacen sobre la forma canónica. Un cuerpo de menos de MIN_BODY_DIGITS dígitos no es un
+RUT ("12" o "S/N 5" no se convierten en "1-2" ni "5-…") y queda como texto.
+El índice de toda la población (RutRegistry) se mantiene en forma incremental: cada guardado
+reemplaza solo los RUTs de la evaluación guardada, el índice se persiste en SQLite local y se
+reconstruye completo solo al partir el proceso o si los datos cambiaron fuera de la app.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from json_codec import decode_json
+
+logger = logging.getLogger(__name__)
+
+MIN_BODY_DIGITS = 6  # Cuerpo más corto que un RUT real: números sueltos, folios, teléfonos cortos
+_RUT_RE = re.compile(r"^(\d{1,9})([\dK])$")
+
+
+def compute_dv(body):
+    """Dígito verificador módulo 11 del cuerpo numérico: '12345678' -> '5'."""
+    total, factor = 0, 2
+    for digit in reversed(str(int(body))):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    dv = 11 - total % 11
+    return {11: "0", 10: "K"}.get(dv, str(dv))
+
+
+def split_rut(rut):
+    """(cuerpo, DV) de un RUT en cualquier formato, o None si no tiene forma de RUT (cuerpo corto incluido)."""
+    compact = re.sub(r"[.\-\s]", "", str(rut or "")).upper()
+    found = _RUT_RE.match(compact)
+    if not found or len(found.group(1).lstrip("0")) < MIN_BODY_DIGITS:
+        return None
+    return found.group(1).lstrip("0"), found.group(2)
+
+
+def canonical_rut(rut):
+    """Forma canónica '12345678-9', o '' si el valor no es un RUT (vacío, 'S/R', texto)."""
+    parts = split_rut(rut)
+    return f"{parts[0]}-{parts[1]}" if parts else ""
+
+
+def is_valid_rut(rut):
+    """True si tiene forma de RUT y el dígito verificador es correcto."""
+    parts = split_rut(rut)
+    return bool(parts) and compute_dv(parts[0]) == parts[1]
+
+
+def format_rut(rut):
+    """Formato de despliegue con puntos: '12.345.678-9' (o el valor original si no es un RUT)."""
+    parts = split_rut(rut)
+    if not parts:
+        return str(rut or "").strip()
+    return f"{int(parts[0]):,}".replace(",", ".") + f"-{parts[1]}"
+
+
+def _members(gf_json):
+    try:
+        members = decode_json(gf_json) if gf_json else []
+    except (TypeError, ValueError):
+        return []
+    return members if isinstance(members, list) else []
+
+
+class RutIndex:
+    """Índice RUT canónico -> [(familia, ID Evaluación, posición del integrante)]."""
+
+    def __init__(self):
+        self.entries = {}
+        self.by_eval = {}   # ID Evaluación -> RUTs canónicos que aporta (para reemplazarlos)
+
+    def add(self, rut, familia, eval_id, position):
+        key = canonical_rut(rut)
+        if key:
+            self.entries.setdefault(key, []).append((familia, eval_id, position))
+            self.by_eval.setdefault(eval_id, []).append(key)
+
+    def add_evaluation(self, eval_id, familia, gf_json):
+        for position, member in enumerate(_members(gf_json)):
+            if isinstance(member, dict):
+                self.add(member.get("RUT", ""), familia, eval_id, position)
+
+    def remove_evaluation(self, eval_id):
+        for key in set(self.by_eval.pop(eval_id, [])):
+            kept = [e for e in self.entries.get(key, []) if e[1] != eval_id]
+            if kept:
+                self.entries[key] = kept
+            else:
+                self.entries.pop(key, None)
+
+    def set_evaluation(self, eval_id, familia, gf_json):
+        """Reemplaza los RUTs de una evaluación (guardado) sin tocar el resto del índice."""
+        self.remove_evaluation(eval_id)
+        self.add_evaluation(eval_id, familia, gf_json)
+
+    @classmethod
+    def from_columns(cls, ids, familias, grupos):
+        """Construye el índice desde las columnas ID Evaluación, Familia y Grupo Familiar JSON."""
+        index = cls()
+        for eval_id, familia, gf_json in zip(ids, familias, grupos):
+            index.add_evaluation(eval_id, familia, gf_json)
+        return index
+
+    def lookup(self, rut):
+        """Registros con ese RUT (cualquier formato); [] si no hay."""
+        return self.entries.get(canonical_rut(rut), [])
+
+    def other_families(self, rut, eval_id):
+        """Registros con ese RUT que pertenecen a otra evaluación (alerta de duplicidad)."""
+        return [e for e in self.lookup(rut) if e[1] != eval_id]
+
+    def duplicates(self):
+        """{RUT canónico: registros} para los RUTs presentes en más de una evaluación."""
+        return {rut: found for rut, found in self.entries.items() if len({e[1] for e in found}) > 1}
+
+    def rows(self, eval_id=None):
+        """Filas (rut, ID, familia, posición) del índice completo o de una evaluación."""
+        keys = set(self.by_eval.get(eval_id, [])) if eval_id is not None else self.entries
+        return [(key, e[1], e[0], e[2]) for key in keys for e in self.entries.get(key, [])
+                if eval_id is None or e[1] == eval_id]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RutRegistry:
+    """
+    RutIndex compartido por el proceso, con versión de datos (data_version) y copia en SQLite.
+    Los guardados hechos por la app se aplican con apply() y sus publicaciones en el bus de
+    versiones se reconocen con acknowledge(); cualquier otra versión nueva (reconciliación del
+    espejo, otra réplica, migraciones) obliga a reconstruir.
+    """
+
+    def __init__(self, path=None):
+        self.index = RutIndex()
+        self.version = None
+        self._own = set()           # Versiones publicadas por guardados ya aplicados
+        self._generation = 0        # Cambios aplicados (descarta reconstrucciones obsoletas)
+        self._lock = threading.RLock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS ruts (rut TEXT, eval_id TEXT, familia TEXT, position INTEGER)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_ruts_eval ON ruts (eval_id)")
+
+    def _persist(self, rows, eval_id=None):
+        if self._db is None:
+            return
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+            if eval_id is None:
+                self._db.execute("DELETE FROM ruts")
+            else:
+                self._db.execute("DELETE FROM ruts WHERE eval_id = ?", (eval_id,))
+            self._db.executemany("INSERT INTO ruts (rut, eval_id, familia, position) VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        except Exception as e:
+            self._db.execute("ROLLBACK")
+            logger.warning("Error persistiendo índice de RUTs: %s", e)
+
+    def load(self, version):
+        """Carga la copia persistida (arranque en frío). Retorna False si no había copia."""
+        if self._db is None:
+            return False
+        rows = self._db.execute("SELECT rut, eval_id, familia, position FROM ruts ORDER BY rowid").fetchall()
+        if not rows:
+            return False
+        index = RutIndex()
+        for rut, eval_id, familia, position in rows:
+            index.add(rut, familia, eval_id, position)
+        with self._lock:
+            self.index, self.version = index, version
+        return True
+
+    def is_fresh(self, version):
+        """True si el índice refleja `version`: igual, o solo avanzó por guardados ya aplicados."""
+        with self._lock:
+            if self.version is None:
+                return False
+            if version == self.version:
+                return True
+            (known, epoch), (current, current_epoch) = self.version, version
+            if epoch == current_epoch and all(v in self._own for v in range(known + 1, current + 1)):
+                self._own = {v for v in self._own if v > current}
+                self.version = version
+                return True
+            return False
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def rebuild(self, ids, familias, grupos, version, generation=None):
+        """Reconstrucción completa. Si se indica `generation` y hubo guardados entremedio, se descarta."""
+        index = RutIndex.from_columns(ids, familias, grupos)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self.index, self.version = index, version
+            self._persist(index.rows())
+        return True
+
+    def apply(self, eval_id, familia, gf_json):
+        """Aplica un guardado: reemplaza solo los RUTs de esa evaluación (memoria y copia local)."""
+        eval_id = str(eval_id).strip()
+        if not eval_id:
+            return
+        with self._lock:
+            self.index.set_evaluation(eval_id, familia, gf_json)
+            self._generation += 1
+            self._persist(self.index.rows(eval_id), eval_id)
+
+    def acknowledge(self, *versions):
+        """Registra versiones del bus publicadas por guardados ya aplicados con apply()."""
+        with self._lock:
+            self._own.update(v for v in versions if v is not None)
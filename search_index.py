@@ -0,0 +1,205 @@
+"""
+search_index.py — Índice invertido para la búsqueda de familias del panel lateral.
+Se construye una vez por versión de datos (ver EvaluacionesSnapshot.derived) a partir de:
+  - Familia (apellidos), nombres de los integrantes y RUTs del Grupo Familiar JSON
+  - Dirección
+Solo se indexan los valores de los campos, nunca las claves del JSON ("Parentesco", "RUT", ...).
+Los tokens se guardan sin tildes ni mayúsculas ("Ñancupil" -> "nancupil").
+  - search(): cada término de la consulta se busca como prefijo (bisect sobre los tokens
+    ordenados) y todos deben coincidir; retorna los ID Evaluación ordenados por puntaje
+  - fuzzy_search(): tolera errores de tipeo en apellidos y nombres usando un índice de trigramas
+    precalculado (candidatos) y distancia de edición (puntaje); retorna los top-k con puntaje
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+from json_codec import decode_json
+from rut import canonical_rut
+
+# Peso de cada campo en el puntaje (coincidencia exacta del token vale el doble)
+FIELD_WEIGHTS = {"rut": 4, "familia": 3, "integrante": 2, "direccion": 1}
+
+_RUT_RE = re.compile(r"\b\d{1,2}\.?\d{3}\.?\d{3}-?[\dkK]\b")
+_TOKEN_RE = re.compile(r"\w+")
+_RUT_SEPARATOR_RE = re.compile(r"(?<=\d)[.\-](?=[\dkK])")  # RUT parcial en la consulta: "12.345" -> "12345"
+_CACHE_SIZE = 64
+
+# Búsqueda difusa: similitud mínima (0-1) y candidatos por término que se comparan con distancia de edición
+FUZZY_MIN_SCORE = 0.6
+FUZZY_CANDIDATES = 200
+NAME_FIELDS = ("familia", "integrante")
+
+
+def fold_accents(text):
+    """Quita tildes y diéresis (descomposición NFD): 'Huenchullán' -> 'Huenchullan', 'Ñ' -> 'N'."""
+    s = unicodedata.normalize('NFD', str(text or ""))
+    return ''.join(c for c in s if unicodedata.category(c) != 'Mn')
+
+
+def trigrams(token):
+    """Trigramas del token con bordes marcados: 'soto' -> {'  s', ' so', 'sot', 'oto', 'to '}."""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b):
+    """Distancia de Levenshtein (inserciones, eliminaciones y sustituciones)."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def normalize_rut(rut):
+    """RUT como token: forma canónica (rut.py) sin guion y con K minúscula: '12.345.678-K' -> '12345678k'."""
+    return (canonical_rut(rut) or re.sub(r"[.\-\s]", "", str(rut))).replace("-", "").lower()
+
+
+def tokenize(text):
+    """Tokens en minúsculas y sin tildes; los RUTs se conservan como un solo token normalizado."""
+    text = fold_accents(text)
+    ruts = [normalize_rut(m) for m in _RUT_RE.findall(text)]
+    return ruts + _TOKEN_RE.findall(_RUT_RE.sub(" ", text).lower())
+
+
+def _members(gf_json):
+    try:
+        members = decode_json(gf_json) if gf_json else []
+    except (TypeError, ValueError):
+        return []
+    return [m for m in members if isinstance(m, dict)] if isinstance(members, list) else []
+
+
+class SearchIndex:
+    """Índice token -> {documento: peso}, con los tokens ordenados para búsquedas por prefijo."""
+
+    def __init__(self):
+        self.ids = []
+        self.postings = {}
+        self.tokens = []
+        self.names = set()          # Tokens de apellidos y nombres (los únicos de la búsqueda difusa)
+        self.trigrams = {}          # Trigrama -> [tokens de nombre que lo contienen]
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _add(self, doc, field, text, whole_rut=False):
+        weight = FIELD_WEIGHTS[field]
+        tokens = [normalize_rut(text)] if whole_rut else tokenize(text)
+        for token in tokens:
+            if token:
+                found = self.postings.setdefault(token, {})
+                if found.get(doc, 0) < weight:
+                    found[doc] = weight
+                if field in NAME_FIELDS and not token.isdigit():
+                    self.names.add(token)
+
+    @classmethod
+    def from_columns(cls, ids, familias, direcciones, grupos):
+        """Construye el índice desde las columnas de Evaluaciones (listas alineadas)."""
+        index = cls()
+        for eval_id, familia, direccion, gf_json in zip(ids, familias, direcciones, grupos):
+            eval_id = str(eval_id).strip()
+            if not eval_id:
+                continue
+            doc = len(index.ids)
+            index.ids.append(eval_id)
+            index._add(doc, "familia", familia)
+            index._add(doc, "direccion", direccion)
+            for member in _members(gf_json):
+                for key, value in member.items():
+                    if str(key).strip().lower().startswith("nombre"):
+                        index._add(doc, "integrante", value)
+                rut = str(member.get("RUT", "") or "").strip()
+                if rut and rut.upper() != "S/R":
+                    index._add(doc, "rut", rut, whole_rut=True)
+        index.tokens = sorted(index.postings)
+        for token in index.names:
+            for gram in trigrams(token):
+                index.trigrams.setdefault(gram, []).append(token)
+        return index
+
+    def _prefix_matches(self, term):
+        """Documentos cuyo algún token empieza con term: {doc: mejor puntaje}."""
+        scores = {}
+        start = bisect_left(self.tokens, term)
+        for token in self.tokens[start:]:
+            if not token.startswith(term):
+                break
+            exact = 2 if token == term else 1
+            for doc, weight in self.postings[token].items():
+                if scores.get(doc, 0) < weight * exact:
+                    scores[doc] = weight * exact
+        return scores
+
+    def search(self, query, limit=None):
+        """ID Evaluación que coinciden con todos los términos, de mayor a menor puntaje."""
+        terms = list(dict.fromkeys(tokenize(_RUT_SEPARATOR_RE.sub("", str(query or "")))))
+        if not terms:
+            return []
+        key = tuple(terms)
+        with self._lock:
+            ranked = self._cache.get(key)
+        if ranked is None:
+            # Primero el término más selectivo (el más largo) para achicar la intersección
+            total = None
+            for term in sorted(terms, key=len, reverse=True):
+                scores = self._prefix_matches(term)
+                if total is None:
+                    total = scores
+                else:
+                    total = {doc: s + scores[doc] for doc, s in total.items() if doc in scores}
+                if not total:
+                    break
+            ranked = [self.ids[doc] for doc, _ in sorted(total.items(), key=lambda item: (-item[1], item[0]))]
+            with self._lock:
+                if len(self._cache) >= _CACHE_SIZE:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[key] = ranked
+        return ranked[:limit] if limit else ranked
+
+    def _similar_tokens(self, term):
+        """Tokens de nombre parecidos a term: {token: similitud 0-1} (1 - distancia / largo mayor)."""
+        shared = {}
+        for gram in trigrams(term):
+            for token in self.trigrams.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        best = sorted(shared, key=shared.get, reverse=True)[:FUZZY_CANDIDATES]
+        similar = {}
+        for token in best:
+            # Los prefijos cuentan como coincidencia completa ("nancu" -> "nancupil")
+            if token.startswith(term):
+                score = 1.0
+            else:
+                score = 1 - edit_distance(term, token) / max(len(term), len(token))
+            if score >= FUZZY_MIN_SCORE:
+                similar[token] = score
+        return similar
+
+    def fuzzy_search(self, query, k=20):
+        """
+        Búsqueda tolerante a tildes y errores de tipeo sobre Familia y nombres de integrantes.
+        Retorna hasta k pares (ID Evaluación, puntaje) de mayor a menor; cada término de la consulta
+        aporta la mejor similitud de sus tokens parecidos por el peso del campo.
+        """
+        terms = [t for t in dict.fromkeys(tokenize(query)) if not t.isdigit()]
+        if not terms:
+            return []
+        total = {}
+        for term in terms:
+            scores = {}
+            for token, similarity in self._similar_tokens(term).items():
+                for doc, weight in self.postings[token].items():
+                    if weight >= FIELD_WEIGHTS["integrante"] and scores.get(doc, 0) < similarity * weight:
+                        scores[doc] = similarity * weight
+            for doc, score in scores.items():
+                total[doc] = total.get(doc, 0) + score
+        top = sorted(total.items(), key=lambda item: (-item[1], item[0]))[:k]
+        best = len(terms) * FIELD_WEIGHTS["familia"]
+        return [(self.ids[doc], round(min(score / best, 1.0), 3)) for doc, score in top]
@@ -2,20 +2,18 @@
 seed_postas_data.py — Inserta 30 familias de prueba ricas.
 RISK_KEYS sincronizados exactamente con app.py (incluye t3_duelo).
 """
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import json, random
 from datetime import date, timedelta
+from storage import open_backend, DEFAULT_SQLITE_PATH
 
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1JjYw2W6c-N2swGPuIHbz0CU7aDhh1pA-6VH1WuXV41w/edit"
 import toml
 secrets    = toml.load("d:/PROYECTOS PROGRAMACIÓN/ANTIGRAVITY_PROJECTS/encuesta_riesgo/.streamlit/secrets.toml")
 creds_dict = secrets["gcp_service_account"]
-scope  = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds  = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-sh     = client.open_by_url(SHEET_URL)
-ws_eval = sh.worksheet("Evaluaciones")
+# Backend de persistencia: [storage] backend = "sheets" | "sqlite" en secrets.toml
+storage_cfg = dict(secrets.get("storage", {}))
+db = open_backend(storage_cfg.get("backend", "sheets"), creds_dict=creds_dict, sheet_url=SHEET_URL,
+                  sqlite_path=storage_cfg.get("sqlite_path", DEFAULT_SQLITE_PATH))
 
 # ── EXACTAMENTE igual a app.py risk_keys ──────────────────────────────────
 RISK_KEYS = [
@@ -157,9 +155,9 @@ def compute_risk(active):
     return total, nivel
 
 
-def delete_last_n_rows(ws, n):
+def delete_last_n_rows(table, n):
     """Elimina las últimas n filas de datos (no header)."""
-    all_vals = ws.get_all_values()
+    all_vals = db.read_table(table)
     total = len(all_vals)
     if total <= 1:
         print("No hay filas para eliminar.")
@@ -167,17 +165,16 @@ def delete_last_n_rows(ws, n):
     start_row = max(2, total - n + 1)
     rows_to_delete = list(range(total, start_row - 1, -1))
     print(f"Eliminando {len(rows_to_delete)} fila(s) incorrecta(s)...")
-    for r in rows_to_delete:
-        ws.delete_rows(r)
+    db.delete_rows(table, rows_to_delete)
     print("Filas eliminadas.")
 
 
 def seed_data(n=30):
     # 1. Eliminar los 30 registros malos anteriores
-    delete_last_n_rows(ws_eval, 30)
+    delete_last_n_rows("Evaluaciones", 30)
 
     # 2. Determinar último ID
-    all_vals = ws_eval.get_all_values()
+    all_vals = db.read_table("Evaluaciones")
     last_idx = 1
     if len(all_vals) > 1:
         try:
@@ -280,7 +277,9 @@ def seed_data(n=30):
         rows.append(row)
         print(f"  [{i+1:02d}/30] {eval_id} — {familia} ({len(members)} integrantes) — {nivel} ({total_pts}pts) [{perfil}]")
 
-    ws_eval.append_rows(rows, value_input_option="USER_ENTERED")
+    # En Sheets las fechas y puntajes se interpretan como si se tipearan (USER_ENTERED), como antes
+    extra = {"value_input_option": "USER_ENTERED"} if db.name == "sheets" else {}
+    db.append_rows("Evaluaciones", all_vals[0] if all_vals else [], rows, **extra)
     print(f"\n✅ {len(rows)} familias con grupo familiar completo insertadas.")
     print(f"   Columnas por fila: {len(rows[0])} | RISK_KEYS: {len(RISK_KEYS)}")
 
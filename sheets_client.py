@@ -0,0 +1,146 @@
+"""
+sheets_client.py — Conexión compartida a Google Sheets.
+Un único cliente autorizado por proceso (compartido entre todas las sesiones de Streamlit):
+  - Las credenciales se construyen y autorizan una sola vez
+  - El token se renueva en segundo plano antes de expirar (sin esperar un 401)
+  - La sesión HTTP (keep-alive) se reutiliza entre llamadas
+  - El Spreadsheet y los Worksheet se cachean por título (sin open_by_url repetidos)
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import streamlit as st
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+logger = logging.getLogger(__name__)
+
+SHEET_URL = "https://docs.google.com/spreadsheets/d/1JjYw2W6c-N2swGPuIHbz0CU7aDhh1pA-6VH1WuXV41w/edit"
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+SERVICE_ACCOUNT_KEYS = [
+    "type", "project_id", "private_key_id", "private_key", "client_email", "client_id",
+    "auth_uri", "token_uri", "auth_provider_x509_cert_url", "client_x509_cert_url", "universe_domain"
+]
+
+TOKEN_CHECK_SECONDS = 60      # Frecuencia del hilo de renovación
+TOKEN_MARGIN_SECONDS = 300    # Renovar si quedan menos de 5 min de vigencia
+HTTP_POOL_SIZE = 16           # Conexiones keep-alive simultáneas (varias sesiones a la vez)
+
+
+class SheetsConnection:
+    """Cliente gspread autorizado + handles cacheados, seguro para uso entre hilos."""
+
+    def __init__(self, creds_dict, sheet_url=SHEET_URL):
+        self._creds_dict = creds_dict
+        self._sheet_url = sheet_url
+        self._lock = threading.RLock()
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._refresher = None
+        self._stop = threading.Event()
+
+    # --- Cliente y Spreadsheet ---
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                creds = ServiceAccountCredentials.from_json_keyfile_dict(self._creds_dict, SCOPE)
+                self._client = gspread.authorize(creds)
+                self._tune_http_session()
+                self._start_refresher()
+            return self._client
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self.client().open_by_url(self._sheet_url)
+            return self._spreadsheet
+
+    def worksheet(self, title, headers=None, create=True):
+        """
+        Obtiene una hoja por título desde caché.
+        Si no existe y create=True la crea (con encabezados opcionales); si no, propaga WorksheetNotFound.
+        """
+        with self._lock:
+            ws = self._worksheets.get(title)
+            if ws is not None:
+                return ws
+            spreadsheet = self.spreadsheet()
+            try:
+                ws = spreadsheet.worksheet(title)
+            except gspread.WorksheetNotFound:
+                if not create:
+                    raise
+                ws = spreadsheet.add_worksheet(title=title, rows="1000", cols="50")
+                if headers:
+                    ws.append_row(headers)
+            self._worksheets[title] = ws
+            return ws
+
+    def forget_worksheet(self, title):
+        """Descarta el handle cacheado (p. ej. si la hoja fue renombrada o eliminada)."""
+        with self._lock:
+            self._worksheets.pop(title, None)
+
+    def reset(self):
+        """Fuerza una reconexión completa en la próxima llamada."""
+        with self._lock:
+            self._client = None
+            self._spreadsheet = None
+            self._worksheets.clear()
+
+    # --- Sesión HTTP y token ---
+    def _auth_and_session(self):
+        http = getattr(self._client, "http_client", self._client)  # gspread >= 6 / gspread 5
+        return getattr(http, "auth", None), getattr(http, "session", None)
+
+    def _tune_http_session(self):
+        _, session = self._auth_and_session()
+        if session is None:
+            return
+        try:
+            from requests.adapters import HTTPAdapter
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+        except ImportError:
+            pass
+
+    def _start_refresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, name="sheets-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(TOKEN_CHECK_SECONDS):
+            try:
+                self.refresh_token_if_needed()
+            except Exception as e:
+                # Si falla, la sesión autorizada igual renueva al recibir un 401
+                logger.warning("Error renovando token de Google: %s", e)
+
+    def refresh_token_if_needed(self):
+        with self._lock:
+            if self._client is None:
+                return
+            auth, _ = self._auth_and_session()
+        expiry = getattr(auth, "expiry", None)
+        if auth is None or not hasattr(auth, "refresh"):
+            return
+        if expiry is not None and expiry - datetime.utcnow() > timedelta(seconds=TOKEN_MARGIN_SECONDS):
+            return
+        from google.auth.transport.requests import Request
+        auth.refresh(Request())
+
+
+def service_account_info(secrets):
+    """Extrae del bloque [gcp_service_account] solo las claves requeridas por la cuenta de servicio."""
+    return {k: secrets[k] for k in SERVICE_ACCOUNT_KEYS}
+
+
+@st.cache_resource(show_spinner=False)
+def get_connection():
+    """Conexión única por proceso, compartida por todas las sesiones."""
+    return SheetsConnection(service_account_info(st.secrets["gcp_service_account"]))
@@ -0,0 +1,1246 @@
+"""
+storage.py — Capa de persistencia intercambiable.
+Todas las tablas se modelan como en Google Sheets: una grilla con la fila 1 de encabezados,
+celdas de texto y filas numeradas desde 2. Implementaciones disponibles:
+  - SheetsBackend: Google Sheets (comportamiento histórico de la app)
+  - SQLiteBackend: base local (operación sin cuota de Sheets, benchmarks sin red)
+  - MemoryBackend: en memoria (pruebas y perfilado)
+El backend activo se elige con la variable de entorno GEN_ENC_STORAGE o con
+[storage] backend = "sheets" | "sqlite" | "memory" en secrets.toml. Con Sheets, las hojas
+más leídas se sirven desde un espejo SQLite local (ver mirror.py; [storage] mirror = false lo desactiva).
+"""
+import json
+import numbers
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import streamlit as st
+import gspread
+
+from sheets_client import SHEET_URL, SheetsConnection, get_connection
+
+ID_COL = "ID Evaluación"
+
+AUDIT_TABLE = "Auditoría"        # Hoja histórica única (solo lectura: ya no recibe eventos)
+AUDIT_HEADERS = ["Timestamp", "Usuario", "Cargo", "Acción", "Detalles", "ID Evaluación"]
+# Auditoría particionada por mes: una hoja por mes ("Auditoría 2025-03")
+AUDIT_PARTITION_PREFIX = AUDIT_TABLE + " "
+_AUDIT_MONTH_RE = re.compile(r"^(\d{4})-(\d{2})")
+
+# Hojas cuyas celdas Sheets interpreta como si el usuario las tipeara (USER_ENTERED): fechas y
+# números del plan quedan como fechas y números, como los escribía la app
+USER_ENTERED_TABLES = ("Planes de Intervención",)
+
+DATA_DIR = os.environ.get("GEN_ENC_DATA_DIR", ".local_data")
+DEFAULT_SQLITE_PATH = os.path.join(DATA_DIR, "gen_enc.sqlite3")
+
+# Secuencias de IDs en Sheets: una hoja por secuencia, una fila por bloque reservado
+SEQUENCE_SHEET_PREFIX = "Secuencia "
+SEQUENCE_HEADERS = ["Tipo", "Cantidad", "Fecha", "Hasta"]
+SEQUENCE_WINDOW = 20    # Filas de la secuencia leídas por solicitud al buscar el último "Hasta"
+
+
+def to_cell(value):
+    """Convierte un valor Python al texto que Sheets devolvería en get_all_values()."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return str(value)
+
+
+# Textos con que Sheets muestra un booleano según el idioma de la planilla
+_TRUE_CELLS = ("TRUE", "VERDADERO")
+_FALSE_CELLS = ("FALSE", "FALSO", "")
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_CELL_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+
+
+def cell_matches(value, cell):
+    """
+    True si el valor del formulario ya es el de la celda leída de la base. Las celdas que Sheets
+    interpretó se leen con el formato visible de la planilla, así que se compara según el tipo del
+    valor: booleanos contra TRUE/FALSE (o VERDADERO/FALSO), números por valor (acepta coma decimal)
+    y fechas ISO contra los formatos de fecha habituales; el resto, como texto.
+    """
+    cell = str(cell).strip()
+    if isinstance(value, bool):
+        return cell.upper() in (_TRUE_CELLS if value else _FALSE_CELLS)
+    if isinstance(value, numbers.Real):
+        try:
+            return float(cell if "." in cell else cell.replace(",", ".")) == float(value)
+        except ValueError:
+            return False
+    text = to_cell(value)
+    if text == cell:
+        return True
+    if _ISO_DATE_RE.match(text.strip()):
+        for fmt in _CELL_DATE_FORMATS:
+            try:
+                return datetime.strptime(cell, fmt).date().isoformat() == text.strip()
+            except ValueError:
+                continue
+    return False
+
+
+def key_index(headers, key_col=ID_COL):
+    """Posición de la columna clave (0 si no está en los encabezados, como hacía la app)."""
+    return headers.index(key_col) if key_col in headers else 0
+
+
+def find_row_number(values, key_value, key_col=ID_COL):
+    """Número de fila (base 1, fila 1 = encabezados) del primer registro con esa clave, o -1."""
+    if not values:
+        return -1
+    idx = key_index(values[0], key_col)
+    target = str(key_value).strip()
+    for i, row in enumerate(values[1:], 2):
+        if len(row) > idx and str(row[idx]).strip() == target:
+            return i
+    return -1
+
+
+def col_letter(index):
+    """Índice de columna (base 0) -> letra A1 ("A", "Z", "AA", ...)."""
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def row_runs(row_numbers):
+    """Agrupa números de fila en tramos contiguos [(inicio, fin), ...]."""
+    runs = []
+    for n in sorted(set(row_numbers)):
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return [tuple(r) for r in runs]
+
+
+def child_block_plan(values, key_value, n_new, key_col=ID_COL):
+    """
+    Estrategia para reemplazar las filas hijas de una clave (p. ej. el plan de una evaluación).
+    Si las filas actuales forman un bloque contiguo se sobrescriben en su lugar, lo que no desplaza
+    al resto de la hoja; si no, se eliminan todas. Retorna (sobrescribir, eliminar): números de fila
+    a sobrescribir con las primeras filas nuevas y números de fila a eliminar. Las filas nuevas
+    restantes se agregan al final.
+    """
+    if not values:
+        return [], []
+    idx = key_index(values[0], key_col)
+    target = str(key_value).strip()
+    existing = [i for i, r in enumerate(values[1:], 2) if len(r) > idx and str(r[idx]).strip() == target]
+    if existing and existing[-1] - existing[0] + 1 == len(existing):
+        overwrite = existing[:n_new]
+        return overwrite, existing[len(overwrite):]
+    return [], existing
+
+
+def trim_row(row):
+    """Quita celdas vacías al final (Sheets no las devuelve en lecturas por rango)."""
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def project_rows(values, columns):
+    """Recorta una grilla (encabezados + filas) a las columnas nombradas que existan."""
+    if not values:
+        return []
+    idx = [values[0].index(c) for c in columns if c in values[0]]
+    return [[r[i] if i < len(r) else "" for i in idx] for r in values]
+
+
+def audit_partition(timestamp):
+    """Hoja mensual del evento según su Timestamp: '2025-03-14 10:00:00' -> 'Auditoría 2025-03'."""
+    found = _AUDIT_MONTH_RE.match(str(timestamp or "").strip())
+    month = found.group(0) if found else datetime.now().strftime("%Y-%m")
+    return AUDIT_PARTITION_PREFIX + month
+
+
+def _cell_int(value):
+    """Entero de una celda numérica de Sheets ('5', '5.0'); 0 si no es un número."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def row_to_record(headers, row):
+    """Fila -> dict {encabezado: valor}, omitiendo encabezados vacíos."""
+    return {h: row[i] for i, h in enumerate(headers) if h and i < len(row)}
+
+
+class StorageBackend:
+    """
+    Interfaz común de persistencia. Los números de fila siguen la convención de Sheets.
+    Los métodos propagan excepciones; la UI decide cómo informarlas.
+    """
+    name = "base"
+    tracks_changes = False  # True si todo cambio de datos pasa por la app o se detecta al reconciliar
+
+    def read_table(self, table):
+        """Retorna la tabla completa como lista de filas (la primera son los encabezados), o [] si no existe."""
+        raise NotImplementedError
+
+    def find_row(self, table, key_value, key_col=ID_COL):
+        """Busca el primer registro cuya clave coincide. Retorna dict o None."""
+        values = self.read_table(table)
+        row_num = find_row_number(values, key_value, key_col) if str(key_value).strip() else -1
+        return row_to_record(values[0], values[row_num - 1]) if row_num != -1 else None
+
+    def read_projection(self, table, columns):
+        """
+        Lectura proyectada: igual que read_table pero solo con las columnas nombradas que existan
+        (en el orden pedido). Evita descargar las columnas JSON cuando no se necesitan.
+        """
+        return project_rows(self.read_table(table), columns)
+
+    def read_columns(self, table, col_indexes):
+        """Retorna solo las columnas pedidas (base 0), cada una como lista que incluye el encabezado."""
+        values = self.read_table(table)
+        return [[r[i] if i < len(r) else "" for r in values] for i in col_indexes]
+
+    def read_rows(self, table, row_numbers):
+        """Retorna {n_fila: fila} solo para las filas pedidas (las vacías o inexistentes vuelven como [])."""
+        values = self.read_table(table)
+        return {n: values[n - 1] if n <= len(values) else [] for n in set(row_numbers) if n >= 1}
+
+    def read_cells(self, table, key_value, columns, key_col=ID_COL):
+        """
+        {columna: valor} de la fila con esa clave, solo para las columnas pedidas que existan, o None
+        si la fila no existe. Siempre consulta la fuente de verdad (control de revisiones al guardar).
+        """
+        record = self.find_row(table, key_value, key_col)
+        if record is None:
+            return None
+        return {c: record[c] for c in columns if c in record}
+
+    def upsert_row(self, table, headers, row, key_col=ID_COL):
+        """Actualiza la fila con la misma clave o la agrega al final. Retorna el N° de fila actualizada o None si se agregó."""
+        raise NotImplementedError
+
+    def update_cells(self, table, headers, key_value, changes, key_col=ID_COL):
+        """
+        Escribe solo las celdas `changes` ({encabezado: valor}) de la fila con esa clave.
+        Retorna el N° de fila, o None si no se pudo (la fila no existe o los encabezados de la hoja
+        no coinciden con `headers`); en ese caso quien llama usa upsert_row con la fila completa.
+        """
+        values = self.read_table(table)
+        if not values or trim_row(values[0]) != trim_row(headers):
+            return None
+        row_num = find_row_number(values, key_value, key_col) if str(key_value).strip() else -1
+        if row_num == -1:
+            return None
+        row = list(values[row_num - 1]) + [""] * (len(headers) - len(values[row_num - 1]))
+        for name, value in changes.items():
+            if name in headers:
+                row[headers.index(name)] = value
+        self.update_rows(table, {row_num: row})
+        return row_num
+
+    def append_rows(self, table, headers, rows):
+        """Agrega filas al final de la tabla (creándola con encabezados si no existe)."""
+        raise NotImplementedError
+
+    def update_rows(self, table, updates):
+        """Sobrescribe filas completas: updates = {n_fila: fila}."""
+        raise NotImplementedError
+
+    def delete_rows(self, table, row_numbers):
+        """Elimina filas por número (convención de Sheets, fila 1 = encabezados)."""
+        raise NotImplementedError
+
+    def replace_child_rows(self, table, headers, key_value, rows, key_col=ID_COL):
+        """Reemplaza todas las filas asociadas a una clave por las nuevas. Retorna cuántas se escribieron."""
+        raise NotImplementedError
+
+    def write_table(self, table, rows):
+        """Reemplaza todo el contenido de la tabla (p. ej. hoja REM-P7)."""
+        raise NotImplementedError
+
+    def list_tables(self, prefix=""):
+        """Nombres de las tablas existentes que empiezan con `prefix`."""
+        raise NotImplementedError
+
+    def append_audit(self, row):
+        self.append_audit_rows([row])
+
+    def append_audit_rows(self, rows):
+        """
+        Agrega eventos de auditoría (filas de AUDIT_HEADERS) a la hoja de su mes (audit_partition),
+        todas las hojas en una sola escritura.
+        """
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(audit_partition(row[0] if row else ""), []).append(row)
+        with self.batch():
+            for table, part in partitions.items():
+                self.append_rows(table, AUDIT_HEADERS, part)
+
+    def audit_partitions(self):
+        """Hojas de auditoría existentes, de la más antigua a la más reciente (la histórica primero)."""
+        names = set(self.list_tables(AUDIT_TABLE))
+        monthly = sorted(n for n in names if n.startswith(AUDIT_PARTITION_PREFIX)
+                         and _AUDIT_MONTH_RE.match(n[len(AUDIT_PARTITION_PREFIX):]))
+        return ([AUDIT_TABLE] if AUDIT_TABLE in names else []) + monthly
+
+    def reserve_ids(self, sequence, count, seed=None):
+        """
+        Reserva `count` números consecutivos de la secuencia de forma atómica (sin colisiones entre
+        sesiones ni instancias). seed(): último número ya usado, solo se consulta si la secuencia
+        aún no existe. Retorna un range con los números reservados.
+        """
+        raise NotImplementedError
+
+    def reset_sequence(self, sequence, value):
+        """Fija el último número usado de la secuencia (p. ej. después de renumerar los IDs)."""
+        raise NotImplementedError
+
+    @contextmanager
+    def batch(self):
+        """
+        Agrupa las escrituras del bloque para enviarlas juntas al salir (un "Guardar" = una solicitud).
+        Los números de fila retornados dentro del bloque se calculan sobre el estado previo al lote,
+        y las lecturas dentro del bloque aún no ven las escrituras pendientes.
+        Por defecto las escrituras se aplican de inmediato.
+        """
+        yield self
+
+    def reconcile(self, tables=None, full=False):
+        """Sincroniza copias locales con la fuente de verdad (sin efecto si el backend no tiene copias)."""
+        return []
+
+
+# --- GOOGLE SHEETS ---
+class SheetsBackend(StorageBackend):
+    name = "sheets"
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._local = threading.local()  # Lote activo por hilo (cada sesión de Streamlit es un hilo)
+        self._indexes = {}               # Índice clave -> N° de fila por hoja (ver _build_index)
+        self._headers = {}               # Últimos encabezados vistos por hoja (lecturas proyectadas)
+        self._index_lock = threading.RLock()
+        self._seeded = set()             # Secuencias con fila base verificada en este proceso
+
+    def _ws(self, table, headers=None, create=True):
+        return self.conn.worksheet(table, headers, create=create)
+
+    # --- Índice clave -> fila ---
+    def _build_index(self, ws, table, key_col):
+        """
+        Construye el índice con una sola lectura (fila de encabezados + columna clave).
+        Retorna (índice, encabezados). El índice es {"col", "key_col", "rows": {clave: fila}, "last",
+        "keys": columna clave completa (con el encabezado)}.
+        """
+        known = self._indexes.get(table)
+        col = known["col"] if known and known["key_col"] == key_col else 0
+        header, column = ws.batch_get(["1:1", f"{col_letter(col)}:{col_letter(col)}"])
+        header = list(header[0]) if header else []
+        self._headers[table] = header
+        if key_index(header, key_col) != col:
+            # La clave no estaba donde se esperaba: segunda lectura con la columna correcta
+            col = key_index(header, key_col)
+            column = ws.batch_get([f"{col_letter(col)}:{col_letter(col)}"])[0]
+        keys = [r[0] if r else "" for r in column]
+        rows = {}
+        for n, key in enumerate(keys[1:], 2):
+            if str(key).strip():
+                rows.setdefault(str(key).strip(), n)  # Como find_row_number: gana la primera
+        index = {"col": col, "key_col": key_col, "rows": rows, "last": max(len(keys), 1), "keys": keys}
+        with self._index_lock:
+            self._indexes[table] = index
+        return index, header
+
+    def _locate(self, ws, table, key_value, key_col=ID_COL):
+        """
+        Retorna (N° de fila o -1, encabezados, fila o None si no se leyó) sin descargar la hoja completa.
+        La posición del índice se verifica leyendo solo esa fila; si no coincide (otra instancia
+        insertó o eliminó filas) el índice se reconstruye.
+        """
+        target = str(key_value).strip()
+        with self._index_lock:
+            index = self._indexes.get(table)
+        if index and index["key_col"] == key_col and target in index["rows"]:
+            n = index["rows"][target]
+            header, row = ws.batch_get(["1:1", f"{n}:{n}"])
+            header = list(header[0]) if header else []
+            row = list(row[0]) if row else []
+            col = key_index(header, key_col)
+            if col == index["col"] and len(row) > col and str(row[col]).strip() == target:
+                return n, header, row
+        index, header = self._build_index(ws, table, key_col)
+        return index["rows"].get(target, -1) if target else -1, header, None
+
+    def _index_appended(self, table, rows):
+        """Registra filas agregadas al final en el índice (si existe)."""
+        with self._index_lock:
+            index = self._indexes.get(table)
+            if not index:
+                return
+            for row in rows:
+                index["last"] += 1
+                key = str(row[index["col"]]).strip() if len(row) > index["col"] else ""
+                index["keys"][index["last"] - 1:] = [key]
+                if key:
+                    index["rows"].setdefault(key, index["last"])
+
+    def _forget_index(self, table):
+        with self._index_lock:
+            self._indexes.pop(table, None)
+
+    def read_table(self, table):
+        try:
+            return self._ws(table, create=False).get_all_values()
+        except gspread.WorksheetNotFound:
+            return []
+
+    def find_row(self, table, key_value, key_col=ID_COL):
+        try:
+            ws = self._ws(table, create=False)
+        except gspread.WorksheetNotFound:
+            return None
+        row_num, header, row = self._locate(ws, table, key_value, key_col)
+        if row_num == -1:
+            return None
+        if row is None:
+            row = self.read_rows(table, [row_num])[row_num]
+        return row_to_record(header, row)
+
+    def read_cells(self, table, key_value, columns, key_col=ID_COL):
+        """
+        Lee solo las celdas pedidas de la fila (ubicada con el índice) más la celda clave, junto con
+        sus encabezados para verificar que nada se movió; si algo no coincide, reconstruye el índice
+        y reintenta una vez. Un solo batch_get de pocas celdas.
+        """
+        try:
+            ws = self._ws(table, create=False)
+        except gspread.WorksheetNotFound:
+            return None
+        target = str(key_value).strip()
+        for attempt in range(2):
+            with self._index_lock:
+                index = self._indexes.get(table)
+            header = self._headers.get(table)
+            fresh = attempt or not index or index["key_col"] != key_col or header is None
+            if fresh:
+                index, header = self._build_index(ws, table, key_col)
+            n = index["rows"].get(target)
+            if n is None:
+                if fresh:
+                    return None
+                continue
+            names = [c for c in columns if c in header]
+            wanted = sorted({index["col"]} | {header.index(c) for c in names})
+            runs = row_runs(wanted)
+            ranges = []
+            for a, b in runs:
+                ranges += [f"{col_letter(a)}1:{col_letter(b)}1", f"{col_letter(a)}{n}:{col_letter(b)}{n}"]
+            got = ws.batch_get(ranges)
+            heads, cells = {}, {}
+            for k, (a, _) in enumerate(runs):
+                for target_map, rng in ((heads, got[2 * k]), (cells, got[2 * k + 1])):
+                    for offset, value in enumerate(rng[0] if rng else []):
+                        target_map[a + offset] = value
+            if (all(heads.get(i, "") == header[i] for i in wanted)
+                    and str(cells.get(index["col"], "")).strip() == target):
+                return {c: cells.get(header.index(c), "") for c in names}
+        return None
+
+    def read_projection(self, table, columns):
+        try:
+            ws = self._ws(table, create=False)
+        except gspread.WorksheetNotFound:
+            return []
+        for attempt in range(2):
+            header = self._headers.get(table)
+            if header is None or attempt:
+                found = ws.batch_get(["1:1"])[0]
+                header = self._headers[table] = list(found[0]) if found else []
+            names = [c for c in columns if c in header]
+            if not names:
+                return [[]] if header else []
+            idx = [header.index(c) for c in names]
+            # Un rango por tramo de columnas contiguas; cada rango trae su encabezado para validarlo
+            runs = row_runs(idx)
+            got = ws.batch_get([f"{col_letter(a)}:{col_letter(b)}" for a, b in runs])
+            cells = {}
+            for (a, b), rng in zip(runs, got):
+                for n, row in enumerate(rng):
+                    for offset, value in enumerate(row):
+                        cells[(n, a + offset)] = value
+            if all(cells.get((0, i), "") == header[i] for i in idx):
+                height = max([n + 1 for n, _ in cells] + [1])
+                return [[cells.get((n, i), "") for i in idx] for n in range(height)]
+            # Las columnas se movieron desde la última lectura: releer encabezados y reintentar
+        return project_rows(self.read_table(table), columns)
+
+    def read_columns(self, table, col_indexes):
+        if not col_indexes:
+            return []
+        try:
+            ws = self._ws(table, create=False)
+        except gspread.WorksheetNotFound:
+            return [[] for _ in col_indexes]
+        ranges = [f"{col_letter(i)}:{col_letter(i)}" for i in col_indexes]
+        return [[r[0] if r else "" for r in rng] for rng in ws.batch_get(ranges)]
+
+    def read_rows(self, table, row_numbers):
+        runs = row_runs(n for n in row_numbers if n >= 1)
+        if not runs:
+            return {}
+        try:
+            ws = self._ws(table, create=False)
+        except gspread.WorksheetNotFound:
+            return {}
+        # Un único batch_get con un rango por tramo contiguo de filas
+        found = {}
+        for (start, end), rng in zip(runs, ws.batch_get([f"{start}:{end}" for start, end in runs])):
+            for offset, row in enumerate(rng):
+                found[start + offset] = list(row)
+            for n in range(start + len(rng), end + 1):
+                found[n] = []  # Filas vacías al final del tramo
+        return found
+
+    # --- Primitivas de escritura (directas, o encoladas si hay un lote activo) ---
+    def _pending(self):
+        return getattr(self._local, "batch", None)
+
+    def _ensure_cols(self, ws, width):
+        """Amplía la grilla si una fila trae más columnas que la hoja (p. ej. columnas nuevas)."""
+        if width > ws.col_count:
+            ws.add_cols(width - ws.col_count)
+
+    @staticmethod
+    def _input_option(table):
+        return "USER_ENTERED" if table in USER_ENTERED_TABLES else "RAW"
+
+    def _put(self, ws, row_num, rows, col=0, value_input_option="RAW"):
+        if self._pending() is not None:
+            self._pending().put(ws, row_num, rows, col, user_entered=value_input_option == "USER_ENTERED")
+            return
+        self._ensure_cols(ws, col + max(len(r) for r in rows))
+        ws.update(range_name=f"{col_letter(col)}{row_num}", values=rows, value_input_option=value_input_option)
+
+    def _append(self, ws, rows, value_input_option="RAW"):
+        if self._pending() is not None:
+            self._pending().append(ws, rows, user_entered=value_input_option == "USER_ENTERED")
+            return
+        self._ensure_cols(ws, max(len(r) for r in rows))
+        ws.append_rows(rows, value_input_option=value_input_option)
+
+    def _delete(self, ws, row_numbers):
+        self._forget_index(ws.title)
+        # Siempre vía lote: tramos contiguos en un solo DeleteDimension, todo en una solicitud
+        with self.batch():
+            self._pending().delete(ws, row_numbers)
+
+    def _clear(self, ws):
+        self._forget_index(ws.title)
+        self._headers.pop(ws.title, None)
+        if self._pending() is not None:
+            self._pending().clear(ws)
+            return
+        ws.clear()
+
+    @contextmanager
+    def batch(self):
+        if self._pending() is not None:
+            yield self  # Lote anidado: escribe el lote externo
+            return
+        self._local.batch = WriteBatch()
+        try:
+            yield self
+            pending = self._pending()
+        finally:
+            self._local.batch = None
+        # Las hojas ampliadas se vuelven a pedir para que el handle conozca sus nuevas dimensiones
+        for ws in pending.flush(self.conn.spreadsheet()):
+            self.conn.forget_worksheet(ws.title)
+
+    # --- Interfaz ---
+    def upsert_row(self, table, headers, row, key_col=ID_COL):
+        ws = self._ws(table, headers)
+        key_value = str(row[key_index(headers, key_col)]).strip()
+        row_num, current_headers, _ = self._locate(ws, table, key_value, key_col)
+
+        # Asegurar encabezados
+        if trim_row(current_headers) != trim_row(headers):
+            self._put(ws, 1, [headers])
+            self._forget_index(table)
+            self._headers.pop(table, None)
+
+        if row_num != -1:
+            self._put(ws, row_num, [row])
+            return row_num
+        self._append(ws, [row])
+        self._index_appended(table, [row])
+        return None
+
+    def update_cells(self, table, headers, key_value, changes, key_col=ID_COL):
+        try:
+            ws = self._ws(table, create=False)
+        except gspread.WorksheetNotFound:
+            return None
+        row_num, current_headers, _ = self._locate(ws, table, str(key_value).strip(), key_col)
+        if row_num == -1 or trim_row(current_headers) != trim_row(headers):
+            return None
+        cells = {headers.index(name): value for name, value in changes.items() if name in headers}
+        # Un updateCells por tramo de columnas contiguas, todos en una sola solicitud
+        with self.batch():
+            for start, end in row_runs(cells):
+                self._put(ws, row_num, [[cells[i] for i in range(start, end + 1)]], col=start)
+        return row_num
+
+    def list_tables(self, prefix=""):
+        return [ws.title for ws in self.conn.spreadsheet().worksheets() if ws.title.startswith(prefix)]
+
+    def append_rows(self, table, headers, rows, value_input_option=None):
+        if rows:
+            self._append(self._ws(table, headers), rows, value_input_option or self._input_option(table))
+            self._index_appended(table, rows)
+
+    def update_rows(self, table, updates):
+        if not updates:
+            return
+        ws = self._ws(table, create=False)
+        self._forget_index(table)  # Puede cambiar claves (p. ej. migración de IDs)
+        option = self._input_option(table)
+        if self._pending() is not None:
+            for n, row in sorted(updates.items()):
+                self._put(ws, n, [row], value_input_option=option)
+            return
+        self._ensure_cols(ws, max(len(r) for r in updates.values()))
+        ws.batch_update([{"range": f"A{n}", "values": [row]} for n, row in sorted(updates.items())],
+                        value_input_option=option)
+
+    def delete_rows(self, table, row_numbers):
+        self._delete(self._ws(table, create=False), row_numbers)
+
+    def replace_child_rows(self, table, headers, key_value, rows, key_col=ID_COL):
+        ws = self._ws(table, headers)
+        # El bloque se ubica con la columna clave (índice), sin descargar la hoja completa
+        index, current = self._build_index(ws, table, key_col)
+        keys = index["keys"]
+
+        # Forzar encabezados correctos en la primera fila
+        if trim_row(current[:len(headers)]) != trim_row(headers):
+            self._put(ws, 1, [headers])
+            self._headers.pop(table, None)
+            col = key_index(headers, key_col)
+            if col != index["col"]:
+                column = ws.batch_get([f"{col_letter(col)}:{col_letter(col)}"])[0]
+                keys = [r[0] if r else "" for r in column]
+            self._forget_index(table)
+
+        # Bloque en su lugar + filas sobrantes/extra, todo en una sola solicitud
+        grid = [[key_col]] + [[key] for key in keys[1:]]
+        overwrite, rows_to_delete = child_block_plan(grid, key_value, len(rows), key_col)
+        option = self._input_option(table)
+        with self.batch():
+            if overwrite:
+                self._put(ws, overwrite[0], rows[:len(overwrite)], value_input_option=option)
+            if rows_to_delete:
+                self._delete(ws, rows_to_delete)
+            if rows[len(overwrite):]:
+                self._append(ws, rows[len(overwrite):], option)
+                self._index_appended(table, rows[len(overwrite):])
+        return len(rows)
+
+    def write_table(self, table, rows):
+        ws = self._ws(table)
+        self._clear(ws)
+        if rows:
+            self._put(ws, 1, rows)
+
+    # --- Secuencias ---
+    @staticmethod
+    def _sequence_used(ws, row_num):
+        """
+        Suma de las cantidades de las filas 2..row_num-1 de la hoja de secuencia. Cada fila guarda en
+        "Hasta" el acumulado hasta ella (la fila 2, la base, es su propio acumulado), así que basta leer
+        hacia arriba hasta la primera fila con acumulado, de a SEQUENCE_WINDOW filas.
+        """
+        pending, end = 0, row_num - 1
+        while end >= 2:
+            start = max(2, end - SEQUENCE_WINDOW + 1)
+            cells = ws.batch_get([f"A{start}:D{end}"])[0]
+            cells = cells + [[]] * (end - start + 1 - len(cells))  # Sheets omite las filas vacías del final
+            for n, row in zip(range(end, start - 1, -1), reversed(cells)):
+                upto = _cell_int(row[3]) if len(row) > 3 and str(row[3]).strip() else None
+                if upto is None and n == 2:
+                    upto = _cell_int(row[1]) if len(row) > 1 else 0
+                if upto is not None:
+                    return upto + pending
+                pending += _cell_int(row[1]) if len(row) > 1 else 0
+            end = start - 1
+        return pending
+
+    def reserve_ids(self, sequence, count, seed=None):
+        """
+        Sheets no ofrece compare-and-set, pero sí serializa los append: cada reserva agrega una fila
+        ("reserva", cantidad) a la hoja de la secuencia y la API informa en qué fila quedó. El bloque
+        empieza después de la suma de las cantidades de las filas anteriores (la fila 2 es la base),
+        así que dos instancias que reservan a la vez obtienen bloques distintos. Las filas nunca se
+        eliminan (una compactación desplazaría la numeración que otra instancia está leyendo); en
+        cambio cada reserva anota su acumulado ("Hasta") y la siguiente solo lee hasta esa fila.
+        Costo: un append, la lectura de unas pocas filas y la escritura de una celda.
+        """
+        ws = self._ws(SEQUENCE_SHEET_PREFIX + sequence, SEQUENCE_HEADERS)
+        stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if sequence not in self._seeded:
+            base = ws.batch_get(["A2:B2"])[0]
+            if not base or not base[0]:
+                # Dos instancias sembrando a la vez solo dejan un salto en la numeración
+                ws.append_rows([["base", int(seed() if seed else 0), stamp]],
+                               value_input_option="RAW", insert_data_option="INSERT_ROWS", table_range="A1")
+            self._seeded.add(sequence)
+        response = ws.append_rows([["reserva", int(count), stamp]], value_input_option="RAW",
+                                  insert_data_option="INSERT_ROWS", table_range="A1")
+        row_num = int(re.search(r"![A-Z$]+(\d+)", response["updates"]["updatedRange"]).group(1))
+        used = self._sequence_used(ws, row_num) if row_num > 2 else 0
+        try:
+            ws.update(range_name=f"D{row_num}", values=[[used + int(count)]], value_input_option="RAW")
+        except Exception:
+            pass  # Sin el acumulado la reserva igual vale; la próxima solo lee más filas
+        return range(used + 1, used + int(count) + 1)
+
+    def reset_sequence(self, sequence, value):
+        stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.write_table(SEQUENCE_SHEET_PREFIX + sequence, [SEQUENCE_HEADERS, ["base", int(value), stamp, int(value)]])
+        self._seeded.add(sequence)
+
+
+_INTEGER_RE = re.compile(r"^[+-]?\d{1,15}$")
+
+
+class WriteBatch:
+    """
+    Mutaciones de Sheets acumuladas durante un "Guardar" (SheetsBackend.batch()).
+    flush() las envía en un único spreadsheet.batch_update, que Sheets aplica de forma atómica.
+    Orden: ampliar columnas, limpiar hojas, sobrescribir filas o tramos de celdas (con la numeración previa al lote),
+    eliminar filas de abajo hacia arriba (un DeleteDimension por tramo contiguo) y, al final, agregar filas.
+    Las celdas se escriben como valores literales (equivalente a RAW), salvo las marcadas
+    user_entered, que se interpretan como lo haría USER_ENTERED (ver _parsed_cell).
+    """
+
+    def __init__(self):
+        self.worksheets = {}
+        self.widened = []
+        self.clears = []
+        self.puts = []
+        self.deletes = {}
+        self.appends = []
+
+    def _track(self, ws):
+        self.worksheets[ws.id] = ws
+        return ws.id
+
+    def put(self, ws, row_num, rows, col=0, user_entered=False):
+        self.puts.append((self._track(ws), row_num, rows, col, user_entered))
+
+    def append(self, ws, rows, user_entered=False):
+        self.appends.append((self._track(ws), rows, user_entered))
+
+    def delete(self, ws, row_numbers):
+        self.deletes.setdefault(self._track(ws), set()).update(n for n in row_numbers if n >= 2)
+
+    def clear(self, ws):
+        self.clears.append(self._track(ws))
+
+    @staticmethod
+    def _cell(value):
+        if value is None:
+            return {"userEnteredValue": {"stringValue": ""}}
+        if isinstance(value, bool):
+            return {"userEnteredValue": {"boolValue": value}}
+        if isinstance(value, numbers.Number):
+            return {"userEnteredValue": {"numberValue": float(value)}}
+        return {"userEnteredValue": {"stringValue": str(value)}}
+
+    @classmethod
+    def _parsed_cell(cls, value):
+        """
+        Celda como la dejaría USER_ENTERED, solo en los casos que no dependen de la configuración
+        regional de la planilla: fórmulas, TRUE/FALSE y números enteros. Fechas, decimales,
+        porcentajes y el resto quedan como texto literal (Sheets los interpretaría según el
+        separador decimal y el formato de fecha del locale); se leen igual que como se escribieron.
+        """
+        if not isinstance(value, str):
+            return cls._cell(value)
+        text = value.strip()
+        if text.startswith("="):
+            return {"userEnteredValue": {"formulaValue": text}}
+        if text.upper() in ("TRUE", "FALSE"):
+            return {"userEnteredValue": {"boolValue": text.upper() == "TRUE"}}
+        if _INTEGER_RE.match(text):
+            return {"userEnteredValue": {"numberValue": int(text)}}
+        return cls._cell(value)
+
+    def _rows(self, rows, user_entered=False):
+        cell = self._parsed_cell if user_entered else self._cell
+        return [{"values": [cell(v) for v in row]} for row in rows]
+
+    @staticmethod
+    def _fields(user_entered):
+        return "userEnteredValue,userEnteredFormat.numberFormat" if user_entered else "userEnteredValue"
+
+    def requests(self):
+        requests = []
+        widths = {}
+        self.widened = []
+        for sheet_id, _, rows, col, _ in self.puts:
+            widths[sheet_id] = max([widths.get(sheet_id, 0)] + [col + len(r) for r in rows])
+        for sheet_id, rows, _ in self.appends:
+            widths[sheet_id] = max([widths.get(sheet_id, 0)] + [len(r) for r in rows])
+        for sheet_id, width in widths.items():
+            missing = width - self.worksheets[sheet_id].col_count
+            if missing > 0:
+                self.widened.append(sheet_id)
+                requests.append({"appendDimension": {"sheetId": sheet_id, "dimension": "COLUMNS", "length": missing}})
+
+        for sheet_id in self.clears:
+            requests.append({"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}})
+        for sheet_id, row_num, rows, col, user_entered in self.puts:
+            requests.append({"updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": row_num - 1, "columnIndex": col},
+                "rows": self._rows(rows, user_entered), "fields": self._fields(user_entered)}})
+        for sheet_id, row_numbers in self.deletes.items():
+            for start, end in reversed(row_runs(row_numbers)):
+                requests.append({"deleteDimension": {"range": {
+                    "sheetId": sheet_id, "dimension": "ROWS", "startIndex": start - 1, "endIndex": end}}})
+        for sheet_id, rows, user_entered in self.appends:
+            requests.append({"appendCells": {"sheetId": sheet_id, "rows": self._rows(rows, user_entered),
+                                             "fields": self._fields(user_entered)}})
+        return requests
+
+    def flush(self, spreadsheet):
+        requests = self.requests()
+        if requests:
+            spreadsheet.batch_update({"requests": requests})
+        return [self.worksheets[sheet_id] for sheet_id in self.widened]
+
+
+# --- MEMORIA ---
+class MemoryBackend(StorageBackend):
+    name = "memory"
+    tracks_changes = True
+
+    def __init__(self, tables=None):
+        self._tables = {t: [list(map(to_cell, r)) for r in rows] for t, rows in (tables or {}).items()}
+        self._sequences = {}
+        self._lock = threading.RLock()
+
+    def _grid(self, table, headers=None):
+        grid = self._tables.setdefault(table, [])
+        if not grid and headers:
+            grid.append([to_cell(h) for h in headers])
+        return grid
+
+    def read_table(self, table):
+        with self._lock:
+            return [list(r) for r in self._tables.get(table, [])]
+
+    def upsert_row(self, table, headers, row, key_col=ID_COL):
+        with self._lock:
+            grid = self._grid(table, headers)
+            grid[0] = list(headers)
+            cells = [to_cell(v) for v in row]
+            key_value = cells[key_index(headers, key_col)].strip()
+            row_num = find_row_number(grid, key_value, key_col) if key_value else -1
+            if row_num != -1:
+                grid[row_num - 1] = cells
+                return row_num
+            grid.append(cells)
+            return None
+
+    def list_tables(self, prefix=""):
+        with self._lock:
+            return [t for t in self._tables if t.startswith(prefix)]
+
+    def append_rows(self, table, headers, rows):
+        with self._lock:
+            grid = self._grid(table, headers)
+            grid.extend([to_cell(v) for v in r] for r in rows)
+
+    def update_rows(self, table, updates):
+        with self._lock:
+            grid = self._grid(table)
+            for n, row in updates.items():
+                grid[n - 1] = [to_cell(v) for v in row]
+
+    def delete_rows(self, table, row_numbers):
+        with self._lock:
+            grid = self._grid(table)
+            for row_num in sorted(set(row_numbers), reverse=True):
+                if 1 < row_num <= len(grid):
+                    del grid[row_num - 1]
+
+    def replace_child_rows(self, table, headers, key_value, rows, key_col=ID_COL):
+        with self._lock:
+            grid = self._grid(table, headers)
+            grid[0] = list(headers)
+            cells = [[to_cell(v) for v in r] for r in rows]
+            overwrite, rows_to_delete = child_block_plan(grid, key_value, len(cells), key_col)
+            for n, row in zip(overwrite, cells):
+                grid[n - 1] = row
+            for n in sorted(rows_to_delete, reverse=True):
+                del grid[n - 1]
+            grid.extend(cells[len(overwrite):])
+            return len(rows)
+
+    def write_table(self, table, rows):
+        with self._lock:
+            self._tables[table] = [[to_cell(v) for v in r] for r in rows]
+
+    def reserve_ids(self, sequence, count, seed=None):
+        with self._lock:
+            if sequence not in self._sequences:
+                self._sequences[sequence] = int(seed() if seed else 0)
+            start = self._sequences[sequence] + 1
+            self._sequences[sequence] += int(count)
+        return range(start, start + int(count))
+
+    def reset_sequence(self, sequence, value):
+        with self._lock:
+            self._sequences[sequence] = int(value)
+
+
+# --- SQLITE ---
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Cada hoja es una tabla SQLite con columnas posicionales c0..cN (igual que la grilla de Sheets,
+    lo que tolera encabezados vacíos o repetidos). Los encabezados se guardan en la tabla _tables
+    y la columna clave se indexa en la primera búsqueda.
+    """
+    name = "sqlite"
+    tracks_changes = True
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS _tables (name TEXT PRIMARY KEY, headers TEXT, width INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS _sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    # --- Esquema ---
+    def _meta(self, table):
+        cur = self._db.execute("SELECT headers, width FROM _tables WHERE name = ?", (table,))
+        found = cur.fetchone()
+        return (json.loads(found[0]), found[1]) if found else (None, 0)
+
+    def _ensure_table(self, table, width, headers=None):
+        current_headers, current_width = self._meta(table)
+        if current_headers is None:
+            cols = ", ".join(f"c{i} TEXT DEFAULT ''" for i in range(max(width, 1)))
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} (_row INTEGER PRIMARY KEY AUTOINCREMENT, {cols})")
+            current_width = max(width, 1)
+            self._db.execute("INSERT INTO _tables (name, headers, width) VALUES (?, ?, ?)",
+                             (table, json.dumps(headers or [], ensure_ascii=False), current_width))
+        for i in range(current_width, width):
+            self._db.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN c{i} TEXT DEFAULT ''")
+        if width > current_width:
+            self._db.execute("UPDATE _tables SET width = ? WHERE name = ?", (width, table))
+        if headers is not None and headers != current_headers:
+            self._db.execute("UPDATE _tables SET headers = ? WHERE name = ?",
+                             (json.dumps(list(headers), ensure_ascii=False), table))
+        return max(width, current_width)
+
+    def _ensure_index(self, table, col):
+        # Índice sobre la clave sin espacios: las búsquedas comparan TRIM(clave), como Sheets y memoria
+        self._db.execute(f"DROP INDEX IF EXISTS {_quote(f'ix_{table}_c{col}')}")
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'ix_{table}_k{col}')} ON {_quote(table)} (TRIM(c{col}))")
+
+    def _insert(self, table, rows):
+        if not rows:
+            return
+        width = max(len(r) for r in rows)
+        cols = ", ".join(f"c{i}" for i in range(width))
+        marks = ", ".join("?" for _ in range(width))
+        padded = [[to_cell(v) for v in r] + [""] * (width - len(r)) for r in rows]
+        self._db.executemany(f"INSERT INTO {_quote(table)} ({cols}) VALUES ({marks})", padded)
+
+    def _position(self, table, rowid):
+        cur = self._db.execute(f"SELECT COUNT(*) FROM {_quote(table)} WHERE _row <= ?", (rowid,))
+        return cur.fetchone()[0] + 1
+
+    # --- Interfaz ---
+    def read_table(self, table):
+        with self._lock:
+            headers, width = self._meta(table)
+            if headers is None:
+                return []
+            cols = ", ".join(f"c{i}" for i in range(width))
+            rows = [list(r) for r in self._db.execute(f"SELECT {cols} FROM {_quote(table)} ORDER BY _row")]
+        header_row = list(headers) + [""] * (width - len(headers))
+        return [header_row] + rows if (headers or rows) else []
+
+    def read_projection(self, table, columns):
+        with self._lock:
+            headers, _ = self._meta(table)
+            if headers is None:
+                return []
+            names = [c for c in columns if c in headers]
+            if not names:
+                return [[]] if headers else []
+            cols = ", ".join(f"c{headers.index(c)}" for c in names)
+            rows = [list(r) for r in self._db.execute(f"SELECT {cols} FROM {_quote(table)} ORDER BY _row")]
+        return [names] + rows
+
+    def find_row(self, table, key_value, key_col=ID_COL):
+        with self._lock:
+            headers, width = self._meta(table)
+            if not headers:
+                return None
+            k = key_index(headers, key_col)
+            self._ensure_index(table, k)
+            cols = ", ".join(f"c{i}" for i in range(width))
+            key_value = str(key_value).strip()
+            found = self._db.execute(f"SELECT {cols} FROM {_quote(table)} WHERE TRIM(c{k}) = ? ORDER BY _row LIMIT 1",
+                                     (key_value,)).fetchone() if key_value else None
+        return row_to_record(headers, list(found)) if found else None
+
+    def upsert_row(self, table, headers, row, key_col=ID_COL):
+        cells = [to_cell(v) for v in row]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                width = self._ensure_table(table, max(len(headers), len(cells)), headers)
+                k = key_index(headers, key_col)
+                self._ensure_index(table, k)
+                key_value = cells[k].strip() if k < len(cells) else ""
+                found = None
+                if key_value:
+                    found = self._db.execute(f"SELECT _row FROM {_quote(table)} WHERE TRIM(c{k}) = ? ORDER BY _row LIMIT 1",
+                                             (key_value,)).fetchone()
+                if found:
+                    padded = cells + [""] * (width - len(cells))
+                    sets = ", ".join(f"c{i} = ?" for i in range(width))
+                    self._db.execute(f"UPDATE {_quote(table)} SET {sets} WHERE _row = ?", padded + [found[0]])
+                    result = self._position(table, found[0])
+                else:
+                    self._insert(table, [cells])
+                    result = None
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return result
+
+    def update_cells(self, table, headers, key_value, changes, key_col=ID_COL):
+        with self._lock:
+            current, _ = self._meta(table)
+            if not current or trim_row(current) != trim_row(headers):
+                return None
+            k = key_index(headers, key_col)
+            self._ensure_index(table, k)
+            cells = {headers.index(name): to_cell(value) for name, value in changes.items() if name in headers}
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                key_value = str(key_value).strip()
+                found = self._db.execute(f"SELECT _row FROM {_quote(table)} WHERE TRIM(c{k}) = ? ORDER BY _row LIMIT 1",
+                                         (key_value,)).fetchone() if key_value else None
+                result = None
+                if found:
+                    if cells:
+                        self._ensure_table(table, max(cells) + 1)
+                        sets = ", ".join(f"c{i} = ?" for i in cells)
+                        self._db.execute(f"UPDATE {_quote(table)} SET {sets} WHERE _row = ?", list(cells.values()) + [found[0]])
+                    result = self._position(table, found[0])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return result
+
+    def list_tables(self, prefix=""):
+        with self._lock:
+            names = [r[0] for r in self._db.execute("SELECT name FROM _tables ORDER BY name")]
+        return [n for n in names if n.startswith(prefix)]
+
+    def append_rows(self, table, headers, rows):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                width = max([len(headers)] + [len(r) for r in rows])
+                current_headers, _ = self._meta(table)
+                self._ensure_table(table, width, headers if not current_headers else None)
+                self._insert(table, rows)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def update_rows(self, table, updates):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                width = self._ensure_table(table, max(len(r) for r in updates.values()) if updates else 0)
+                sets = ", ".join(f"c{i} = ?" for i in range(width))
+                for n, row in updates.items():
+                    found = self._db.execute(f"SELECT _row FROM {_quote(table)} ORDER BY _row LIMIT 1 OFFSET ?",
+                                             (n - 2,)).fetchone()
+                    if found:
+                        cells = [to_cell(v) for v in row]
+                        self._db.execute(f"UPDATE {_quote(table)} SET {sets} WHERE _row = ?",
+                                         cells + [""] * (width - len(cells)) + [found[0]])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _rowids(self, table, row_numbers):
+        """Traduce números de fila (posición) a _row internos."""
+        wanted = {n - 2 for n in row_numbers if n >= 2}
+        if not wanted:
+            return []
+        cur = self._db.execute(f"SELECT _row FROM {_quote(table)} ORDER BY _row")
+        return [r[0] for pos, r in enumerate(cur) if pos in wanted]
+
+    def delete_rows(self, table, row_numbers):
+        with self._lock:
+            if self._meta(table)[0] is None:
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(f"DELETE FROM {_quote(table)} WHERE _row = ?",
+                                     [(r,) for r in self._rowids(table, row_numbers)])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def replace_child_rows(self, table, headers, key_value, rows, key_col=ID_COL):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                width = self._ensure_table(table, max([len(headers)] + [len(r) for r in rows]), headers)
+                k = key_index(headers, key_col)
+                # Misma estrategia que Sheets para que ambas grillas conserven el mismo orden de filas
+                found = self._db.execute(f"SELECT _row, c{k} FROM {_quote(table)} ORDER BY _row").fetchall()
+                ids = [r[0] for r in found]
+                keys = [[""] * k + [r[1]] for r in found]
+                overwrite, rows_to_delete = child_block_plan([headers] + keys, key_value, len(rows), key_col)
+                sets = ", ".join(f"c{i} = ?" for i in range(width))
+                for n, row in zip(overwrite, rows):
+                    cells = [to_cell(v) for v in row]
+                    self._db.execute(f"UPDATE {_quote(table)} SET {sets} WHERE _row = ?",
+                                     cells + [""] * (width - len(cells)) + [ids[n - 2]])
+                self._db.executemany(f"DELETE FROM {_quote(table)} WHERE _row = ?",
+                                     [(ids[n - 2],) for n in rows_to_delete])
+                self._insert(table, rows[len(overwrite):])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def write_table(self, table, rows):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                width = max([len(r) for r in rows] + [1])
+                self._ensure_table(table, width, [to_cell(v) for v in rows[0]] if rows else [])
+                self._db.execute(f"DELETE FROM {_quote(table)}")
+                self._insert(table, rows[1:])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def reserve_ids(self, sequence, count, seed=None):
+        # BEGIN IMMEDIATE bloquea a otros procesos que escriban la misma base: leer y avanzar es atómico
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                found = self._db.execute("SELECT value FROM _sequences WHERE name = ?", (sequence,)).fetchone()
+                value = found[0] if found else int(seed() if seed else 0)
+                self._db.execute("INSERT INTO _sequences (name, value) VALUES (?, ?) "
+                                 "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                                 (sequence, value + int(count)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return range(value + 1, value + int(count) + 1)
+
+    def reset_sequence(self, sequence, value):
+        with self._lock:
+            self._db.execute("INSERT INTO _sequences (name, value) VALUES (?, ?) "
+                             "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (sequence, int(value)))
+
+
+# --- SELECCIÓN DEL BACKEND ---
+def open_backend(kind="sheets", creds_dict=None, sqlite_path=DEFAULT_SQLITE_PATH, sheet_url=SHEET_URL):
+    """Construye un backend fuera de Streamlit (scripts de mantenimiento, benchmarks)."""
+    if kind == "sqlite":
+        return SQLiteBackend(sqlite_path)
+    if kind == "memory":
+        return MemoryBackend()
+    return SheetsBackend(SheetsConnection(creds_dict, sheet_url))
+
+
+def storage_settings():
+    """Lee [storage] desde secrets.toml (opcional); GEN_ENC_STORAGE tiene prioridad sobre backend."""
+    try:
+        settings = dict(st.secrets.get("storage", {}))
+    except Exception:
+        settings = {}
+    if os.environ.get("GEN_ENC_STORAGE"):
+        settings["backend"] = os.environ["GEN_ENC_STORAGE"]
+    if os.environ.get("GEN_ENC_MIRROR"):
+        settings["mirror"] = os.environ["GEN_ENC_MIRROR"].lower() not in ("0", "false", "no")
+    if os.environ.get("GEN_ENC_COMPACT_JSON"):
+        settings["compact_json"] = os.environ["GEN_ENC_COMPACT_JSON"].lower() not in ("0", "false", "no")
+    if os.environ.get("GEN_ENC_OUTBOX"):
+        settings["outbox"] = os.environ["GEN_ENC_OUTBOX"].lower() not in ("0", "false", "no")
+    settings.setdefault("backend", "sheets")
+    settings.setdefault("sqlite_path", DEFAULT_SQLITE_PATH)
+    settings.setdefault("mirror", True)
+    settings.setdefault("version_bus", "process")
+    settings.setdefault("outbox", False)
+    settings.setdefault("compact_json", False)
+    return settings
+
+
+def _publish_change(table):
+    from data_version import notify_change
+    notify_change(table)
+
+
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    """Backend de persistencia único por proceso, compartido por todas las sesiones."""
+    settings = storage_settings()
+    kind = settings["backend"]
+    if kind == "sheets":
+        backend = SheetsBackend(get_connection())
+        if settings["mirror"]:
+            from mirror import DEFAULT_MIRROR_PATH, RECONCILE_SECONDS, MirroredBackend
+            backend = MirroredBackend(
+                backend,
+                SQLiteBackend(settings.get("mirror_path", DEFAULT_MIRROR_PATH)),
+                reconcile_seconds=int(settings.get("reconcile_seconds", RECONCILE_SECONDS)),
+                on_change=_publish_change,
+            )
+        return backend
+    return open_backend(kind, sqlite_path=settings["sqlite_path"])
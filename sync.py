@@ -0,0 +1,154 @@
+"""
+sync.py — Sincronización incremental (delta) de hojas con marca de actualización.
+Cada guardado de una evaluación estampa "Fecha Actualización" y "Revisión". Para refrescar
+una copia local basta entonces con:
+  1. Sondeo: leer solo las columnas ID + Fecha Actualización + Revisión (una llamada, pocos KB)
+  2. Si coinciden con la copia local, no se descarga nada más
+  3. Si no, descargar únicamente las filas cuya marca cambió y las filas nuevas (un batch_get)
+Eliminaciones o reordenamientos de filas (p. ej. ediciones manuales en la planilla) fuerzan
+una copia completa, igual que la resincronización completa periódica.
+La misma "Revisión" sirve de control de concurrencia optimista: al guardar se compara la revisión
+de la fila en la base con la que tenía el registro al cargarse (RevisionConflict si otro usuario
+guardó entremedio) y field_changes() arma la comparación campo a campo para resolver el conflicto.
+"""
+from datetime import datetime
+
+from storage import ID_COL, key_index, trim_row
+
+STAMP_COL = "Fecha Actualización"
+REVISION_COL = "Revisión"
+STAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def current_revision(record):
+    """Revisión guardada en un registro (dict), 0 si no tiene."""
+    try:
+        return int(str((record or {}).get(REVISION_COL, "") or 0).strip())
+    except ValueError:
+        return 0
+
+
+def stamp_row(headers, row, previous=None):
+    """
+    Agrega/actualiza las columnas Fecha Actualización y Revisión.
+    previous: registro actual (dict) para continuar su revisión. Retorna (headers, row) nuevos.
+    """
+    headers = list(headers)
+    row = list(row)
+    for col in (STAMP_COL, REVISION_COL):
+        if col not in headers:
+            headers.append(col)
+    row += [""] * (len(headers) - len(row))
+    row[headers.index(STAMP_COL)] = datetime.now().strftime(STAMP_FORMAT)
+    row[headers.index(REVISION_COL)] = current_revision(previous) + 1
+    return headers, row
+
+
+class RevisionConflict(Exception):
+    """El registro cambió en la base desde que se cargó (otro usuario guardó entremedio)."""
+
+    def __init__(self, key, loaded, current):
+        super().__init__(f"El registro {key} fue modificado por otro usuario "
+                         f"(revisión {current}, se cargó la {loaded}).")
+        self.key, self.loaded, self.current = key, loaded, current
+
+
+def check_revision(loaded, current, key=""):
+    """Lanza RevisionConflict si la revisión actual (dict de la base) no es la del registro cargado."""
+    if current_revision(current) != current_revision(loaded):
+        raise RevisionConflict(key, current_revision(loaded), current_revision(current))
+
+
+def field_changes(base, mine, theirs):
+    """
+    Diferencias campo a campo entre el registro al cargarse (base), la versión a guardar (mine)
+    y la versión actual en la base (theirs); todos dicts de texto. Omite las columnas de marca.
+    Retorna [(campo, base, mine, theirs, origen)] con origen "mío", "otro" o "ambos" (conflicto).
+    """
+    changes = []
+    for field in dict.fromkeys(list(mine) + list(theirs)):
+        if field in (STAMP_COL, REVISION_COL):
+            continue
+        b, m, t = base.get(field, ""), mine.get(field, ""), theirs.get(field, "")
+        if m == t or (m == b and t == b):
+            continue
+        origin = "mío" if t == b else "otro" if m == b else "ambos"
+        changes.append((field, b, m, t, origin))
+    return changes
+
+
+def merge_changes(base, mine, theirs, keep_theirs=()):
+    """
+    Combina por campo: los campos que cambió solo el otro usuario toman su valor, los que cambié yo
+    conservan el mío, y en los conflictos ("ambos") gana el mío salvo los listados en keep_theirs.
+    """
+    merged = dict(theirs)
+    for field, _, m, _, origin in field_changes(base, mine, theirs):
+        if origin == "mío" or (origin == "ambos" and field not in keep_theirs):
+            merged[field] = m
+    return merged
+
+
+def _column_rows(column, count):
+    """Valores de una columna para las filas 2..count+1 (rellena celdas vacías al final)."""
+    body = list(column[1:])
+    return body + [""] * (count - len(body))
+
+
+def fetch_delta(primary, local, table, key_col=ID_COL):
+    """
+    Parte de lectura de delta_sync: compara la copia `local` con `primary` y descarga solo las filas
+    que cambiaron, sin escribir nada. Retorna ("skip", None), ("full", None) o
+    ("delta", (encabezados, {n_fila: fila modificada}, [filas agregadas])) para apply_delta().
+    """
+    values = local.read_table(table)
+    if not values or STAMP_COL not in values[0]:
+        return "full", None
+    headers = values[0]
+    # La revisión desambigua dos guardados dentro del mismo segundo
+    probe = [key_index(headers, key_col), headers.index(STAMP_COL)]
+    if REVISION_COL in headers:
+        probe.append(headers.index(REVISION_COL))
+
+    # 1. Sondeo barato: solo ID + marca (+ revisión)
+    columns = primary.read_columns(table, probe)
+    if any(not col or col[0] != headers[i] for col, i in zip(columns, probe)):
+        return "full", None
+    count = max(len(col) for col in columns) - 1
+    remote = list(zip(*(_column_rows(col, count) for col in columns)))
+    current = [tuple(r[i] if i < len(r) else "" for i in probe) for r in values[1:]]
+    if remote == current:
+        return "skip", None
+
+    # Solo se soportan ediciones en sitio y filas agregadas al final
+    if len(remote) < len(current) or [r[0] for r in remote[:len(current)]] != [c[0] for c in current]:
+        return "full", None
+
+    # 2. Descargar solo filas modificadas y nuevas (más la fila de encabezados para validarla)
+    changed = [i for i, (a, b) in enumerate(zip(remote, current), 2) if a != b]
+    added = list(range(len(current) + 2, len(remote) + 2))
+    rows = primary.read_rows(table, [1] + changed + added)
+    if trim_row(rows.get(1, [])) != trim_row(headers):
+        return "full", None
+    return "delta", (headers, {n: rows.get(n, []) for n in changed}, [rows.get(n, []) for n in added])
+
+
+def apply_delta(local, table, delta):
+    """Parte de escritura de delta_sync: aplica en `local` lo descargado por fetch_delta()."""
+    headers, changed, added = delta
+    if changed:
+        local.update_rows(table, changed)
+    if added:
+        local.append_rows(table, headers, added)
+
+
+def delta_sync(primary, local, table, key_col=ID_COL):
+    """
+    Actualiza `local` (copia de `table`) trayendo desde `primary` solo lo que cambió.
+    Retorna "skip" (sin cambios), "delta" (filas actualizadas/agregadas) o "full" si hace falta
+    una copia completa (la decide quien llama).
+    """
+    result, delta = fetch_delta(primary, local, table, key_col)
+    if result == "delta":
+        apply_delta(local, table, delta)
+    return result
@@ -0,0 +1,42 @@
+"""Foto compartida de Evaluaciones e invalidación por versión de datos (analytics.py, data_version.py)."""
+import pytest
+
+pytest.importorskip("plotly")
+
+from analytics import get_evaluaciones_snapshot, invalidate_evaluaciones_cache, load_evaluaciones_df
+
+HEADERS = ["ID Evaluación", "Familia", "Sector", "Establecimiento"]
+
+
+@pytest.fixture
+def db(memory_storage):
+    memory_storage.append_rows("Evaluaciones", HEADERS, [["EVA-001", "Pérez", "Sol", "Cesfam"],
+                                                         ["EVA-002", "Soto", "Luna", "Posta"]])
+    reads = []
+    original = memory_storage.read_table
+    memory_storage.read_table = lambda table: reads.append(table) or original(table)
+    memory_storage.reads = reads
+    return memory_storage
+
+
+def test_snapshot_is_loaded_once_per_version(db):
+    assert get_evaluaciones_snapshot() is get_evaluaciones_snapshot()
+    load_evaluaciones_df()
+    load_evaluaciones_df(est_filter="Posta")
+    assert db.reads == ["Evaluaciones"]
+
+
+def test_callers_get_their_own_frame(db):
+    df = load_evaluaciones_df()
+    df.loc[0, "Familia"] = "Cambiada"
+    assert load_evaluaciones_df().loc[0, "Familia"] == "Pérez"
+    assert list(load_evaluaciones_df(est_filter="Posta")["ID Evaluación"]) == ["EVA-002"]
+
+
+def test_a_save_invalidates_the_snapshot_for_every_session(db):
+    load_evaluaciones_df()
+    db.upsert_row("Evaluaciones", HEADERS, ["EVA-003", "Rojas", "Sol", "Cesfam"])
+    assert len(load_evaluaciones_df()) == 2  # Sin aviso, la foto vigente se sigue sirviendo
+    invalidate_evaluaciones_cache()
+    assert list(load_evaluaciones_df()["ID Evaluación"]) == ["EVA-001", "EVA-002", "EVA-003"]
+    assert db.reads == ["Evaluaciones", "Evaluaciones"]
@@ -0,0 +1,138 @@
+"""Auditoría con búfer local y envío por lotes (audit.py), particionada por mes y consultada en AuditIndex."""
+from datetime import date, datetime
+
+import pytest
+
+from audit import AuditBuffer, AuditIndex
+from storage import AUDIT_HEADERS, AUDIT_TABLE, MemoryBackend, trim_row
+
+
+def _event(ts, usuario="ana", accion="Guardar", eval_id="EVA-001"):
+    return [ts, usuario, "Enfermera", accion, "", eval_id]
+
+
+class OfflineBackend(MemoryBackend):
+    def append_audit_rows(self, rows):
+        raise ConnectionError("sin conexión")
+
+
+def test_log_only_writes_the_local_file(tmp_path):
+    db = MemoryBackend()
+    buffer = AuditBuffer(db, spill_path=str(tmp_path / "spill.jsonl"))
+    buffer.log(_event("2025-03-14 10:00:00"))
+    assert buffer.pending() == 1
+    assert db.list_tables() == []
+    assert (tmp_path / "spill.jsonl").read_text(encoding="utf-8").count("\n") == 1
+
+
+def test_flush_sends_every_month_in_one_request(sheets_backend, spreadsheet, tmp_path):
+    buffer = AuditBuffer(sheets_backend, spill_path=str(tmp_path / "spill.jsonl"))
+    for ts in ("2025-02-27 09:00:00", "2025-03-01 08:00:00", "2025-03-14 10:00:00"):
+        buffer.log(_event(ts))
+    sent = spreadsheet.batch_updates
+    assert buffer.flush() == 3
+    assert spreadsheet.batch_updates == sent + 1
+    assert sheets_backend.audit_partitions() == ["Auditoría 2025-02", "Auditoría 2025-03"]
+    assert [trim_row(r)[0] for r in sheets_backend.read_table("Auditoría 2025-03")] == [
+        "Timestamp", "2025-03-01 08:00:00", "2025-03-14 10:00:00"]
+    assert buffer.pending() == 0 and (tmp_path / "spill.jsonl").read_text(encoding="utf-8") == ""
+    assert buffer.flush() == 0
+
+
+def test_append_audit_rows_partitions_alike_on_every_backend(backend):
+    backend.append_audit_rows([_event("2025-02-27 09:00:00"), _event("2025-03-01 08:00:00")])
+    assert backend.audit_partitions() == ["Auditoría 2025-02", "Auditoría 2025-03"]
+    assert trim_row(backend.read_table("Auditoría 2025-02")[0]) == AUDIT_HEADERS
+
+
+def test_events_survive_a_failed_send_and_a_restart(tmp_path):
+    spill = str(tmp_path / "spill.jsonl")
+    buffer = AuditBuffer(OfflineBackend(), spill_path=spill)
+    buffer.log(_event("2025-03-14 10:00:00"))
+    buffer.log(_event("2025-03-14 10:05:00", accion="Eliminar"))
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    assert buffer.pending() == 2
+    # El proceso se reinicia: los eventos del archivo se envían en la primera pasada
+    with open(spill, "a", encoding="utf-8") as f:
+        f.write('["2025-03-14 10:1')  # Línea truncada por la caída
+    db = MemoryBackend()
+    restarted = AuditBuffer(db, spill_path=spill)
+    assert restarted.pending() == 2
+    assert restarted.flush() == 2
+    assert [r[3] for r in db.read_table("Auditoría 2025-03")[1:]] == ["Guardar", "Eliminar"]
+
+
+def test_full_buffer_wakes_the_sender(tmp_path):
+    buffer = AuditBuffer(MemoryBackend(), spill_path=str(tmp_path / "spill.jsonl"), flush_size=2)
+    buffer.log(_event("2025-03-14 10:00:00"))
+    assert not buffer._wake.is_set()
+    buffer.log(_event("2025-03-14 10:01:00"))
+    assert buffer._wake.is_set()
+
+
+# --- Índice local de consultas ---
+
+def _read_counts(db):
+    """Cuántas veces se leyó cada hoja completa."""
+    counts = {}
+    original = db.read_table
+
+    def read_table(table):
+        counts[table] = counts.get(table, 0) + 1
+        return original(table)
+    db.read_table = read_table
+    return counts
+
+
+@pytest.fixture
+def audited():
+    db = MemoryBackend()
+    db.append_audit_rows([_event("2025-02-27 09:00:00", "ana", "Guardar", "EVA-001"),
+                          _event("2025-03-01 08:00:00", "luis", "Eliminar", "EVA-002"),
+                          _event("2025-03-14 10:00:00", "ana", "Guardar", "EVA-002")])
+    return db
+
+
+def test_query_filters_pages_and_sorts_newest_first(audited):
+    index = AuditIndex(":memory:")
+    assert index.sync(audited) == 2
+    rows, total = index.query(usuario="ana")
+    assert total == 2 and [r[0] for r in rows] == ["2025-03-14 10:00:00", "2025-02-27 09:00:00"]
+    assert index.query(eval_id="EVA-002", accion="Guardar")[1] == 1
+    assert index.query(since=date(2025, 3, 1), until=date(2025, 3, 1))[1] == 1
+    rows, total = index.query(limit=1, offset=1)
+    assert total == 3 and rows[0][0] == "2025-03-01 08:00:00"
+    assert index.distinct("usuario") == ["ana", "luis"]
+    with pytest.raises(ValueError):
+        index.distinct("detalles")
+
+
+def test_closed_months_are_read_once_and_open_months_on_each_sync(audited):
+    current = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    audited.append_audit_rows([_event(current)])
+    index = AuditIndex(":memory:")
+    counts = _read_counts(audited)
+    assert index.sync(audited) == 3
+    assert index.sync(audited) == 0  # Dentro de AUDIT_SYNC_SECONDS
+    assert index.sync(audited, force=True) == 1
+    assert counts == {"Auditoría 2025-02": 1, "Auditoría 2025-03": 1, "Auditoría " + current[:7]: 2}
+    assert [closed for _, _, closed in index.partitions()] == [True, True, False]
+    assert index.sync(audited, full=True) == 3
+
+
+def test_historic_sheet_is_indexed_by_column_name(audited):
+    moved = ["Usuario", "Timestamp", "Acción", "Cargo", "Detalles", "ID Evaluación"]
+    audited.append_rows(AUDIT_TABLE, moved, [["marta", "2024-12-01 12:00:00", "Exportar", "TS", "", ""]])
+    index = AuditIndex(":memory:")
+    index.sync(audited)
+    rows, total = index.query(usuario="marta")
+    assert total == 1 and rows[0][:4] == ["2024-12-01 12:00:00", "marta", "TS", "Exportar"]
+
+
+def test_flushed_events_reach_the_index_without_a_sync(tmp_path):
+    index = AuditIndex(str(tmp_path / "index.sqlite3"))
+    buffer = AuditBuffer(MemoryBackend(), spill_path=str(tmp_path / "spill.jsonl"), index=index)
+    buffer.log(_event("2025-03-14 10:00:00", "ana"))
+    buffer.flush()
+    assert index.query(usuario="ana")[1] == 1
@@ -0,0 +1,50 @@
+"""Revisión y corrección de IDs repetidos y huérfanos (consistency.py)."""
+import pytest
+
+from consistency import CHILD_TABLES, EVAL_TABLE, StalePlan, apply_fix_plan, build_fix_plan, plan_has_changes
+from storage import MemoryBackend, trim_row
+
+HEADERS = ["ID Evaluación", "Fecha", "Familia"]
+PLAN, ECO = CHILD_TABLES
+
+
+@pytest.fixture
+def db():
+    return MemoryBackend({
+        EVAL_TABLE: [HEADERS, ["EVA-001", "d", "Pérez"], ["EVA-002", "d", "Soto"], ["EVA-001", "d", "Rojas"],
+                     ["EVA-002", "d", "soto"]],
+        PLAN: [HEADERS, ["EVA-001", "d", "Rojas"], ["EVA-001", "d", "Pérez"], ["EVA-009", "d", "Vera"]],
+        ECO: [HEADERS, ["EVA-002", "d", "Soto"], ["EVA-002", "d", "Soto"]],
+    })
+
+
+def _plan(db, delete_orphans=False):
+    ids = iter(["EVA-100", "EVA-101"])
+    return build_fix_plan({t: db.read_table(t) for t in (EVAL_TABLE,) + CHILD_TABLES},
+                          lambda familia: next(ids), delete_orphans)
+
+
+def test_plan_renumbers_other_families_and_drops_copies(db):
+    plan = _plan(db)
+    assert plan["renumbered"] == [("EVA-001", "EVA-100", "Rojas")]
+    assert plan["deletes"] == {EVAL_TABLE: [5], ECO: [3]}
+    assert plan["updates"][PLAN] == {2: ["EVA-100", "d", "Rojas"]}
+    assert plan["orphans"] == [(PLAN, 4, "EVA-009", "Vera")]
+    assert plan["keys"] == {EVAL_TABLE: {4: "EVA-001", 5: "EVA-002"}, PLAN: {2: "EVA-001"}, ECO: {3: "EVA-002"}}
+
+
+def test_apply_fix_plan(db):
+    assert apply_fix_plan(db, _plan(db, delete_orphans=True)) == 5
+    assert [r[0] for r in db.read_table(EVAL_TABLE)[1:]] == ["EVA-001", "EVA-002", "EVA-100"]
+    assert [r[0] for r in db.read_table(PLAN)[1:]] == ["EVA-100", "EVA-001"]
+    assert len(db.read_table(ECO)) == 2
+    assert not plan_has_changes(_plan(db))
+
+
+def test_plan_is_refused_when_target_rows_moved(db):
+    plan = _plan(db)
+    before = [trim_row(r) for r in db.read_table(EVAL_TABLE)]
+    db.delete_rows(EVAL_TABLE, [2])  # Otra sesión elimina una fila: todo se desplaza
+    with pytest.raises(StalePlan):
+        apply_fix_plan(db, plan)
+    assert [trim_row(r) for r in db.read_table(EVAL_TABLE)] == [before[0]] + before[2:]
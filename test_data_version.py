@@ -0,0 +1,32 @@
+"""Bus de versiones de datos (data_version.py)."""
+import threading
+
+from data_version import SQLiteVersionBus, VersionBus, data_version, notify_change
+
+
+def test_process_bus_counts_per_topic():
+    bus = VersionBus()
+    assert bus.current("Evaluaciones") == 0
+    assert bus.bump("Evaluaciones") == 1
+    assert (bus.current("Evaluaciones"), bus.current("Auditoría")) == (1, 0)
+
+
+def test_sqlite_bus_is_shared_between_replicas(tmp_path):
+    path = str(tmp_path / "versions.sqlite3")
+    one, other = SQLiteVersionBus(path), SQLiteVersionBus(path)
+    threads = [threading.Thread(target=lambda: [one.bump("Evaluaciones") for _ in range(20)]),
+               threading.Thread(target=lambda: [other.bump("Evaluaciones") for _ in range(20)])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert one.current("Evaluaciones") == other.current("Evaluaciones") == 40
+
+
+def test_notify_change_moves_the_cache_key(memory_storage):
+    before = data_version("Evaluaciones")
+    assert data_version("Evaluaciones") == before
+    notify_change("Evaluaciones")
+    assert data_version("Evaluaciones") != before
+    # Un backend que detecta los cambios externos no necesita la época de respaldo
+    assert before[1] == 0
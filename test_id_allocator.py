@@ -0,0 +1,107 @@
+"""Asignación de IDs EVA-NNN sin colisiones (id_allocator.py y reserve_ids de cada backend)."""
+import threading
+
+import pytest
+
+from conftest import fake_connection
+from id_allocator import IdAllocator, max_eval_number
+from storage import SEQUENCE_SHEET_PREFIX, SEQUENCE_WINDOW, MemoryBackend, SheetsBackend
+
+
+def test_max_eval_number_ignores_other_formats():
+    values = [["Familia", "ID Evaluación"], ["Pérez", "EVA-007-FAM-PER"], ["Soto", "FAM-20240101-AB12"],
+              ["Rojas", " EVA-012-FAM-ROJ"], ["Vera", ""]]
+    assert max_eval_number(values) == 12
+    assert max_eval_number([["ID Evaluación"]]) == 0
+
+
+def _counting(db):
+    """Anota la cantidad pedida en cada reserva al backend."""
+    calls = []
+    reserve = db.reserve_ids
+    db.reserve_ids = lambda *args: calls.append(args[1]) or reserve(*args)
+    return calls
+
+
+def test_allocator_keeps_a_reserve_ahead_of_use():
+    db = MemoryBackend()
+    calls = _counting(db)
+    allocator = IdAllocator(db, "EVA", seed=lambda: 20, block=3, reserve=3)
+    assert [allocator.next() for _ in range(4)] == [21, 22, 23, 24]
+    # Primer bloque al arrancar y luego uno cada vez que la reserva baja de 3
+    assert calls == [3, 3, 3]
+    assert allocator.available() == 5
+    allocator.reset(100)
+    assert allocator.available() == 0
+    assert allocator.next() == 101
+
+
+def test_reserved_numbers_survive_a_restart(tmp_path):
+    db, path = MemoryBackend(), str(tmp_path / "pool.sqlite3")
+    assert IdAllocator(db, "EVA", seed=lambda: 0, block=5, reserve=5, pool_path=path).next() == 1
+    calls = _counting(db)
+    restarted = IdAllocator(db, "EVA", block=5, reserve=5, pool_path=path)
+    assert [restarted.next() for _ in range(3)] == [2, 3, 4]
+    assert calls == []  # La reserva que dejó el proceso anterior alcanza: no se pide nada
+
+
+class OfflineAfterStart(MemoryBackend):
+    online = True
+
+    def reserve_ids(self, sequence, count, seed=None):
+        if not self.online:
+            raise ConnectionError("sin conexión")
+        return super().reserve_ids(sequence, count, seed)
+
+
+def test_queued_saves_take_ids_from_the_reserve_without_a_connection(tmp_path):
+    db = OfflineAfterStart()
+    allocator = IdAllocator(db, "EVA", seed=lambda: 0, block=2, reserve=4)
+    assert allocator.next() == 1
+    db.online = False
+    # La reposición en segundo plano falla (queda registrada) pero las fichas reciben su ID
+    assert [allocator.next(background=True) for _ in range(5)] == [2, 3, 4, 5, 6]
+    with pytest.raises(ConnectionError):
+        allocator.next(background=True)  # Reserva agotada: la ficha nueva espera la conexión
+    db.online = True
+    assert allocator.next(background=True) == 7
+
+
+def test_concurrent_instances_never_share_a_number(spreadsheet):
+    # Cuatro instancias (cada una con su conexión) reservan contra la misma hoja de secuencia
+    allocators = [IdAllocator(SheetsBackend(fake_connection(spreadsheet)), "EVA", seed=lambda: 0, block=5)
+                  for _ in range(4)]
+    got, lock = [], threading.Lock()
+
+    def work(allocator):
+        numbers = [allocator.next() for _ in range(40)]
+        with lock:
+            got.extend(numbers)
+
+    threads = [threading.Thread(target=work, args=(a,)) for a in allocators]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Cada instancia deja su reserva adelantada sin usar: hay saltos, nunca repetidos
+    assert len(set(got)) == len(got) == 160
+
+
+def test_sheets_sequence_reads_a_bounded_window(sheets_backend, spreadsheet):
+    for _ in range(3 * SEQUENCE_WINDOW):
+        sheets_backend.reserve_ids("EVA", 5, seed=lambda: 0)
+    ws = spreadsheet.worksheet(SEQUENCE_SHEET_PREFIX + "EVA")
+    ws.calls.clear()
+    assert list(sheets_backend.reserve_ids("EVA", 5)) == list(range(301, 306))
+    # Una sola lectura de a lo más SEQUENCE_WINDOW filas, que termina en la fila anterior a la reserva
+    last = len(ws.rows) - 1
+    assert [arg for call, arg in ws.calls if call == "batch_get"] == [(f"A{last - SEQUENCE_WINDOW + 1}:D{last}",)]
+
+
+def test_sheets_sequence_without_running_totals_is_walked_once(sheets_backend, spreadsheet):
+    ws = spreadsheet.add_worksheet(SEQUENCE_SHEET_PREFIX + "EVA")
+    ws.rows = [["Tipo", "Cantidad", "Fecha"], ["base", "10", ""]] + [["reserva", "5", ""]] * 50
+    assert list(sheets_backend.reserve_ids("EVA", 5)) == list(range(261, 266))
+    ws.calls.clear()
+    assert list(sheets_backend.reserve_ids("EVA", 5)) == list(range(266, 271))
+    assert len([call for call, _ in ws.calls if call == "batch_get"]) == 1
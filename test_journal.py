@@ -0,0 +1,227 @@
+"""Diario local de guardados (journal.py): anotación, reenvío de pasos pendientes y conflictos."""
+import time
+
+import pytest
+
+from journal import (BACKOFF_BASE_SECONDS, CONFLICT, DISCARDED, DONE, PENDING, QUEUED, JournaledBackend,
+                     OutboxWorker, SaveJournal, journaled_save)
+from storage import ID_COL, MemoryBackend, trim_row
+
+HEADERS = ["ID Evaluación", "Familia", "Fecha Actualización", "Revisión"]
+PLAN_HEADERS = ["ID Evaluación", "Problema", "Acción"]
+
+
+class CountingBackend(MemoryBackend):
+    """MemoryBackend que cuenta las escrituras recibidas por método."""
+
+    def __init__(self, tables=None):
+        super().__init__(tables)
+        self.writes = []
+
+    def upsert_row(self, table, headers, row, key_col=ID_COL):
+        self.writes.append(("upsert_row", row[0]))
+        return super().upsert_row(table, headers, row, key_col)
+
+    def replace_child_rows(self, table, headers, key_value, rows, key_col=ID_COL):
+        self.writes.append(("replace_child_rows", key_value))
+        return super().replace_child_rows(table, headers, key_value, rows, key_col)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return SaveJournal(str(tmp_path / "journal.sqlite3"))
+
+
+@pytest.fixture
+def db():
+    backend = CountingBackend()
+    backend.append_rows("Evaluaciones", HEADERS, [["EVA-001", "Pérez", "2025-01-01 10:00:00", 1]])
+    backend.writes.clear()
+    return backend
+
+
+def _queue(journal, db, key, steps):
+    """Anota un guardado completo en la cola (sin enviarlo). steps: [(método, args)]."""
+    save_id = journal.begin(key, "tester")
+    journaled = JournaledBackend(db, journal, save_id, queued=True)
+    for method, args in steps:
+        assert getattr(journaled, method)(*args) == QUEUED
+    journal.seal(save_id)
+    return save_id
+
+
+def _eval_save(key, familia, revision, stamp="2025-01-02 10:00:00"):
+    return [("upsert_row", ("Evaluaciones", HEADERS, [key, familia, stamp, revision])),
+            ("replace_child_rows", ("Planes de Intervención", PLAN_HEADERS, key, [[key, f"Problema {familia}", "Visita"]]))]
+
+
+def test_queued_writes_are_recorded_without_touching_the_backend(journal, db):
+    save_id = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Soto", 2))
+    assert db.writes == []
+    entry = journal.entry(save_id)
+    assert (entry["status"], entry["steps"], entry["done"]) == (PENDING, 2, 0)
+    assert journal.status("EVA-001")["id"] == save_id
+
+
+def test_direct_writes_are_recorded_after_they_are_sent(journal, db):
+    save_id = journal.begin("EVA-001")
+    journaled = JournaledBackend(db, journal, save_id)
+    assert journaled.update_cells("Evaluaciones", HEADERS, "EVA-001", {"Familia": "Pérez Soto", "Revisión": 2}) == 2
+    assert journaled.update_cells("Evaluaciones", HEADERS, "EVA-404", {"Familia": "x"}) is None
+    journaled.read_table("Evaluaciones")  # Las lecturas no se anotan
+    assert journal.entry(save_id)["steps"] == 1
+
+
+def test_roll_forward_sends_only_the_missing_steps(journal, db):
+    steps = _eval_save("EVA-001", "Pérez Soto", 2)
+    save_id = _queue(journal, db, "EVA-001", steps)
+    # El primer paso llegó a Sheets antes de la caída; el segundo no
+    db.upsert_row(*steps[0][1])
+    db.writes.clear()
+    assert journal.roll_forward(db, save_id) == DONE
+    assert db.writes == [("replace_child_rows", "EVA-001")]
+    assert db.find_row("Planes de Intervención", "EVA-001")["Problema"] == "Problema Pérez Soto"
+    assert journal.entry(save_id)["done"] == 2
+    assert journal.roll_forward(db, save_id) == DONE  # Ya confirmada: no reenvía nada
+    assert db.writes == [("replace_child_rows", "EVA-001")]
+
+
+def test_drain_sends_several_entries_in_one_pass(journal, db):
+    db.append_rows("Evaluaciones", HEADERS, [["EVA-002", "Soto", "2025-01-01 10:00:00", 1]])
+    first = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Soto", 2))
+    second = _queue(journal, db, "EVA-002", _eval_save("EVA-002", "Soto Vera", 2))
+    assert journal.drain(db, [first, second]) == {first: DONE, second: DONE}
+    assert db.find_row("Evaluaciones", "EVA-002")["Familia"] == "Soto Vera"
+    assert journal.counts() == {DONE: 2}
+
+
+def test_conflicting_entry_writes_nothing(journal, db):
+    save_id = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Soto", 2))
+    # Otro usuario guardó EVA-001 mientras la entrada esperaba
+    db.upsert_row("Evaluaciones", HEADERS, ["EVA-001", "Pérez Rojas", "2025-01-02 09:00:00", 2])
+    db.writes.clear()
+    assert journal.roll_forward(db, save_id) == CONFLICT
+    assert db.writes == []
+    assert db.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez Rojas"
+
+
+def test_missing_row_for_update_cells_is_a_conflict_before_any_step(journal, db):
+    save_id = _queue(journal, db, "EVA-009", [
+        ("replace_child_rows", ("Planes de Intervención", PLAN_HEADERS, "EVA-009", [["EVA-009", "Problema", "Visita"]])),
+        ("update_cells", ("Evaluaciones", HEADERS, "EVA-009", {"Familia": "Rojas"})),
+    ])
+    assert journal.roll_forward(db, save_id) == CONFLICT
+    assert db.writes == []  # El paso previo no quedó enviado a medias
+    assert db.find_row("Planes de Intervención", "EVA-009") is None
+
+
+def test_changed_headers_for_update_cells_are_a_conflict(journal, db):
+    save_id = _queue(journal, db, "EVA-001", [
+        ("update_cells", ("Evaluaciones", HEADERS, "EVA-001", {"Familia": "Pérez Soto"}))])
+    db.write_table("Evaluaciones", [HEADERS + ["Teléfono"], ["EVA-001", "Pérez", "2025-01-01 10:00:00", "1", "555"]])
+    assert journal.roll_forward(db, save_id) == CONFLICT
+    assert db.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez"
+
+
+def test_complete_discards_older_pending_entries_of_the_same_record(journal, db):
+    older = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Soto", 2))
+    newer = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Vera", 2))
+    journal.complete(newer)
+    assert journal.entry(older)["status"] == DISCARDED
+    assert journal.pending() == []
+
+
+# --- Marca del guardado y cola de salida ---
+
+def test_step_with_the_same_save_marker_counts_as_arrived(journal, db):
+    steps = _eval_save("EVA-001", "Pérez Soto", 2)
+    save_id = _queue(journal, db, "EVA-001", steps)
+    db.upsert_row(*steps[0][1])
+    db.replace_child_rows(*steps[1][1])
+    db.writes.clear()
+    assert journal.roll_forward(db, save_id) == DONE
+    assert db.writes == [("replace_child_rows", "EVA-001")]  # Solo el paso sin marca se reenvía
+
+
+def test_new_row_colliding_with_an_existing_id_is_a_conflict(journal, db):
+    # Otra sesión ya creó EVA-002 (revisión 1) con otra marca; este guardado también la crea
+    db.append_rows("Evaluaciones", HEADERS, [["EVA-002", "Soto", "2025-01-02 09:00:00", 1]])
+    db.writes.clear()
+    save_id = _queue(journal, db, "EVA-002", _eval_save("EVA-002", "Rojas", 1, stamp="2025-01-02 10:00:00"))
+    assert journal.roll_forward(db, save_id) == CONFLICT
+    assert db.writes == []
+    assert db.find_row("Evaluaciones", "EVA-002")["Familia"] == "Soto"
+
+
+def test_outbox_sends_saves_of_the_same_record_in_order(journal, db):
+    first = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Soto", 2, stamp="2025-01-02 10:00:00"))
+    second = _queue(journal, db, "EVA-001", _eval_save("EVA-001", "Pérez Vera", 3, stamp="2025-01-02 11:00:00"))
+    changed = []
+    worker = OutboxWorker(journal, db, on_change=lambda: changed.append(True))
+    assert worker.drain_once() == {first: DONE}
+    assert worker.drain_once() == {second: DONE}
+    assert db.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez Vera"
+    assert changed == [True, True]
+    assert worker.drain_once() == {}
+
+
+class OfflineBackend(MemoryBackend):
+    def upsert_row(self, *args, **kwargs):
+        raise ConnectionError("sin conexión")
+
+
+def test_failed_send_waits_with_exponential_backoff(journal, db):
+    offline = OfflineBackend({"Evaluaciones": [list(r) for r in db.read_table("Evaluaciones")]})
+    save_id = _queue(journal, offline, "EVA-001", _eval_save("EVA-001", "Pérez Soto", 2))
+    worker = OutboxWorker(journal, offline)
+    before = time.time()
+    assert worker.drain_once() == {save_id: PENDING}
+    entry = journal.entry(save_id)
+    assert entry["attempts"] == 1 and "sin conexión" in entry["error"]
+    assert entry["next_attempt"] >= before + BACKOFF_BASE_SECONDS
+    assert worker.drain_once() == {}  # Aún no vence el próximo intento
+    assert worker.drain_once(due=False) == {save_id: PENDING}
+    assert journal.entry(save_id)["next_attempt"] >= before + 2 * BACKOFF_BASE_SECONDS
+    # Vuelve la conexión: el mismo guardado llega completo
+    assert OutboxWorker(journal, db).drain_once(due=False) == {save_id: DONE}
+    assert db.find_row("Planes de Intervención", "EVA-001")["Problema"] == "Problema Pérez Soto"
+
+
+# --- Guardado completo en un lote (journaled_save) ---
+
+def test_failed_plan_step_sends_nothing_and_discards_the_entry(journal, sheets_backend, spreadsheet, monkeypatch):
+    sheets_backend.append_rows("Evaluaciones", HEADERS, [["EVA-001", "Pérez", "2025-01-01 10:00:00", 1]])
+    sent = spreadsheet.batch_updates
+
+    def broken_plan(*args, **kwargs):
+        raise ValueError("plan inválido")
+
+    monkeypatch.setattr(sheets_backend, "replace_child_rows", broken_plan)
+    with pytest.raises(ValueError):
+        with journaled_save(journal, sheets_backend, "EVA-002", "tester") as db:
+            save_id = db.save_id
+            evaluation, plan = _eval_save("EVA-002", "Soto", 1)
+            db.upsert_row(*evaluation[1])
+            db.replace_child_rows(*plan[1])
+    # La evaluación quedó en el lote que nunca se envió, y el diario no la da por guardada
+    assert spreadsheet.batch_updates == sent
+    assert sheets_backend.find_row("Evaluaciones", "EVA-002") is None
+    assert journal.entry(save_id)["status"] == DISCARDED
+    assert journal.status("EVA-002") is None and journal.pending() == []
+
+
+def test_failed_flush_leaves_the_sealed_entry_pending(journal, sheets_backend, spreadsheet, monkeypatch):
+    def offline(body):
+        raise ConnectionError("sin conexión")
+
+    monkeypatch.setattr(spreadsheet, "batch_update", offline)
+    with pytest.raises(ConnectionError):
+        with journaled_save(journal, sheets_backend, "EVA-003") as db:
+            for method, args in _eval_save("EVA-003", "Rojas", 1):
+                getattr(db, method)(*args)
+    entry = journal.status("EVA-003")
+    assert (entry["status"], entry["attempts"], entry["done"]) == (PENDING, 1, 0)
+    monkeypatch.undo()
+    assert journal.roll_forward(sheets_backend, entry["id"]) == DONE
+    assert [trim_row(r)[:2] for r in sheets_backend.read_table("Planes de Intervención")] == [
+        ["ID Evaluación", "Problema"], ["EVA-003", "Problema Rojas"]]
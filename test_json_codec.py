@@ -0,0 +1,50 @@
+"""Codificación compacta de las columnas JSON (json_codec.py): los tres formatos van y vuelven."""
+import pytest
+
+from json_codec import CELL_LIMIT, COLUMNAR_PREFIX, COMPRESSED_PREFIX, decode_json, encode_json
+
+MEMBERS = [{"Nombre y Apellidos": "Ana Pérez", "RUT": "12.345.678-5", "Edad": 34},
+           {"Nombre y Apellidos": "José Ñúñez", "RUT": "9.876.543-3", "Edad": 8}]
+
+
+def test_plain_json_is_kept_when_compact_is_off():
+    text = encode_json(MEMBERS)
+    assert text.startswith("[{") and "José Ñúñez" in text
+    assert decode_json(text) == MEMBERS
+
+
+def test_uniform_lists_are_written_columnar():
+    text = encode_json(MEMBERS, compact=True)
+    assert text.startswith(COLUMNAR_PREFIX)
+    assert text.count("Nombre y Apellidos") == 1
+    assert decode_json(text) == MEMBERS
+
+
+@pytest.mark.parametrize("value", [[], {"a": 1}, [{"a": 1}, {"b": 2}], [{"a": 1}, "x"], "texto"])
+def test_values_that_are_not_uniform_tables_round_trip_as_json(value):
+    text = encode_json(value, compact=True)
+    assert not text.startswith((COLUMNAR_PREFIX, COMPRESSED_PREFIX))
+    assert decode_json(text) == value
+
+
+def test_large_payloads_are_compressed():
+    members = [dict(MEMBERS[0], Edad=i) for i in range(200)]
+    text = encode_json(members, compact=True)
+    assert text.startswith(COMPRESSED_PREFIX)
+    assert len(text) < len(encode_json(members))
+    assert decode_json(text) == members
+
+
+def test_cells_over_the_sheets_limit_are_compressed_even_with_compact_off():
+    members = [dict(MEMBERS[0], Edad=i) for i in range(CELL_LIMIT // 40)]
+    text = encode_json(members)
+    assert text.startswith(COMPRESSED_PREFIX) and len(text) <= CELL_LIMIT
+    assert decode_json(text) == members
+
+
+def test_decode_accepts_parsed_values_and_rejects_broken_cells():
+    assert decode_json(MEMBERS) is MEMBERS
+    with pytest.raises(ValueError):
+        decode_json(COMPRESSED_PREFIX + "no-es-base64!")
+    with pytest.raises(ValueError):
+        decode_json("{roto")
@@ -0,0 +1,75 @@
+"""Tabla de integrantes explotada desde Grupo Familiar JSON y reporte de RUT duplicados (members.py)."""
+import json
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from json_codec import encode_json
+from members import (MEMBER_COLUMNS, REPORT_COLUMNS, duplicate_members_report, duplicate_report_excel,
+                     explode_members, members_grid, write_members_table)
+from storage import MemoryBackend
+
+
+def _evaluations():
+    return pd.DataFrame({
+        "ID Evaluación": ["EVA-001", "EVA-002", "EVA-003"],
+        "Fecha": ["2025-01-01", "2025-02-01", "2025-03-01"],
+        "Familia": ["Pérez", "Soto", "Rojas"],
+        "Sector": ["Sol", "Luna", "Luna"],
+        "Grupo Familiar JSON": [
+            json.dumps([{"Nombre y Apellidos": "Ana Pérez", "RUT": "12.345.678-5", "F. Nac": "1950-06-15",
+                         "Identidad de género": "Femenino", "Cronico": True, "Resp": "TRUE"},
+                        {"Nombre y Apellidos": "Luis Pérez", "RUT": "S/R", "F. Nac": "15/07/2010", "Sexo": "M"}]),
+            encode_json([{"Nombre y Apellidos": "Ana P.", "RUT": "12345678-5", "F. Nac": ""}]),
+            "no es JSON",
+        ],
+    })
+
+
+def test_one_typed_row_per_member():
+    m = explode_members(_evaluations(), today=date(2025, 6, 14))
+    assert list(m.columns) == MEMBER_COLUMNS
+    assert list(m["ID Evaluación"]) == ["EVA-001", "EVA-001", "EVA-002"]
+    assert list(m["Posición"]) == [0, 1, 0]
+    assert list(m["RUT"]) == ["12345678-5", "", "12345678-5"]
+    assert m.loc[0, "F. Nac"] == date(1950, 6, 15) and m.loc[1, "F. Nac"] == date(2010, 7, 15)
+    assert m.loc[0, "Edad"] == 74 and m.loc[1, "Edad"] == 14 and pd.isna(m.loc[2, "Edad"])
+    assert list(m["Género"]) == ["Femenino", "Masculino", ""]
+    assert list(m["Crónico"]) == [True, False, False] and list(m["Resp"]) == [True, False, False]
+    assert list(m["Sector"]) == ["Sol", "Sol", "Luna"] and list(m["Establecimiento"]) == ["", "", ""]
+
+
+def test_empty_inputs_keep_the_columns():
+    assert list(explode_members(pd.DataFrame()).columns) == MEMBER_COLUMNS
+    assert explode_members(_evaluations().iloc[2:]).empty
+
+
+def test_published_table_is_plain_text():
+    db = MemoryBackend()
+    members = explode_members(_evaluations(), today=date(2025, 6, 14))
+    assert write_members_table(db, members) == 3
+    grid = db.read_table("Integrantes")
+    assert grid[0] == MEMBER_COLUMNS
+    assert grid[1][MEMBER_COLUMNS.index("Crónico")] == "TRUE"
+    assert grid[3][MEMBER_COLUMNS.index("Edad")] == ""
+    assert members_grid(members)[1][MEMBER_COLUMNS.index("F. Nac")] == "1950-06-15"
+
+
+def test_duplicate_report_lists_ruts_shared_by_families():
+    members = explode_members(_evaluations(), today=date(2025, 6, 14))
+    report = duplicate_members_report(members)
+    assert list(report.columns) == REPORT_COLUMNS
+    assert list(report["RUT"]) == ["12345678-5", "12345678-5"]
+    assert list(report["ID Evaluación"]) == ["EVA-001", "EVA-002"]
+    assert list(report["Familias"]) == [2, 2]
+    # Con una sola evaluación no hay RUT compartido entre familias
+    assert duplicate_members_report(members[members["ID Evaluación"] == "EVA-001"]).empty
+
+
+def test_duplicate_report_excel():
+    pytest.importorskip("openpyxl")
+    report = duplicate_members_report(explode_members(_evaluations(), today=date(2025, 6, 14)))
+    buf, error = duplicate_report_excel(report)
+    assert error is None
+    assert list(pd.read_excel(buf, sheet_name="RUT duplicados")["RUT"]) == ["12345678-5", "12345678-5"]
@@ -0,0 +1,120 @@
+"""Espejo SQLite de escritura directa sobre Sheets (mirror.py), con la planilla falsa de conftest.py."""
+import threading
+
+import pytest
+
+from conftest import fake_connection
+from mirror import MirroredBackend
+from storage import SheetsBackend, SQLiteBackend, trim_row
+
+HEADERS = ["ID Evaluación", "Familia", "Fecha Actualización", "Revisión"]
+
+
+@pytest.fixture
+def primary(spreadsheet):
+    db = SheetsBackend(fake_connection(spreadsheet))
+    db.append_rows("Evaluaciones", HEADERS, [["EVA-001", "Pérez", "2025-01-01 10:00:00", 1],
+                                             ["EVA-002", "Soto", "2025-01-01 10:00:00", 1]])
+    return db
+
+
+def _mirrored(primary, path, changed=None):
+    return MirroredBackend(primary, SQLiteBackend(str(path)), reconcile_seconds=0,
+                           on_change=changed.append if changed is not None else None)
+
+
+def _full_reads(spreadsheet):
+    return sum(1 for call, _ in spreadsheet.worksheet("Evaluaciones").calls if call == "get_all_values")
+
+
+def test_reads_are_served_from_the_mirror_after_the_first(primary, spreadsheet, tmp_path):
+    db = _mirrored(primary, tmp_path / "m.sqlite3")
+    assert [trim_row(r) for r in db.read_table("Evaluaciones")][1] == ["EVA-001", "Pérez", "2025-01-01 10:00:00", "1"]
+    db.read_table("Evaluaciones")
+    db.find_row("Evaluaciones", "EVA-002")
+    assert _full_reads(spreadsheet) == 1
+
+
+def test_writes_go_to_sheets_and_the_mirror(primary, tmp_path):
+    db = _mirrored(primary, tmp_path / "m.sqlite3")
+    db.read_table("Evaluaciones")
+    db.upsert_row("Evaluaciones", HEADERS, ["EVA-002", "Soto Vera", "2025-01-02 10:00:00", 2])
+    db.append_rows("Evaluaciones", HEADERS, [["EVA-003", "Rojas", "2025-01-02 10:00:00", 1]])
+    assert [trim_row(r) for r in db.mirror.read_table("Evaluaciones")] == [
+        trim_row(r) for r in primary.read_table("Evaluaciones")]
+
+
+def test_failed_batch_does_not_reach_the_mirror(primary, tmp_path):
+    db = _mirrored(primary, tmp_path / "m.sqlite3")
+    db.read_table("Evaluaciones")
+    with pytest.raises(RuntimeError):
+        with db.batch():
+            db.upsert_row("Evaluaciones", HEADERS, ["EVA-001", "Cambio", "2025-01-02 10:00:00", 2])
+            raise RuntimeError("falla antes del envío")
+    assert db.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez"
+    assert primary.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez"
+
+
+def test_reconcile_brings_external_changes_incrementally(primary, spreadsheet, tmp_path):
+    changed = []
+    db = _mirrored(primary, tmp_path / "m.sqlite3", changed)
+    db.read_table("Evaluaciones")
+    # Otra instancia guarda directamente en Sheets
+    other = SheetsBackend(fake_connection(spreadsheet))
+    other.upsert_row("Evaluaciones", HEADERS, ["EVA-001", "Pérez Soto", "2025-01-03 10:00:00", 2])
+    other.append_rows("Evaluaciones", HEADERS, [["EVA-003", "Rojas", "2025-01-03 10:00:00", 1]])
+    assert db.reconcile() == ["Evaluaciones"]
+    assert changed == ["Evaluaciones"]
+    assert db.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez Soto"
+    assert db.find_row("Evaluaciones", "EVA-003")["Familia"] == "Rojas"
+    assert _full_reads(spreadsheet) == 1  # Solo la población inicial; el resto fue delta
+    assert db.reconcile() == []
+
+
+def test_inherited_mirror_is_caught_up_before_serving(primary, spreadsheet, tmp_path):
+    path = tmp_path / "m.sqlite3"
+    _mirrored(primary, path).read_table("Evaluaciones")
+    # Mientras el proceso estaba detenido, otra instancia guardó
+    primary.upsert_row("Evaluaciones", HEADERS, ["EVA-002", "Soto Vera", "2025-01-04 10:00:00", 2])
+    restarted = _mirrored(SheetsBackend(fake_connection(spreadsheet)), path)
+    assert restarted.find_row("Evaluaciones", "EVA-002")["Familia"] == "Soto Vera"
+
+
+def test_revision_checks_and_row_checks_read_sheets(primary, tmp_path):
+    db = _mirrored(primary, tmp_path / "m.sqlite3")
+    db.read_table("Evaluaciones")
+    primary.update_cells("Evaluaciones", HEADERS, "EVA-001", {"Revisión": 5})
+    assert db.read_cells("Evaluaciones", "EVA-001", ["Revisión"]) == {"Revisión": "5"}
+    assert trim_row(db.read_rows("Evaluaciones", [2])[2])[3] == "5"
+    assert db.find_row("Evaluaciones", "EVA-001")["Revisión"] == "1"  # El espejo aún no reconcilia
+
+
+def test_slow_delta_fetch_does_not_block_writes_and_is_discarded(primary, spreadsheet, tmp_path, monkeypatch):
+    db = _mirrored(primary, tmp_path / "m.sqlite3")
+    db.read_table("Evaluaciones")
+    SheetsBackend(fake_connection(spreadsheet)).upsert_row(
+        "Evaluaciones", HEADERS, ["EVA-001", "Pérez Soto", "2025-01-03 10:00:00", 2])
+    started, release = threading.Event(), threading.Event()
+    read_columns = primary.read_columns
+
+    def slow_read_columns(table, columns):
+        started.set()
+        release.wait(5)
+        return read_columns(table, columns)
+
+    monkeypatch.setattr(primary, "read_columns", slow_read_columns)
+    results = []
+    poller = threading.Thread(target=lambda: results.append(db.reconcile()))
+    poller.start()
+    assert started.wait(5)
+    # Sheets tarda en responder el sondeo: el guardado no espera a la reconciliación
+    db.upsert_row("Evaluaciones", HEADERS, ["EVA-002", "Soto Vera", "2025-01-03 11:00:00", 2])
+    assert poller.is_alive()
+    release.set()
+    poller.join(5)
+    # El delta leído antes del guardado se descarta; el próximo ciclo trae el cambio externo
+    assert results == [[]]
+    assert db.find_row("Evaluaciones", "EVA-002")["Familia"] == "Soto Vera"
+    monkeypatch.setattr(primary, "read_columns", read_columns)
+    assert db.reconcile() == ["Evaluaciones"]
+    assert db.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez Soto"
@@ -0,0 +1,75 @@
+"""RUT canónico, dígito verificador e índice por RUT (rut.py)."""
+import json
+
+import pytest
+
+from rut import RutIndex, RutRegistry, canonical_rut, compute_dv, format_rut, is_valid_rut, split_rut
+
+
+@pytest.mark.parametrize("raw, canonical", [
+    ("12.345.678-5", "12345678-5"),
+    ("12345678-k", "12345678-K"),
+    ("012345678K", "12345678-K"),
+    (" 9.876.543 - 3 ", "9876543-3"),
+    ("100000-0", "100000-0"),
+])
+def test_canonical_forms(raw, canonical):
+    assert canonical_rut(raw) == canonical
+
+
+@pytest.mark.parametrize("raw", ["", None, "S/R", "sin rut", "12", "1234-5", "0000012-3", "12.345.678-X"])
+def test_values_that_are_not_ruts(raw):
+    assert canonical_rut(raw) == "" and split_rut(raw) is None
+    assert format_rut(raw) == str(raw or "").strip()
+
+
+def test_check_digit():
+    assert compute_dv("12345678") == "5"
+    assert compute_dv("6") == "K"
+    assert compute_dv("7654321") == "6"
+    assert is_valid_rut("12.345.678-5") and not is_valid_rut("12.345.678-4")
+    assert format_rut("12345678-5") == "12.345.678-5"
+
+
+def _group(*ruts):
+    return json.dumps([{"Nombre y Apellidos": f"Integrante {i}", "RUT": r} for i, r in enumerate(ruts)])
+
+
+def test_index_finds_other_families():
+    index = RutIndex.from_columns(["EVA-001", "EVA-002"], ["Pérez", "Soto"],
+                                  [_group("12.345.678-5", "S/R"), _group("12345678-5", "9876543-3")])
+    assert index.lookup("12345678-5") == [("Pérez", "EVA-001", 0), ("Soto", "EVA-002", 0)]
+    assert index.other_families("12.345.678-5", "EVA-001") == [("Soto", "EVA-002", 0)]
+    assert list(index.duplicates()) == ["12345678-5"]
+    assert len(index) == 2
+
+
+def test_registry_applies_saves_without_rebuilding(tmp_path):
+    registry = RutRegistry(str(tmp_path / "ruts.sqlite3"))
+    registry.rebuild(["EVA-001", "EVA-002"], ["Pérez", "Soto"], [_group("12345678-5"), _group("9876543-3")], (3, 0))
+    registry.apply("EVA-002", "Soto", _group("12345678-5"))
+    registry.acknowledge(4)
+    # La versión que publicó el propio guardado no obliga a reconstruir; una ajena sí
+    assert registry.is_fresh((4, 0))
+    assert not registry.is_fresh((5, 0))
+    assert [e[1] for e in registry.index.lookup("12345678-5")] == ["EVA-001", "EVA-002"]
+    assert registry.index.lookup("9876543-3") == []
+
+
+def test_registry_reloads_its_local_copy(tmp_path):
+    path = str(tmp_path / "ruts.sqlite3")
+    first = RutRegistry(path)
+    first.rebuild(["EVA-001"], ["Pérez"], [_group("12345678-5")], (1, 0))
+    first.apply("EVA-002", "Soto", _group("9876543-3"))
+    restarted = RutRegistry(path)
+    assert restarted.load((1, 0))
+    assert restarted.index.lookup("9876543-3") == [("Soto", "EVA-002", 0)]
+    assert not RutRegistry(str(tmp_path / "otra.sqlite3")).load((1, 0))
+
+
+def test_stale_rebuild_is_discarded(tmp_path):
+    registry = RutRegistry()
+    generation = registry.generation()
+    registry.apply("EVA-001", "Pérez", _group("12345678-5"))
+    assert not registry.rebuild([], [], [], (1, 0), generation)
+    assert registry.index.lookup("12345678-5")
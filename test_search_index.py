@@ -0,0 +1,52 @@
+"""Índice invertido y búsqueda difusa de familias (search_index.py)."""
+import json
+
+import pytest
+
+from json_codec import encode_json
+from search_index import SearchIndex, fold_accents, tokenize
+
+
+def _family(*members):
+    return json.dumps([{"Nombre y Apellidos": name, "RUT": rut, "Parentesco": "Hijo"} for name, rut in members])
+
+
+@pytest.fixture
+def index():
+    return SearchIndex.from_columns(
+        ["EVA-001", "EVA-002", "EVA-003", ""],
+        ["Ñancupil Huenchullán", "Soto", "Sotomayor", "Sin ID"],
+        ["Pasaje Los Aromos 12", "Calle Soto 45", "Av. Central 1", ""],
+        [_family(("María Ñancupil", "12.345.678-5")), _family(("Pedro Soto", "S/R")),
+         encode_json([{"Nombre y Apellidos": "Ana Rojas", "RUT": "9.876.543-3"}]), ""])
+
+
+def test_tokens_are_folded_and_ruts_kept_whole():
+    assert fold_accents("Huenchullán Ñuñoa") == "Huenchullan Nunoa"
+    assert tokenize("Ñancupil 12.345.678-5") == ["123456785", "nancupil"]
+
+
+def test_prefix_search_ranks_by_field(index):
+    # "soto" es apellido de EVA-002 (exacto), prefijo de Sotomayor y solo calle en la dirección de EVA-002
+    assert index.search("soto") == ["EVA-002", "EVA-003"]
+    assert index.search("nancu") == ["EVA-001"]
+    assert index.search("ÑANCUPIL maria") == ["EVA-001"]
+    assert index.search("soto aromos") == []
+
+
+def test_search_by_rut_in_any_format(index):
+    assert index.search("12345678-5") == ["EVA-001"]
+    assert index.search("12.345") == ["EVA-001"]
+    assert index.search("9876543-3") == ["EVA-003"]  # Grupo Familiar en formato compacto
+
+
+def test_json_keys_are_not_indexed(index):
+    assert index.search("parentesco") == []
+    assert index.search("hijo") == []
+
+
+def test_fuzzy_search_tolerates_typos(index):
+    results = dict(index.fuzzy_search("Nancupill"))
+    assert list(results) == ["EVA-001"] and results["EVA-001"] > 0.6
+    assert index.fuzzy_search("Sotto")[0][0] == "EVA-002"
+    assert index.fuzzy_search("xyzw") == []
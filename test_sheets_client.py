@@ -0,0 +1,46 @@
+"""Conexión compartida a Google Sheets (sheets_client.py): handles cacheados sobre la planilla falsa."""
+import gspread
+import pytest
+
+from conftest import fake_connection
+from sheets_client import SERVICE_ACCOUNT_KEYS, service_account_info
+
+
+class CountingSpreadsheet:
+    """Envuelve la planilla falsa contando las búsquedas de hojas por título."""
+
+    def __init__(self, spreadsheet):
+        self._spreadsheet = spreadsheet
+        self.lookups = 0
+
+    def worksheet(self, title):
+        self.lookups += 1
+        return self._spreadsheet.worksheet(title)
+
+    def __getattr__(self, name):
+        return getattr(self._spreadsheet, name)
+
+
+def test_worksheets_are_looked_up_once(spreadsheet):
+    spreadsheet.add_worksheet("Evaluaciones")
+    counting = CountingSpreadsheet(spreadsheet)
+    conn = fake_connection(counting)
+    assert conn.worksheet("Evaluaciones") is conn.worksheet("Evaluaciones")
+    assert counting.lookups == 1
+    conn.forget_worksheet("Evaluaciones")
+    conn.worksheet("Evaluaciones")
+    assert counting.lookups == 2
+
+
+def test_missing_worksheet_is_created_with_headers_only_when_asked(spreadsheet):
+    conn = fake_connection(spreadsheet)
+    with pytest.raises(gspread.WorksheetNotFound):
+        conn.worksheet("Ecomapa", create=False)
+    ws = conn.worksheet("Ecomapa", headers=["ID Evaluación", "Tipo"])
+    assert ws.get_all_values() == [["ID Evaluación", "Tipo"]]
+
+
+def test_service_account_info_keeps_only_the_account_keys():
+    secrets = {k: f"valor {k}" for k in SERVICE_ACCOUNT_KEYS}
+    secrets["sheet_url"] = "https://ejemplo"
+    assert service_account_info(secrets) == {k: f"valor {k}" for k in SERVICE_ACCOUNT_KEYS}
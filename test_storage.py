@@ -0,0 +1,271 @@
+"""Paridad de la interfaz StorageBackend entre Memory, SQLite y Sheets (planilla falsa de conftest.py)."""
+from datetime import date
+
+import pytest
+
+from conftest import FakeSpreadsheet, fake_connection
+from storage import AUDIT_HEADERS, SheetsBackend, WriteBatch, cell_matches, trim_row
+
+HEADERS = ["ID Evaluación", "Fecha", "Familia"]
+PLAN = "Planes de Intervención"
+PLAN_HEADERS = ["ID Evaluación", "Problema", "Fecha Programada"]
+
+
+def _grid(db, table):
+    return [trim_row(r) for r in db.read_table(table)]
+
+
+def _seed(db):
+    db.append_rows("Evaluaciones", HEADERS, [["EVA-001", "2025-01-01", "Pérez"],
+                                             ["EVA-002", "2025-01-02", "Soto"],
+                                             ["EVA-003", "2025-01-03", "Rojas"]])
+
+
+def test_missing_table_reads_empty(backend):
+    assert backend.read_table("No existe") == []
+    assert backend.find_row("No existe", "EVA-001") is None
+    assert backend.read_cells("No existe", "EVA-001", ["Familia"]) is None
+
+
+def test_append_and_read_table(backend):
+    _seed(backend)
+    assert _grid(backend, "Evaluaciones") == [HEADERS,
+                                             ["EVA-001", "2025-01-01", "Pérez"],
+                                             ["EVA-002", "2025-01-02", "Soto"],
+                                             ["EVA-003", "2025-01-03", "Rojas"]]
+
+
+def test_upsert_updates_first_match_or_appends(backend):
+    _seed(backend)
+    assert backend.upsert_row("Evaluaciones", HEADERS, ["EVA-002", "2025-02-02", "Soto Díaz"]) == 3
+    assert backend.upsert_row("Evaluaciones", HEADERS, ["EVA-004", "2025-02-03", "Muñoz"]) is None
+    assert backend.find_row("Evaluaciones", "EVA-002") == {"ID Evaluación": "EVA-002", "Fecha": "2025-02-02",
+                                                           "Familia": "Soto Díaz"}
+    assert _grid(backend, "Evaluaciones")[-1] == ["EVA-004", "2025-02-03", "Muñoz"]
+
+
+def test_values_come_back_as_sheet_text(backend):
+    backend.upsert_row("Evaluaciones", HEADERS + ["Revisión", "Crónico"], ["EVA-001", None, "Pérez", 3, True])
+    record = backend.find_row("Evaluaciones", "EVA-001")
+    assert (record["Fecha"], record["Revisión"], record["Crónico"]) == ("", "3", "TRUE")
+
+
+def test_read_cells_and_update_cells(backend):
+    _seed(backend)
+    assert backend.read_cells("Evaluaciones", "EVA-002", ["Familia", "No existe"]) == {"Familia": "Soto"}
+    assert backend.update_cells("Evaluaciones", HEADERS, "EVA-002", {"Familia": "Soto Vera"}) == 3
+    assert backend.find_row("Evaluaciones", "EVA-002")["Familia"] == "Soto Vera"
+    # Fila inexistente o encabezados distintos: no escribe y quien llama usa upsert_row
+    assert backend.update_cells("Evaluaciones", HEADERS, "EVA-999", {"Familia": "x"}) is None
+    assert backend.update_cells("Evaluaciones", HEADERS + ["Otra"], "EVA-002", {"Familia": "x"}) is None
+    assert backend.find_row("Evaluaciones", "EVA-002")["Familia"] == "Soto Vera"
+
+
+def test_update_and_delete_rows(backend):
+    _seed(backend)
+    backend.update_rows("Evaluaciones", {2: ["EVA-010", "2025-01-01", "Pérez"]})
+    backend.delete_rows("Evaluaciones", [3, 1])  # La fila de encabezados nunca se elimina
+    assert _grid(backend, "Evaluaciones") == [HEADERS, ["EVA-010", "2025-01-01", "Pérez"],
+                                             ["EVA-003", "2025-01-03", "Rojas"]]
+
+
+def test_read_projection_and_rows(backend):
+    _seed(backend)
+    assert backend.read_projection("Evaluaciones", ["Familia", "ID Evaluación", "No existe"]) == [
+        ["Familia", "ID Evaluación"], ["Pérez", "EVA-001"], ["Soto", "EVA-002"], ["Rojas", "EVA-003"]]
+    rows = backend.read_rows("Evaluaciones", [1, 3, 9])
+    assert trim_row(rows[1]) == HEADERS
+    assert trim_row(rows[3]) == ["EVA-002", "2025-01-02", "Soto"]
+    assert rows[9] == []
+
+
+def test_replace_child_rows_keeps_the_rest_in_order(backend):
+    backend.append_rows(PLAN, PLAN_HEADERS, [["EVA-001", "a", "2025-01-01"], ["EVA-002", "b", "2025-01-01"],
+                                             ["EVA-002", "c", "2025-01-01"], ["EVA-003", "d", "2025-01-01"]])
+    # Bloque contiguo: se sobrescribe en su lugar y lo que sobra se elimina
+    assert backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-002", [["EVA-002", "e", "2025-02-01"]]) == 1
+    assert _grid(backend, PLAN) == [PLAN_HEADERS, ["EVA-001", "a", "2025-01-01"], ["EVA-002", "e", "2025-02-01"],
+                                    ["EVA-003", "d", "2025-01-01"]]
+    # Más filas que el bloque: las extra se agregan al final
+    backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-001", [["EVA-001", "f", "2025-03-01"],
+                                                               ["EVA-001", "g", "2025-03-02"]])
+    assert _grid(backend, PLAN)[1:] == [["EVA-001", "f", "2025-03-01"], ["EVA-002", "e", "2025-02-01"],
+                                        ["EVA-003", "d", "2025-01-01"], ["EVA-001", "g", "2025-03-02"]]
+    # Bloque no contiguo: se eliminan todas y las nuevas van al final
+    backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-001", [["EVA-001", "h", "2025-04-01"]])
+    assert _grid(backend, PLAN)[1:] == [["EVA-002", "e", "2025-02-01"], ["EVA-003", "d", "2025-01-01"],
+                                        ["EVA-001", "h", "2025-04-01"]]
+    # Sin filas nuevas: se eliminan las de la clave
+    assert backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-003", []) == 0
+    assert _grid(backend, PLAN)[1:] == [["EVA-002", "e", "2025-02-01"], ["EVA-001", "h", "2025-04-01"]]
+
+
+def test_write_table_replaces_content(backend):
+    _seed(backend)
+    backend.write_table("Evaluaciones", [["A", "B"], ["1", "2"]])
+    assert _grid(backend, "Evaluaciones") == [["A", "B"], ["1", "2"]]
+
+
+def test_batch_applies_writes_on_exit(backend):
+    _seed(backend)
+    with backend.batch():
+        backend.upsert_row("Evaluaciones", HEADERS, ["EVA-002", "2025-05-05", "Soto"])
+        backend.append_rows("Evaluaciones", HEADERS, [["EVA-004", "2025-05-06", "Vera"]])
+        backend.delete_rows("Evaluaciones", [2])
+    assert _grid(backend, "Evaluaciones") == [HEADERS, ["EVA-002", "2025-05-05", "Soto"],
+                                             ["EVA-003", "2025-01-03", "Rojas"], ["EVA-004", "2025-05-06", "Vera"]]
+
+
+def test_list_tables_and_audit_partitions(backend):
+    backend.append_audit_rows([["2025-03-01 10:00:00", "u", "c", "a", "d", "EVA-001"],
+                               ["2025-04-01 10:00:00", "u", "c", "a", "d", "EVA-002"]])
+    assert backend.audit_partitions() == ["Auditoría 2025-03", "Auditoría 2025-04"]
+    assert _grid(backend, "Auditoría 2025-04") == [AUDIT_HEADERS, ["2025-04-01 10:00:00", "u", "c", "a", "d", "EVA-002"]]
+
+
+def test_reserve_ids_is_sequential_and_seeds_once(backend):
+    seeds = []
+
+    def seed():
+        seeds.append(1)
+        return 41
+
+    assert list(backend.reserve_ids("EVA", 3, seed)) == [42, 43, 44]
+    assert list(backend.reserve_ids("EVA", 2, seed)) == [45, 46]
+    assert len(seeds) == 1
+    backend.reset_sequence("EVA", 7)
+    assert list(backend.reserve_ids("EVA", 1, seed)) == [8]
+
+
+# --- Lote de Sheets (WriteBatch) ---
+def test_sheets_batch_sends_one_request(sheets_backend, spreadsheet):
+    _seed(sheets_backend)
+    sent = spreadsheet.batch_updates
+    with sheets_backend.batch():
+        sheets_backend.upsert_row("Evaluaciones", HEADERS, ["EVA-001", "2025-05-05", "Pérez"])
+        sheets_backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-001", [["EVA-001", "a", "2025-05-05"]])
+        sheets_backend.append_rows("Ecomapas", HEADERS, [["EVA-001", "2025-05-05", "Pérez"]])
+    assert spreadsheet.batch_updates == sent + 1
+    assert not [c for ws in spreadsheet.worksheets() for c, _ in ws.calls if c in ("update", "batch_update")]
+
+
+def test_write_batch_request_order():
+    class Ws:
+        def __init__(self, sheet_id):
+            self.id, self.col_count = sheet_id, 2
+
+    a, b = Ws(1), Ws(2)
+    batch = WriteBatch()
+    batch.append(a, [["x", "y", "z"]])
+    batch.delete(a, [5, 2, 3, 1])
+    batch.put(b, 4, [["p"]], col=1)
+    batch.clear(b)
+    kinds = [next(iter(r)) for r in batch.requests()]
+    assert kinds == ["appendDimension", "updateCells", "updateCells", "deleteDimension", "deleteDimension",
+                     "appendCells"]
+    deletes = [r["deleteDimension"]["range"] for r in batch.requests() if "deleteDimension" in r]
+    # De abajo hacia arriba, un tramo por grupo contiguo y nunca la fila de encabezados
+    assert [(d["startIndex"], d["endIndex"]) for d in deletes] == [(4, 5), (1, 3)]
+
+
+def test_user_entered_cells_are_parsed_like_sheets():
+    cell = WriteBatch._parsed_cell
+    assert cell("=SUM(A1:A2)") == {"userEnteredValue": {"formulaValue": "=SUM(A1:A2)"}}
+    assert cell("true") == {"userEnteredValue": {"boolValue": True}}
+    assert cell(" 007") == {"userEnteredValue": {"numberValue": 7}}
+    # Decimales y fechas dependen del locale de la planilla: se escriben como texto literal
+    assert cell("12.5") == {"userEnteredValue": {"stringValue": "12.5"}}
+    assert cell("2025-03-01") == {"userEnteredValue": {"stringValue": "2025-03-01"}}
+    assert cell("Controlar PA") == {"userEnteredValue": {"stringValue": "Controlar PA"}}
+    assert WriteBatch._cell("12.5") == {"userEnteredValue": {"stringValue": "12.5"}}
+
+
+def test_batched_and_direct_plan_writes_store_the_same_cells(spreadsheet):
+    rows = [["EVA-001", "=1+1", "2025-03-01"], ["EVA-001", "007", "TRUE"]]
+    direct = SheetsBackend(fake_connection(FakeSpreadsheet()))
+    direct.append_rows(PLAN, PLAN_HEADERS, rows)
+    batched = SheetsBackend(fake_connection(spreadsheet))
+    with batched.batch():
+        batched.append_rows(PLAN, PLAN_HEADERS, rows)
+    assert batched.read_table(PLAN) == direct.read_table(PLAN)
+    assert batched.read_table(PLAN)[2] == ["EVA-001", "7", "TRUE"]
+
+
+# --- Lecturas acotadas de Sheets ---
+def _calls(spreadsheet, table, kind):
+    return [arg for call, arg in spreadsheet.worksheet(table).calls if call == kind]
+
+
+def test_replace_child_rows_reads_only_the_key_column(sheets_backend, spreadsheet):
+    sheets_backend.append_rows(PLAN, PLAN_HEADERS, [["EVA-001", "a", "2025-01-01"], ["EVA-002", "b", "2025-01-01"]])
+    sheets_backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-001", [["EVA-001", "c", "2025-01-02"]])
+    assert not _calls(spreadsheet, PLAN, "get_all_values")
+    assert _calls(spreadsheet, PLAN, "batch_get") == [("1:1", "A:A")]
+
+
+def test_replace_child_rows_rewrites_changed_headers(backend):
+    backend.append_rows(PLAN, ["Problema", "ID Evaluación", "Fecha Programada"],
+                        [["a", "EVA-001", "2025-01-01"], ["EVA-002", "b", "2025-01-01"]])
+    backend.replace_child_rows(PLAN, PLAN_HEADERS, "EVA-002", [["EVA-002", "c", "2025-01-02"]])
+    # El bloque se ubica con la columna clave de los encabezados nuevos (columna A)
+    assert _grid(backend, PLAN) == [PLAN_HEADERS, ["a", "EVA-001", "2025-01-01"], ["EVA-002", "c", "2025-01-02"]]
+
+
+def test_index_locates_rows_and_survives_external_inserts(sheets_backend, spreadsheet):
+    _seed(sheets_backend)
+    assert sheets_backend.find_row("Evaluaciones", "EVA-003")["Familia"] == "Rojas"
+    reads = len(_calls(spreadsheet, "Evaluaciones", "batch_get"))
+    assert sheets_backend.upsert_row("Evaluaciones", HEADERS, ["EVA-003", "2025-06-01", "Rojas"]) == 4
+    # Con el índice vigente, ubicar la fila es una sola lectura (encabezados + esa fila)
+    assert _calls(spreadsheet, "Evaluaciones", "batch_get")[reads:] == [("1:1", "4:4")]
+    assert not _calls(spreadsheet, "Evaluaciones", "get_all_values")
+    # Otra instancia inserta una fila arriba: la posición anotada ya no coincide y el índice se reconstruye
+    spreadsheet.worksheet("Evaluaciones").rows.insert(1, ["EVA-000", "2024-12-31", "Vera"])
+    assert sheets_backend.upsert_row("Evaluaciones", HEADERS, ["EVA-003", "2025-06-02", "Rojas"]) == 5
+    assert _grid(sheets_backend, "Evaluaciones")[4] == ["EVA-003", "2025-06-02", "Rojas"]
+
+
+def test_keys_are_matched_without_surrounding_spaces(backend):
+    backend.append_rows("Evaluaciones", HEADERS, [[" EVA-001 ", "2025-01-01", "Pérez"], ["", "2025-01-02", "Sin ID"]])
+    assert backend.find_row("Evaluaciones", "EVA-001")["Familia"] == "Pérez"
+    assert backend.read_cells("Evaluaciones", " EVA-001", ["Familia"]) == {"Familia": "Pérez"}
+    assert backend.upsert_row("Evaluaciones", HEADERS, ["EVA-001 ", "2025-03-01", "Pérez Soto"]) == 2
+    assert backend.find_row("Evaluaciones", " EVA-001 ")["Familia"] == "Pérez Soto"
+    assert backend.update_cells("Evaluaciones", HEADERS, "EVA-001\t", {"Fecha": "2025-03-02"}) == 2
+    # Una clave vacía no ubica la fila sin ID
+    assert backend.find_row("Evaluaciones", "  ") is None
+    assert backend.update_cells("Evaluaciones", HEADERS, "", {"Familia": "x"}) is None
+
+
+def test_projection_reads_only_the_requested_columns(sheets_backend, spreadsheet):
+    _seed(sheets_backend)
+    assert sheets_backend.read_projection("Evaluaciones", ["ID Evaluación", "Familia"])[1] == ["EVA-001", "Pérez"]
+    assert _calls(spreadsheet, "Evaluaciones", "batch_get")[-1] == ("A:A", "C:C")
+    assert not _calls(spreadsheet, "Evaluaciones", "get_all_values")
+    # Columnas movidas desde la última lectura: se releen los encabezados y se reintenta
+    ws = spreadsheet.worksheet("Evaluaciones")
+    ws.rows = [[r[2], r[0], r[1]] for r in ws.rows]
+    assert sheets_backend.read_projection("Evaluaciones", ["ID Evaluación", "Familia"])[1] == ["EVA-001", "Pérez"]
+
+
+def test_update_cells_sends_only_the_changed_runs(sheets_backend, spreadsheet):
+    headers = HEADERS + ["Dirección", "Teléfono"]
+    sheets_backend.append_rows("Evaluaciones", headers, [["EVA-001", "2025-01-01", "Pérez", "Los Aromos 12", "555"]])
+    ws = spreadsheet.worksheet("Evaluaciones")
+    ws.rows[1][3] = "Editado por otra sesión"  # Celda que este guardado no toca
+    sent = spreadsheet.batch_updates
+    changes = {"Fecha": "2025-02-01", "Familia": "Pérez Soto", "Teléfono": "777"}
+    assert sheets_backend.update_cells("Evaluaciones", headers, "EVA-001", changes) == 2
+    assert spreadsheet.batch_updates == sent + 1
+    assert ws.rows[1] == ["EVA-001", "2025-02-01", "Pérez Soto", "Editado por otra sesión", "777"]
+
+
+@pytest.mark.parametrize("value, cell, same", [
+    (True, "TRUE", True), (True, "VERDADERO", True), (False, "FALSO", True), (False, "", True),
+    (True, "FALSE", False),
+    (12, "12", True), (12.5, "12,5", True), (7, " 7 ", True), (12.5, "12", False), (3, "tres", False),
+    ("2025-03-01", "01/03/2025", True), (date(2025, 3, 1), "2025-03-01", True), ("2025-03-01", "02/03/2025", False),
+    ("Pérez", "Pérez", True), ("Pérez", "Perez", False), (None, "", True), ("007", "7", False),
+])
+def test_cell_matches_compares_form_values_with_formatted_cells(value, cell, same):
+    assert cell_matches(value, cell) is same
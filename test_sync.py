@@ -0,0 +1,74 @@
+"""Sincronización incremental con Fecha Actualización + Revisión (sync.py)."""
+import pytest
+
+from storage import MemoryBackend, trim_row
+from sync import (REVISION_COL, STAMP_COL, RevisionConflict, check_revision, current_revision, delta_sync,
+                  field_changes, merge_changes, stamp_row)
+
+HEADERS = ["ID Evaluación", "Familia"]
+STAMPED = HEADERS + [STAMP_COL, REVISION_COL]
+
+
+def _pair():
+    rows = [["EVA-001", "Pérez", "2025-01-01 10:00:00", "1"], ["EVA-002", "Soto", "2025-01-01 10:00:00", "1"]]
+    primary, local = MemoryBackend(), MemoryBackend()
+    primary.append_rows("Evaluaciones", STAMPED, rows)
+    local.append_rows("Evaluaciones", STAMPED, rows)
+    return primary, local
+
+
+def test_stamp_row_adds_columns_and_continues_the_revision():
+    headers, row = stamp_row(HEADERS, ["EVA-001", "Pérez"])
+    assert headers == STAMPED and row[3] == 1 and row[2]
+    _, row = stamp_row(headers, row, previous={REVISION_COL: "4"})
+    assert row[3] == 5
+
+
+def test_delta_sync_skips_when_nothing_changed():
+    primary, local = _pair()
+    assert delta_sync(primary, local, "Evaluaciones") == "skip"
+
+
+def test_delta_sync_brings_edited_and_appended_rows():
+    primary, local = _pair()
+    primary.upsert_row("Evaluaciones", STAMPED, ["EVA-002", "Soto Vera", "2025-01-01 10:00:00", "2"])
+    primary.append_rows("Evaluaciones", STAMPED, [["EVA-003", "Rojas", "2025-01-02 10:00:00", "1"]])
+    assert delta_sync(primary, local, "Evaluaciones") == "delta"
+    assert [trim_row(r) for r in local.read_table("Evaluaciones")] == primary.read_table("Evaluaciones")
+
+
+def test_delta_sync_asks_for_a_full_copy_when_rows_move_or_stamps_are_missing():
+    primary, local = _pair()
+    primary.delete_rows("Evaluaciones", [2])
+    assert delta_sync(primary, local, "Evaluaciones") == "full"
+    unstamped = MemoryBackend({"Evaluaciones": [HEADERS, ["EVA-001", "Pérez"]]})
+    assert delta_sync(unstamped, unstamped, "Evaluaciones") == "full"
+
+
+def test_check_revision_raises_when_another_save_came_in_between():
+    loaded = {REVISION_COL: "3"}
+    check_revision(loaded, {REVISION_COL: "3"}, "EVA-001")
+    with pytest.raises(RevisionConflict) as err:
+        check_revision(loaded, {REVISION_COL: "4"}, "EVA-001")
+    assert (err.value.key, err.value.loaded, err.value.current) == ("EVA-001", 3, 4)
+    assert current_revision({}) == 0 and current_revision({REVISION_COL: "x"}) == 0
+
+
+def test_field_changes_tells_mine_theirs_and_both_apart():
+    base = {"Familia": "Pérez", "Dirección": "Los Aromos 12", "Teléfono": "555", STAMP_COL: "a"}
+    mine = {"Familia": "Pérez Soto", "Dirección": "Los Aromos 12", "Teléfono": "777", STAMP_COL: "b"}
+    theirs = {"Familia": "Pérez", "Dirección": "Las Acacias 3", "Teléfono": "999", STAMP_COL: "c"}
+    assert field_changes(base, mine, theirs) == [
+        ("Familia", "Pérez", "Pérez Soto", "Pérez", "mío"),
+        ("Dirección", "Los Aromos 12", "Los Aromos 12", "Las Acacias 3", "otro"),
+        ("Teléfono", "555", "777", "999", "ambos"),
+    ]
+
+
+def test_merge_changes_keeps_both_sides_and_resolves_conflicts_by_field():
+    base = {"Familia": "Pérez", "Dirección": "Los Aromos 12", "Teléfono": "555"}
+    mine = {"Familia": "Pérez Soto", "Dirección": "Los Aromos 12", "Teléfono": "777"}
+    theirs = {"Familia": "Pérez", "Dirección": "Las Acacias 3", "Teléfono": "999"}
+    assert merge_changes(base, mine, theirs) == {
+        "Familia": "Pérez Soto", "Dirección": "Las Acacias 3", "Teléfono": "777"}
+    assert merge_changes(base, mine, theirs, keep_theirs=("Teléfono",))["Teléfono"] == "999"